@@ -0,0 +1,92 @@
+import math
+
+# Sampled estimates of the rate analytics, for a quick first look at very
+# large stops tables: the dashboard shows the estimate at once and swaps in
+# the exact result when it lands (see CheckPostAnalytics.run_progressive).
+# Each query runs over a sample of stops (TABLESAMPLE; see
+# backends.sample_clause) and returns per group the raw counts behind the
+# rate: `hits` of `n` sampled stops. estimate() turns them into the exact
+# method's columns plus a 95% confidence interval and the sample size.
+# 'rate' is the exact method's rate column, rows come ordered by it (DESC).
+APPROXIMATE_QUERIES = {
+    'get_highest_arrest_rate_by_age_group': {
+        'query': """
+        SELECT
+            d.age_group,
+            COUNT(CASE WHEN s.is_arrested = TRUE THEN 1 END) AS hits,
+            COUNT(*) AS n
+        FROM drivers d
+        JOIN stops s ON d.vehicle_number = s.vehicle_number
+        GROUP BY d.age_group;
+        """,
+        'rate': 'arrest_rate',
+    },
+    'get_race_gender_highest_search_rate': {
+        'query': """
+        SELECT
+            d.driver_race,
+            d.driver_gender,
+            COUNT(CASE WHEN s.search_conducted = TRUE THEN 1 END) AS hits,
+            COUNT(*) AS n
+        FROM drivers d
+        JOIN stops s ON d.vehicle_number = s.vehicle_number
+        GROUP BY d.driver_race, d.driver_gender;
+        """,
+        'rate': 'search_rate_percent',
+    },
+    'get_arrest_rate_by_country_violation': {
+        'query': """
+        SELECT
+            s.country_name,
+            v.violation,
+            COUNT(CASE WHEN s.is_arrested = TRUE THEN 1 END) AS hits,
+            COUNT(*) AS n
+        FROM stops s
+        JOIN violations v ON s.vehicle_number = v.vehicle_number
+        GROUP BY s.country_name, v.violation;
+        """,
+        'rate': 'arrest_rate_percent',
+    },
+}
+
+# Stops to aim for in a sample: enough for intervals of a few points on the
+# smaller groups, little enough to answer in well under a second.
+TARGET_SAMPLE_ROWS = 200_000
+MIN_SAMPLE_PERCENT = 0.01
+Z_95 = 1.96
+
+
+def sample_percent(total_rows, target_rows=TARGET_SAMPLE_ROWS):
+    # Share of stops to sample; 100 (no sampling) for small tables.
+    if total_rows <= target_rows:
+        return 100.0
+    return round(max(MIN_SAMPLE_PERCENT, 100.0 * target_rows / total_rows), 4)
+
+
+def wilson_interval(hits, n, z=Z_95):
+    # Wilson score interval of hits / n, in percent. Unlike the normal
+    # approximation it stays inside 0-100 and behaves for rare events and
+    # small groups. TABLESAMPLE SYSTEM samples whole pages, so on data
+    # clustered by page the true interval is somewhat wider.
+    if n == 0:
+        return 0.0, 100.0
+    rate = hits / n
+    centre = (rate + z * z / (2 * n)) / (1 + z * z / n)
+    margin = z * math.sqrt(rate * (1 - rate) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+    return round(max(0.0, centre - margin) * 100, 2), round(min(1.0, centre + margin) * 100, 2)
+
+
+def estimate(name, rows, columns, params):
+    # Sampled (group..., hits, n) rows -> the exact method's columns plus
+    # ci_low_percent, ci_high_percent and sampled_stops, best rate first.
+    rate = APPROXIMATE_QUERIES[name]['rate']
+    groups = columns[:-2]
+    estimated = []
+    for row in rows:
+        *group, hits, n = row
+        low, high = wilson_interval(hits, n)
+        estimated.append((*group, round(hits / n * 100, 2), low, high, n))
+    estimated.sort(key=lambda row: row[len(groups)], reverse=True)
+    if params.get('limit') is not None:
+        estimated = estimated[:params['limit']]
+    return estimated, groups + [rate, 'ci_low_percent', 'ci_high_percent', 'sampled_stops']
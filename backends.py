@@ -0,0 +1,191 @@
+import re
+import sqlite3
+from contextlib import contextmanager
+from datetime import date, datetime, time
+
+import pandas as pd
+
+try:
+    import duckdb
+except ImportError:  # only needed for backend='duckdb'
+    duckdb = None
+
+# Embedded alternatives to PostgreSQL for CheckPostAnalytics and traffic_stops:
+# a DuckDB or SQLite file, for laptops, disconnected check posts and quick
+# checks. The code keeps writing PostgreSQL SQL with psycopg2 placeholders;
+# EmbeddedCursor translates each statement to the backend's dialect.
+BACKENDS = ['postgres', 'duckdb', 'sqlite']
+EMBEDDED_BACKENDS = ['duckdb', 'sqlite']
+
+EXTRACT_FORMATS = {'YEAR': '%Y', 'MONTH': '%m', 'DAY': '%d', 'HOUR': '%H', 'MINUTE': '%M'}
+
+
+def connect(backend, path):
+    if backend == 'duckdb':
+        if duckdb is None:
+            raise RuntimeError("backend='duckdb' needs the duckdb package")
+        return duckdb.connect(path)
+    if backend == 'sqlite':
+        # isolation_level=None: autocommit, like the psycopg2 connections;
+        # transactions are opened explicitly (see embedded_transaction()).
+        return sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    raise ValueError(f"Unknown embedded backend: {backend}")
+
+
+def supports_grouping_sets(backend):
+    return backend != 'sqlite'
+
+
+def sample_clause(backend, percent):
+    # (after the table name, extra WHERE condition) reading ~percent% of a
+    # table's rows. DuckDB's system sampling works on whole row groups, too
+    # coarse for tables below a few million rows, so it samples rows.
+    if backend == 'postgres':
+        return f"TABLESAMPLE SYSTEM ({percent})", None
+    if backend == 'duckdb':
+        return f"TABLESAMPLE {percent}% (bernoulli)", None
+    return "", f"abs(random()) % 1000000 < {round(percent * 10000)}"
+
+
+def table_qualifier(backend):
+    # Prefix naming a real table where a CTE of the same name is in scope
+    # (see filters.apply_filters). SQLite lets a CTE see its later siblings;
+    # both embedded backends keep their tables in schema main.
+    return 'main.' if backend in EMBEDDED_BACKENDS else ''
+
+
+def bind(query, params):
+    # psycopg2 %s placeholders -> qmark. "= ANY(%s)" with a list becomes
+    # IN (?, ?, ...), which both backends understand.
+    parts = query.replace('%%', '\0').split('%s')
+    text, values = parts[0], []
+    for part, value in zip(parts[1:], params):
+        if isinstance(value, (list, tuple)):
+            any_call = re.search(r"=\s*ANY\(\s*$", text)
+            text = text[:any_call.start()] + f"IN ({', '.join('?' * len(value)) or 'NULL'}"
+            values.extend(value)
+        else:
+            text += '?'
+            values.append(value)
+        text += part
+    return text.replace('\0', '%'), values
+
+
+def translate(query, backend):
+    # PostgreSQL-only syntax used by this code base, rewritten per backend.
+    query = re.sub(r"\bTIMESTAMPTZ\b", "TIMESTAMP", query)
+    query = re.sub(r"\bnow\(\)", "CURRENT_TIMESTAMP", query)
+    if backend == 'duckdb':
+        # DuckDB can't cascade and re-checks foreign keys on every upsert;
+        # referential integrity comes from loading parents first.
+        query = re.sub(r",\s*FOREIGN KEY \([^)]*\) REFERENCES \w+\s*\([^)]*\)(?: ON DELETE CASCADE)?", "", query)
+        query = re.sub(r"\s+REFERENCES \w+\s*\([^)]*\)", "", query)
+        # DuckDB's NUMERIC is DECIMAL(18,3): ROUND(x::NUMERIC, 2) would round
+        # twice. Keep PostgreSQL's float8 -> numeric precision instead.
+        query = re.sub(r"::NUMERIC\b", "::DECIMAL(38, 15)", query)
+        return query
+    query = re.sub(r"EXTRACT\((\w+) FROM ([^)]+)\)",
+                   lambda match: f"CAST(strftime('{EXTRACT_FORMATS[match.group(1).upper()]}', {match.group(2)}) AS INTEGER)",
+                   query)
+    query = re.sub(r"::FLOAT\b", " * 1.0", query)
+    query = re.sub(r"::(?:NUMERIC|INT|TEXT)\b", "", query)
+    query = re.sub(r"GREATEST\(([^(),]+),\s*([^(),]+)\)", r"MAX(COALESCE(\1, \2), COALESCE(\2, \1))", query)
+    return query
+
+
+def adapt(value, backend):
+    # SQLite stores dates and times as ISO text.
+    if backend == 'sqlite' and isinstance(value, (date, datetime, time)):
+        return value.isoformat()
+    return value
+
+
+class EmbeddedCursor:
+    # The subset of the psycopg2 cursor interface this code base uses.
+    def __init__(self, connection, backend):
+        self.connection = connection
+        self.backend = backend
+        self.cursor = connection.cursor()
+
+    def execute(self, query, params=None):
+        if params is not None:
+            query, params = bind(query, params)
+            params = [adapt(value, self.backend) for value in params]
+        self.cursor.execute(translate(query, self.backend), params or [])
+        return self
+
+    def executemany(self, query, rows):
+        query, _ = bind(query, [None] * query.count('%s'))
+        self.cursor.executemany(translate(query, self.backend),
+                                [[adapt(value, self.backend) for value in row] for row in rows])
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    def insert_frame(self, table, df, replace=False):
+        # Bulk load in place of COPY. DuckDB scans the DataFrame directly
+        # (columnar, vectorized); SQLite gets one executemany.
+        verb = "INSERT OR REPLACE" if replace else "INSERT"
+        columns = ", ".join(df.columns)
+        if self.backend == 'duckdb':
+            self.cursor.register('frame', df)
+            try:
+                self.cursor.execute(f"{verb} INTO {table} ({columns}) SELECT {columns} FROM frame")
+            finally:
+                self.cursor.unregister('frame')
+            return len(df)
+        rows = df.astype(object).where(df.notna(), None)
+        for column in df.columns:
+            if pd.api.types.is_datetime64_any_dtype(df[column]):
+                rows[column] = df[column].dt.strftime('%Y-%m-%d').astype(object).where(df[column].notna(), None)
+        # One transaction for the whole frame, not one commit per row.
+        with embedded_transaction(self, not self.connection.in_transaction):
+            self.cursor.executemany(f"{verb} INTO {table} ({columns}) VALUES ({', '.join('?' * len(df.columns))})",
+                                    [[adapt(value, self.backend) for value in row]
+                                     for row in rows.itertuples(index=False, name=None)])
+        return len(df)
+
+    def close(self):
+        self.cursor.close()
+
+
+@contextmanager
+def transaction_scope(connection, transaction):
+    if not transaction:
+        yield
+        return
+    connection.autocommit = False
+    try:
+        yield
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.autocommit = True
+
+
+@contextmanager
+def embedded_transaction(mediator, transaction):
+    # transaction_scope() for embedded connections.
+    if not transaction:
+        yield
+        return
+    mediator.execute("BEGIN")
+    try:
+        yield
+        mediator.execute("COMMIT")
+    except Exception:
+        mediator.execute("ROLLBACK")
+        raise
@@ -0,0 +1,193 @@
+import argparse
+import json
+import os
+import platform
+import time
+from datetime import date, datetime
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+from generator import generate
+from main_check import traffic_stops
+from sql import ANALYTIC_METHODS, CheckPostAnalytics
+
+HOST = "localhost"
+PORT = 5432
+USER = "postgres"
+PASSWORD = "vGpostgre"
+DATABASE = "traffic_stops_bench"
+
+DEFAULT_SIZES = [10_000, 1_000_000, 10_000_000]
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def reset_database():
+    admin = psycopg2.connect(host=HOST, port=PORT, user=USER, password=PASSWORD, database="postgres")
+    admin.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+    with admin.cursor() as mediator:
+        mediator.execute(f"DROP DATABASE IF EXISTS {DATABASE} WITH (FORCE);")
+        mediator.execute(f"CREATE DATABASE {DATABASE};")
+    admin.close()
+
+
+def bench_load(csv_path, rows):
+    app = traffic_stops(HOST, PORT, USER, PASSWORD, DATABASE)
+    app.create_tables()
+    app.insert_sample_officers()
+
+    start = time.perf_counter()
+    app.load_streaming(csv_path)
+    load_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    app.create_indexes()
+    index_seconds = time.perf_counter() - start
+    app.close()
+    return {
+        'seconds': load_seconds,
+        'rows_per_sec': rows / load_seconds,
+        'index_seconds': index_seconds,
+    }
+
+
+def bench_queries(analytics, repeats):
+    results = {}
+    for method_name in ANALYTIC_METHODS:
+        method = getattr(analytics, method_name)
+        method()  # warm up
+        samples = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            rows, _ = method()
+            samples.append((time.perf_counter() - start) * 1000)
+        results[method_name] = {
+            'p50_ms': percentile(samples, 50),
+            'p95_ms': percentile(samples, 95),
+            'rows': len(rows),
+        }
+        print(f"  {method_name:<45} p50={results[method_name]['p50_ms']:>9.2f} ms  "
+              f"p95={results[method_name]['p95_ms']:>9.2f} ms")
+    return results
+
+
+def bench_inserts(analytics, count, prefix):
+    # One row per call, the way the New Entry form writes.
+    numbers = [f"{prefix}{i:08d}" for i in range(count)]
+    results = {}
+
+    start = time.perf_counter()
+    for number in numbers:
+        analytics.insert_driver_data(number, 'M', 30, 'Adult', 'Other')
+    results['insert_driver_data'] = {'rows_per_sec': count / (time.perf_counter() - start)}
+
+    start = time.perf_counter()
+    for number in numbers:
+        analytics.insert_stop_data(number, date(2024, 1, 1), datetime.now().time(), '0-15 Min',
+                                   'India', False, False, False, 'Warning', 'A2')
+    results['insert_stop_data'] = {'rows_per_sec': count / (time.perf_counter() - start)}
+
+    start = time.perf_counter()
+    for number in numbers:
+        analytics.insert_violation_data(number, 'Speeding', 'Speeding')
+    results['insert_violation_data'] = {'rows_per_sec': count / (time.perf_counter() - start)}
+
+    start = time.perf_counter()
+    for i in range(count):
+        analytics.submit_stop(f"{prefix}S{i:07d}", 'M', 30, 'Adult', 'Other', date(2024, 1, 1),
+                              datetime.now().time(), '0-15 Min', 'India', False, False, False,
+                              'Warning', 'A2', 'Speeding', 'Speeding')
+    results['submit_stop'] = {'rows_per_sec': count / (time.perf_counter() - start)}
+
+    for name, result in results.items():
+        print(f"  {name:<45} {result['rows_per_sec']:>9.0f} rows/sec")
+    return results
+
+
+def flatten(results):
+    # {'10000': {'queries': {'get_x': {'p50_ms': ...}}}} -> {'10000 get_x.p50_ms': ...}
+    flat = {}
+    for size, sections in results.items():
+        for section, entries in sections.items():
+            if section == 'load':
+                entries = {'load': entries}
+            for name, metrics in entries.items():
+                for metric, value in metrics.items():
+                    flat[f"{size} {name}.{metric}"] = value
+    return flat
+
+
+def compare(current, baseline, threshold):
+    # Latencies regress when they grow, throughputs when they shrink.
+    regressions = []
+    old_metrics = flatten(baseline)
+    for key, value in flatten(current).items():
+        old = old_metrics.get(key)
+        if not old or key.endswith('.rows'):
+            continue
+        if key.endswith('_ms') or key.endswith('seconds'):
+            change = value / old - 1
+        else:
+            change = 1 - value / old
+        if change > threshold:
+            regressions.append(f"{key}: {old:.2f} -> {value:.2f} ({change:+.0%} worse)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark loading, analytics and inserts at scaled data sizes.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--repeats', type=int, default=10, help="Timed runs per analytics query")
+    parser.add_argument('--inserts', type=int, default=500, help="Rows written per insert_* method")
+    parser.add_argument('--data-dir', default='bench_data', help="Where generated CSVs are kept between runs")
+    parser.add_argument('--baseline', default='bench_baseline.json')
+    parser.add_argument('--save-baseline', action='store_true', help="Overwrite the baseline with this run")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="Fail when a metric is this fraction worse than the baseline")
+    args = parser.parse_args()
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    results = {}
+    for size in args.sizes:
+        print(f"=== {size:,} stops ===")
+        csv_path = os.path.join(args.data_dir, f"stops_{size}.csv")
+        if not os.path.exists(csv_path):
+            generate(csv_path, size)
+
+        reset_database()
+        load = bench_load(csv_path, size)
+        print(f"  load: {load['rows_per_sec']:,.0f} rows/sec ({load['seconds']:.1f}s)")
+
+        analytics = CheckPostAnalytics(HOST, PORT, USER, PASSWORD, DATABASE)
+        results[str(size)] = {
+            'load': load,
+            'queries': bench_queries(analytics, args.repeats),
+            'inserts': bench_inserts(analytics, args.inserts, prefix='BI'),
+        }
+        analytics.close()
+
+    if args.save_baseline or not os.path.exists(args.baseline):
+        with open(args.baseline, 'w') as f:
+            json.dump({'machine': platform.node(), 'recorded_at': datetime.now().isoformat(),
+                       'results': results}, f, indent=2)
+        print(f"Baseline written to {args.baseline}.")
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)['results']
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} regressions over {args.threshold:.0%}:")
+        for regression in regressions:
+            print(f"  {regression}")
+        raise SystemExit(1)
+    print("No regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+
+SIZE_SAMPLE = 8
+
+
+def estimate_size(value):
+    # Rough in-memory footprint of a (rows, columns) result. Longer sequences
+    # (the rows) are sized from a few evenly spaced items, scaled up, so
+    # sizing a large result doesn't walk every cell.
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)) and value:
+        step = max(1, len(value) // SIZE_SAMPLE)
+        sampled = value[::step][:SIZE_SAMPLE]
+        size += sum(estimate_size(item) for item in sampled) * len(value) // len(sampled)
+    return size
+
+
+class QueryCache:
+    def __init__(self, max_bytes=64 * 1024 * 1024, default_ttl=300):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.entries = OrderedDict()  # key -> (expires_at, size, value), oldest first
+        self.size = 0
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[2]
+
+    def put(self, key, value, ttl=None, generation=None):
+        size = estimate_size(value)
+        with self.lock:
+            # A write landed while this result was being computed; it may be stale.
+            if generation is not None and generation != self.generation:
+                return
+            if size > self.max_bytes:
+                return
+            if key in self.entries:
+                self._drop(key)
+            ttl = self.default_ttl if ttl is None else ttl
+            self.entries[key] = (time.monotonic() + ttl, size, value)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            self.generation += 1
+            self.invalidations += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+    def _drop(self, key):
+        _, size, _ = self.entries.pop(key)
+        self.size -= size
+
+
+def cache_key(name, args=(), kwargs=None):
+    # The key @cached stores a method call's result under.
+    return (name, args, tuple(sorted((kwargs or {}).items())))
+
+
+def cached(ttl=None, key=None):
+    # Caches a CheckPostAnalytics method on self.cache, keyed by method name + arguments.
+    # `key(args, kwargs)` may normalize the arguments first, returning (args, kwargs),
+    # so that calls meaning the same thing share an entry.
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self.cache is None:
+                return method(self, *args, **kwargs)
+
+            entry = cache_key(method.__name__, *(key(args, kwargs) if key else (args, kwargs)))
+            found, value = self.cache.get(entry)
+            if found:
+                return value
+
+            generation = self.cache.generation
+            value = method(self, *args, **kwargs)
+            self.cache.put(entry, value, ttl, generation)
+            return value
+        return wrapper
+    return decorator
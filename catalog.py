@@ -0,0 +1,329 @@
+import re
+from datetime import date
+
+from filters import split_filters
+
+# The Deep Dive analytics, defined once. Each entry becomes a CheckPostAnalytics
+# method of the same name (see sql.catalog_method) and a dashboard query (see
+# dashboard_queries). An entry either has a 'query' with %(name)s placeholders
+# for its 'params', or names a materialized 'view' (see views.py) served by
+# run_aggregate. 'params' maps each parameter to (type, default), in
+# positional order; 'ttl' is the result cache TTL (None: the cache default).
+# Every method also takes the global filters (filters.py) as keywords.
+# A new analytic is a new entry here.
+QUERY_CATALOG = {
+    'get_top_10_drug_related_vehicles': {
+        'category': "🚗 Vehicle-Based",
+        'label': "Top 10 Drug-Related Vehicles",
+        'params': {'limit': (int, 10)},
+        'query': """
+        SELECT vehicle_number
+        FROM stops
+        WHERE drugs_related_stop = TRUE
+        LIMIT %(limit)s;
+        """,
+    },
+    'get_most_searched_vehicles': {
+        'category': "🚗 Vehicle-Based",
+        'label': "Most Frequently Searched Vehicles",
+        'params': {'limit': (int, 1)},
+        'query': """
+        SELECT vehicle_number, COUNT(*) AS search_count
+        FROM stops
+        WHERE search_conducted = TRUE
+        GROUP BY vehicle_number
+        ORDER BY search_count DESC
+        LIMIT %(limit)s;
+        """,
+    },
+    'get_highest_arrest_rate_by_age_group': {
+        'category': "🢍 Demographic-Based",
+        'label': "Highest Arrest Rate by Age Group",
+        'params': {'limit': (int, 1)},
+        'query': """
+        SELECT
+            d.age_group,
+            ROUND(
+                (COUNT(CASE WHEN s.is_arrested = TRUE THEN 1 END)::FLOAT / COUNT(*) * 100)::NUMERIC,
+                2
+            ) AS arrest_rate
+        FROM drivers d
+        JOIN stops s ON d.vehicle_number = s.vehicle_number
+        GROUP BY d.age_group
+        ORDER BY arrest_rate DESC
+        LIMIT %(limit)s;
+        """,
+    },
+    'get_gender_distribution_by_country': {
+        'category': "🢍 Demographic-Based",
+        'label': "Gender Distribution by Country",
+        'view': 'mv_gender_distribution_by_country',
+        'ttl': 900,
+    },
+    'get_race_gender_highest_search_rate': {
+        'category': "🢍 Demographic-Based",
+        'label': "Race & Gender with Highest Search Rate",
+        'params': {'limit': (int, 1)},
+        'query': """
+        SELECT
+            d.driver_race,
+            d.driver_gender,
+            ROUND((
+                COUNT(CASE WHEN s.search_conducted = TRUE THEN 1 END)::FLOAT
+                / COUNT(*) * 100)::NUMERIC, 2
+            ) AS search_rate_percent
+        FROM drivers d
+        JOIN stops s ON d.vehicle_number = s.vehicle_number
+        GROUP BY d.driver_race, d.driver_gender
+        ORDER BY search_rate_percent DESC
+        LIMIT %(limit)s;
+        """,
+    },
+    'get_peak_traffic_stop_time': {
+        'category': "🕒 Time-Based",
+        'label': "Peak Traffic Stop Times",
+        'params': {'limit': (int, 1)},
+        'query': """
+        SELECT
+            CASE
+                WHEN EXTRACT(HOUR FROM stop_time) BETWEEN 5 AND 11 THEN 'Morning'
+                WHEN EXTRACT(HOUR FROM stop_time) BETWEEN 12 AND 16 THEN 'Afternoon'
+                WHEN EXTRACT(HOUR FROM stop_time) BETWEEN 17 AND 20 THEN 'Evening'
+                ELSE 'Night'
+            END AS time_of_day,
+            COUNT(*) AS total_stops
+        FROM stops
+        GROUP BY time_of_day
+        ORDER BY total_stops DESC
+        LIMIT %(limit)s;
+        """,
+    },
+    'get_average_stop_duration_by_violation': {
+        'category': "🕒 Time-Based",
+        'label': "Average Stop Duration by Violation",
+        'view': 'mv_average_stop_duration_by_violation',
+        'ttl': 900,
+    },
+    'get_arrest_rate_by_time_of_day': {
+        'category': "🕒 Time-Based",
+        'label': "Are Night Stops More Arrest-Prone?",
+        'query': """
+        SELECT
+            CASE
+                WHEN EXTRACT(HOUR FROM stop_time) BETWEEN 5 AND 11 THEN 'Morning'
+                WHEN EXTRACT(HOUR FROM stop_time) BETWEEN 12 AND 16 THEN 'Afternoon'
+                WHEN EXTRACT(HOUR FROM stop_time) BETWEEN 17 AND 20 THEN 'Evening'
+                ELSE 'Night'
+            END AS time_of_day,
+            COUNT(*) AS total_stops,
+            COUNT(CASE WHEN is_arrested = TRUE THEN 1 END) AS total_arrests,
+            ROUND(
+                (COUNT(CASE WHEN is_arrested = TRUE THEN 1 END)::FLOAT / COUNT(*) * 100)::NUMERIC,
+                2
+            ) AS arrest_rate_percent
+        FROM stops
+        GROUP BY time_of_day
+        ORDER BY arrest_rate_percent DESC;
+        """,
+    },
+    'get_violation_search_arrest_stats': {
+        'category': "⚖️ Violation-Based",
+        'label': "Violations with Most Searches/Arrests",
+        'query': """
+        SELECT
+            v.violation,
+            COUNT(*) AS incident_count
+        FROM violations v
+        JOIN stops s ON s.vehicle_number = v.vehicle_number
+        WHERE s.search_conducted = TRUE OR s.is_arrested = TRUE
+        GROUP BY v.violation
+        ORDER BY incident_count DESC;
+        """,
+    },
+    'get_common_violations_under_25': {
+        'category': "⚖️ Violation-Based",
+        'label': "Violations Common < Age 25",
+        'params': {'max_age': (int, 25)},
+        'query': """
+        SELECT
+            v.violation,
+            COUNT(*) AS violation_count
+        FROM violations v
+        JOIN drivers d ON d.vehicle_number = v.vehicle_number
+        WHERE d.driver_age < %(max_age)s
+        GROUP BY v.violation
+        ORDER BY violation_count DESC;
+        """,
+    },
+    'get_rarely_flagged_violations': {
+        'category': "⚖️ Violation-Based",
+        'label': "Violations Rarely Leading to Arrest",
+        'params': {'limit': (int, 1)},
+        'query': """
+        SELECT
+            v.violation,
+            COUNT(CASE WHEN s.search_conducted = TRUE OR s.is_arrested = TRUE THEN 1 END) AS search_or_arrest_count
+        FROM violations v
+        JOIN stops s ON v.vehicle_number = s.vehicle_number
+        GROUP BY v.violation
+        ORDER BY search_or_arrest_count ASC
+        LIMIT %(limit)s;
+        """,
+    },
+    'get_country_with_highest_drug_related_rate': {
+        'category': "🌍 Location-Based",
+        'label': "Countries with Highest Drug Stop Rates",
+        'params': {'limit': (int, 1)},
+        'query': """
+        SELECT
+            country_name,
+            COUNT(*) AS total_stops,
+            COUNT(CASE WHEN drugs_related_stop = TRUE THEN 1 END) AS drug_related_count,
+            ROUND(
+                (COUNT(CASE WHEN drugs_related_stop = TRUE THEN 1 END)::FLOAT
+                / COUNT(*) * 100)::NUMERIC, 2
+            ) AS drug_related_rate_percent
+        FROM stops
+        GROUP BY country_name
+        ORDER BY drug_related_rate_percent DESC
+        LIMIT %(limit)s;
+        """,
+    },
+    'get_arrest_rate_by_country_violation': {
+        'category': "🌍 Location-Based",
+        'label': "Arrest Rate by Country & Violation",
+        'view': 'mv_arrest_rate_by_country_violation',
+        'ttl': 900,
+    },
+    'get_country_with_most_search_stops': {
+        'category': "🌍 Location-Based",
+        'label': "Country with Most Searches",
+        'params': {'limit': (int, 1)},
+        'query': """
+        SELECT
+            country_name,
+            COUNT(*) AS search_conducted_count
+        FROM stops
+        WHERE search_conducted = TRUE
+        GROUP BY country_name
+        ORDER BY search_conducted_count DESC
+        LIMIT %(limit)s;
+        """,
+    },
+    'get_yearly_stops_arrests_by_country': {
+        'category': "🧠 Complex Analytics",
+        'label': "Yearly Stops & Arrests by Country",
+        'view': 'mv_yearly_stops_arrests_by_country',
+        'ttl': 900,
+    },
+    'get_violation_trends_by_age_race': {
+        'category': "🧠 Complex Analytics",
+        'label': "Violation Trends by Age & Race",
+        'view': 'mv_violation_trends_by_age_race',
+        'ttl': 900,
+    },
+    'get_time_period_analysis_of_stops': {
+        'category': "🧠 Complex Analytics",
+        'label': "Time Period Stop Patterns",
+        'view': 'mv_time_period_analysis_of_stops',
+        'ttl': 900,
+    },
+    'get_high_search_arrest_violations': {
+        'category': "🧠 Complex Analytics",
+        'label': "High Search+Arrest Violations",
+        'view': 'mv_high_search_arrest_violations',
+        'ttl': 900,
+    },
+    'get_driver_demographics_by_country': {
+        'category': "🧠 Complex Analytics",
+        'label': "Driver Demographics by Country",
+        'view': 'mv_driver_demographics_by_country',
+        'ttl': 900,
+    },
+    'get_top_5_highest_arrest_violations': {
+        'category': "🧠 Complex Analytics",
+        'label': "Top 5 Arrest-Prone Violations",
+        'params': {'limit': (int, 5), 'min_stops': (int, 1)},
+        'query': """
+        SELECT
+            v.violation,
+            COUNT(*) AS total_stops,
+            COUNT(CASE WHEN s.is_arrested = TRUE THEN 1 END) AS total_arrests,
+            ROUND(
+                (COUNT(CASE WHEN s.is_arrested = TRUE THEN 1 END)::FLOAT
+                / COUNT(*) * 100)::NUMERIC, 2
+            ) AS arrest_rate_percent
+        FROM violations v
+        JOIN stops s ON v.vehicle_number = s.vehicle_number
+        GROUP BY v.violation
+        HAVING COUNT(*) >= %(min_stops)s
+        ORDER BY arrest_rate_percent DESC
+        LIMIT %(limit)s;
+        """,
+    },
+}
+
+# The Deep Dive analytics, in dashboard order. Tools that sweep the whole
+# workload (plan checks, benchmarks) iterate over this list.
+ANALYTIC_METHODS = list(QUERY_CATALOG)
+
+# Parameter types of PREPARE statements.
+SQL_TYPES = {int: 'bigint', float: 'double precision', str: 'text', date: 'date'}
+
+PLACEHOLDER = re.compile(r"%\((\w+)\)s")
+
+
+def bind_params(name, args, kwargs):
+    # Positional and keyword arguments -> {param: value}, with defaults filled
+    # in and values coerced to the declared type.
+    params = QUERY_CATALOG[name].get('params', {})
+    if len(args) > len(params):
+        raise TypeError(f"{name}() takes {len(params)} arguments, {len(args)} given")
+    unknown = set(kwargs) - set(params)
+    if unknown:
+        raise TypeError(f"{name}() got unexpected arguments: {', '.join(sorted(unknown))}")
+    values = dict(zip(params, args), **kwargs)
+    bound = {}
+    for param, (kind, default) in params.items():
+        value = values.get(param, default)
+        if value is not None and not isinstance(value, kind):
+            value = date.fromisoformat(value) if kind is date else kind(value)
+        bound[param] = value
+    return bound
+
+
+def canonical_arguments(name, args, kwargs):
+    # A call's arguments as its cache key sees them: parameters at their
+    # default are dropped and filters normalized, so m(), m(1) and m(limit=1)
+    # share the entry run_shared_scan fills for m().
+    filters, kwargs = split_filters(kwargs)
+    defaults = QUERY_CATALOG[name].get('params', {})
+    params = {param: value for param, value in bind_params(name, args, kwargs).items()
+              if value != defaults[param][1]}
+    return (), dict(params, **filters)
+
+
+def positional(query):
+    # %(name)s placeholders -> %s plus the parameter names in order.
+    return PLACEHOLDER.sub('%s', query), PLACEHOLDER.findall(query)
+
+
+def numbered(query):
+    # %(name)s placeholders -> $1, $2 ... for PREPARE; a name used twice keeps
+    # its number.
+    names = []
+
+    def number(match):
+        if match.group(1) not in names:
+            names.append(match.group(1))
+        return f"${names.index(match.group(1)) + 1}"
+
+    return PLACEHOLDER.sub(number, query), names
+
+
+def dashboard_queries(analytics):
+    # {category: {label: bound method}} for the dashboard, in catalog order.
+    categories = {}
+    for name, entry in QUERY_CATALOG.items():
+        categories.setdefault(entry['category'], {})[entry['label']] = getattr(analytics, name)
+    return categories
@@ -0,0 +1,188 @@
+import argparse
+import os
+import time
+from datetime import date, datetime, time as time_of_day
+from decimal import Decimal
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+from backends import BACKENDS, duckdb
+from benchmark import percentile
+from generator import generate
+from main_check import traffic_stops
+from shared_scan import SHARED_SCAN_METHODS
+from sql import ANALYTIC_METHODS, CheckPostAnalytics
+
+HOST = "localhost"
+PORT = 5432
+USER = "postgres"
+PASSWORD = "vGpostgre"
+DATABASE = "traffic_stops_conformance"
+REPEATED_VEHICLES = 1_000
+
+
+def reset_database(backend, path):
+    if backend != 'postgres':
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    admin = psycopg2.connect(host=HOST, port=PORT, user=USER, password=PASSWORD, database="postgres")
+    admin.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+    with admin.cursor() as mediator:
+        mediator.execute(f"DROP DATABASE IF EXISTS {DATABASE} WITH (FORCE);")
+        mediator.execute(f"CREATE DATABASE {DATABASE};")
+    admin.close()
+
+
+def load(backend, database, csv_path):
+    app = traffic_stops(HOST, PORT, USER, PASSWORD, database, backend)
+    app.create_tables()
+    app.insert_sample_officers()
+    start = time.perf_counter()
+    app.load_streaming(csv_path)
+    app.create_indexes()
+    seconds = time.perf_counter() - start
+    app.close()
+    return seconds
+
+
+def normalize(value):
+    # Backends disagree on types, not values: NUMERIC vs DOUBLE, BOOLEAN vs
+    # 0/1, DATE vs ISO text.
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (Decimal, float)):
+        return round(float(value), 2)
+    if isinstance(value, (date, datetime, time_of_day)):
+        return value.isoformat()
+    return value
+
+
+def normalized_rows(result):
+    if isinstance(result, dict):
+        # get_overview_summary: one row per metric and per histogram bar.
+        result = [(key, *item) for key, value in result.items()
+                  for item in (value if isinstance(value, list) else [(value,)])]
+    else:
+        result = result[0]
+    return [tuple(normalize(value) for value in row) if isinstance(row, (list, tuple)) else normalize(row)
+            for row in result]
+
+
+def measures(rows):
+    # Numeric part of each row: equal measures with different labels means
+    # the backends broke a tie (LIMIT over equal counts/rates) differently.
+    return sorted(repr(tuple(value for value in (row if isinstance(row, tuple) else (row,))
+                             if isinstance(value, (int, float)))) for row in rows)
+
+
+def compare(reference, other):
+    if reference == other:
+        return 'same'
+    if sorted(map(repr, reference)) == sorted(map(repr, other)):
+        return 'same rows, order differs'
+    if len(reference) == len(other) and measures(reference) == measures(other):
+        return 'same up to ties'
+    return 'DIFFERENT'
+
+
+def run_methods(analytics, repeats):
+    results = {}
+    for method_name in ANALYTIC_METHODS + ['get_overview_summary']:
+        method = getattr(analytics, method_name)
+        samples = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            result = method()
+            samples.append((time.perf_counter() - start) * 1000)
+        results[method_name] = {'rows': normalized_rows(result), 'p50_ms': percentile(samples, 50)}
+    return results
+
+
+def make_repeated_copy(source, path):
+    # Copy of a loaded DuckDB file where REPEATED_VEHICLES vehicles have a
+    # second stop a year later, as the partitioned schema allows. The
+    # generator never repeats a vehicle, so the main run can't catch
+    # per-stop double counting of drivers or violations.
+    if os.path.exists(path):
+        os.remove(path)
+    connection = duckdb.connect(path)
+    connection.execute(f"ATTACH '{source}' AS source (READ_ONLY);")
+    for table in ('drivers', 'stops', 'violations'):
+        connection.execute(f"CREATE TABLE {table} AS SELECT * FROM source.{table};")
+    connection.execute(f"""
+        INSERT INTO stops
+        SELECT * REPLACE (CAST(stop_date + INTERVAL 1 YEAR AS DATE) AS stop_date)
+        FROM source.stops ORDER BY vehicle_number LIMIT {REPEATED_VEHICLES};
+    """)
+    connection.close()
+
+
+def check_repeated_vehicles(path):
+    # The shared scan has to give each method the same answer as its own
+    # query when vehicles repeat. Returns the number of mismatches.
+    analytics = CheckPostAnalytics(HOST, PORT, USER, PASSWORD, path, backend='duckdb')
+    scan = analytics.run_shared_scan()
+    failures = 0
+    print(f"\nShared scan vs own queries, {REPEATED_VEHICLES:,} vehicles with a second stop:")
+    for method_name in SHARED_SCAN_METHODS:
+        if method_name == 'get_overview_summary':
+            own = analytics.get_overview_summary_separately()
+        else:
+            own = getattr(analytics, method_name)()
+        status = compare(normalized_rows(own), normalized_rows(scan[method_name]))
+        failures += status == 'DIFFERENT'
+        print(f"{method_name:<45}  {status}")
+    analytics.close()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run every analytics method on several backends; compare results and latency.")
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=['duckdb', 'sqlite'],
+                        help="The first one is the reference")
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--data-dir', default='bench_data', help="Where generated CSVs are kept between runs")
+    args = parser.parse_args()
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    csv_path = os.path.join(args.data_dir, f"stops_{args.rows}.csv")
+    if not os.path.exists(csv_path):
+        generate(csv_path, args.rows)
+
+    results = {}
+    for backend in args.backends:
+        database = DATABASE if backend == 'postgres' else os.path.join(args.data_dir, f"conformance.{backend}")
+        reset_database(backend, database)
+        seconds = load(backend, database, csv_path)
+        print(f"{backend}: loaded {args.rows:,} rows in {seconds:.2f}s")
+        analytics = CheckPostAnalytics(HOST, PORT, USER, PASSWORD, database, backend=backend)
+        results[backend] = run_methods(analytics, args.repeats)
+        analytics.close()
+
+    reference, others = args.backends[0], args.backends[1:]
+    print(f"\n{'method':<45}" + "".join(f"{backend:>12}" for backend in args.backends) + "  results vs " + reference)
+    failures = 0
+    for method_name in results[reference]:
+        statuses = [compare(results[reference][method_name]['rows'], results[backend][method_name]['rows'])
+                    for backend in others]
+        failures += statuses.count('DIFFERENT')
+        timings = "".join(f"{results[backend][method_name]['p50_ms']:>9.2f} ms" for backend in args.backends)
+        print(f"{method_name:<45}{timings}  {', '.join(statuses) or '-'}")
+
+    if 'duckdb' in args.backends:
+        repeated = os.path.join(args.data_dir, "conformance_repeated.duckdb")
+        make_repeated_copy(os.path.join(args.data_dir, "conformance.duckdb"), repeated)
+        failures += check_repeated_vehicles(repeated)
+
+    if failures:
+        print(f"{failures} results differ between backends.")
+        raise SystemExit(1)
+    print("All backends agree.")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,14 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 from sql import CheckPostAnalytics
+from approximate import APPROXIMATE_QUERIES
+from catalog import QUERY_CATALOG, dashboard_queries
+from filters import normalize_filters
+from cache import QueryCache
+from metrics import Metrics, MetricsExporter
+from main_check import BATCH_COLUMNS, validate_batch
+from prediction import PredictionEngine, time_of_day
+from snapshot import Snapshot, SnapshotRefresher
 from datetime import datetime
 
 # --------------------------------------
@@ -32,6 +40,21 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
+# --------------------------------------
+# Instrumentation
+# --------------------------------------
+# Timings of every analytics call and dashboard data load, for the admin
+# Performance page and a Prometheus textfile scraped by node_exporter.
+METRICS_FILE = "metrics/secure_check.prom"
+
+@st.cache_resource
+def get_metrics():
+    metrics = Metrics()
+    MetricsExporter(metrics, METRICS_FILE).start()
+    return metrics
+
+metrics = get_metrics()
+
 # --------------------------------------
 # Database Connection
 # --------------------------------------
@@ -42,35 +65,82 @@ def get_analytics_instance():
         port=5432,
         user="postgres",
         password="vGpostgre",
-        database="traffic_stops"
+        database="traffic_stops",
+        pooled=True,
+        minconn=2,
+        maxconn=20,
+        cache=QueryCache(max_bytes=128 * 1024 * 1024, default_ttl=300),
+        materialized_views=True,
+        metrics=metrics
     )
 
 analytics = get_analytics_instance()
 
+# Built from one aggregate query, then updated in place as officers submit
+# new stops here. Stops written elsewhere (CLI ingest, other processes) move
+# the snapshot's change watermark, which rebuilds it.
+@st.cache_resource(max_entries=1)
+def get_prediction_engine(watermark):
+    return PredictionEngine.from_counts(analytics.get_prediction_counts())
+
+# Memory-mapped Arrow snapshot (written by `python main_check.py snapshot`),
+# shared by every dashboard process through the OS page cache. A background
+# thread rewrites it once the database's change watermark has moved and the
+# snapshot is at least 15 minutes old.
+SNAPSHOT_DIR = "snapshot"
+
+@st.cache_resource
+def get_snapshot():
+    snapshot = Snapshot(SNAPSHOT_DIR)
+    SnapshotRefresher(snapshot, analytics.cursor, interval=60).start()
+    return snapshot
+
+snapshot = get_snapshot()
+
 # --------------------------------------
 # Data Loading
 # --------------------------------------
-def load_data():
+# Raw rows are only fetched by the pages that display them, one keyset page at a
+# time, from the snapshot when there is one.
+def load_stops_page(after, page_size, filters, from_snapshot):
     try:
-        tables = ['stops', 'drivers', 'violations']
-        dataframes = {}
-        for table in tables:
-            query = f"SELECT * FROM {table}"
-            analytics.mediator.execute(query)
-            rows = analytics.mediator.fetchall()
-            cols = [desc[0] for desc in analytics.mediator.description]
-            dataframes[table] = pd.DataFrame(rows, columns=cols)
-        return dataframes['stops'], dataframes['drivers'], dataframes['violations']
+        with metrics.measure('dashboard.load_stops_page') as sample:
+            if from_snapshot:
+                df = snapshot.page(after, page_size + 1)
+                sample['rows'], sample['bytes'] = len(df), int(df.memory_usage().sum())
+                return df
+            rows, cols = analytics.get_stops_page(after, page_size + 1, **filters)
+            return pd.DataFrame(rows, columns=cols)
     except Exception as e:
         st.error(f"❌ Error loading police stop data:\n{e}")
-        return pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
-
-stop_data, drivers_data, violations_data = load_data()
+        return pd.DataFrame()
 
 # --------------------------------------
 # Sidebar Navigation
 # --------------------------------------
-page = st.sidebar.radio("📌 Navigation", ['🏠 Overview','📈 Deep Dive', '📝 New Entry + Prediction'])
+pages = ['🏠 Overview','📈 Deep Dive', '📝 New Entry + Prediction']
+if st.session_state.officer_role == 'admin':
+    pages.append('⏱ Performance')
+page = st.sidebar.radio("📌 Navigation", pages)
+
+# --------------------------------------
+# Global Filters
+# --------------------------------------
+# Pushed into every query of the Overview and Deep Dive pages (see filters.py).
+try:
+    filter_options = analytics.get_filter_options()
+except Exception as e:
+    st.sidebar.error(f"❌ Error loading filter options:\n{e}")
+    filter_options = {'countries': [], 'violations': [], 'age_groups': []}
+
+with st.sidebar.expander("🔎 Filters"):
+    date_range = st.date_input("Stop date range", value=())
+    countries = st.multiselect("Country", filter_options['countries'])
+    violations = st.multiselect("Violation", filter_options['violations'])
+    age_groups = st.multiselect("Age group", filter_options['age_groups'])
+start_date, end_date = (tuple(date_range) + (None, None))[:2]
+filters = normalize_filters({'start_date': start_date, 'end_date': end_date, 'countries': countries,
+                             'violations': violations, 'age_groups': age_groups})
 
 # --------------------------------------
 # Overview Page
@@ -82,23 +152,61 @@ if page == '🏠 Overview':
     st.markdown("---")
 
     st.subheader("🗂️ Police Logs Overview")
-    st.dataframe(stop_data, use_container_width=True)
+    page_size = st.selectbox("Rows per page", [25, 50, 100, 250], index=2)
+    # The snapshot sorts vehicle numbers bytewise (COLLATE "C"), the database
+    # by its collation, so page keys from one source don't carry over to the
+    # other: start again from page 1 when the source changes (e.g. when the
+    # first snapshot lands mid-session).
+    from_snapshot = snapshot.available and not filters
+    if st.session_state.get('stops_page_view') != (page_size, filters, from_snapshot):
+        st.session_state.stops_page_view = (page_size, filters, from_snapshot)
+        st.session_state.stops_page_keys = [None]
+    page_keys = st.session_state.stops_page_keys
+
+    page_data = load_stops_page(page_keys[-1], page_size, filters, from_snapshot)
+    has_next = len(page_data) > page_size
+    page_data = page_data.head(page_size)
+    st.dataframe(page_data, use_container_width=True)
+
+    prev_col, info_col, next_col = st.columns([1, 4, 1])
+    with prev_col:
+        if st.button("⬅️ Previous", disabled=len(page_keys) == 1):
+            page_keys.pop()
+            st.rerun()
+    with info_col:
+        st.caption(f"Page {len(page_keys)}")
+    with next_col:
+        if st.button("Next ➡️", disabled=not has_next):
+            last = page_data.iloc[-1]
+            page_keys.append((last['vehicle_number'], last['stop_date']))
+            st.rerun()
+
+    if snapshot.available and not filters:
+        st.caption(f"Snapshot as of {snapshot.written_at}")
+
+    try:
+        with metrics.measure('dashboard.load_summary'):
+            if snapshot.available and not filters:
+                summary = snapshot.summary()
+            else:
+                summary = analytics.get_overview_summary(**filters)
+    except Exception as e:
+        st.error(f"❌ Error loading police stop data:\n{e}")
+        summary = {'total_stops': 0, 'total_arrests': 0, 'total_warnings': 0,
+                   'drug_related_stops': 0, 'violations': [], 'genders': []}
 
     # Key Metrics
     st.header("📊 KEY METRICS")
     col1, col2, col3, col4 = st.columns(4)
 
     with col1:
-        st.metric("Total Police Stops", stop_data.shape[0])
+        st.metric("Total Police Stops", summary['total_stops'])
     with col2:
-        arrests = stop_data[stop_data['stop_outcome'].str.lower() == 'arrest']
-        st.metric("Total Arrests", arrests.shape[0])
+        st.metric("Total Arrests", summary['total_arrests'])
     with col3:
-        warnings = stop_data[stop_data['stop_outcome'].str.lower() == 'warning']
-        st.metric("Total Warnings", warnings.shape[0])
+        st.metric("Total Warnings", summary['total_warnings'])
     with col4:
-        drug_related = stop_data[stop_data['drugs_related_stop'] == True]
-        st.metric("Drug-Related Stops", drug_related.shape[0])
+        st.metric("Drug-Related Stops", summary['drug_related_stops'])
 
     # Insights Tabs
     st.markdown("## 🔍 Detailed Insights")
@@ -106,24 +214,22 @@ if page == '🏠 Overview':
 
     with tab1:
         st.subheader("Stops by Violation Type")
-        if 'violation' in violations_data.columns:
-            vc = violations_data['violation'].value_counts().reset_index()
-            vc.columns = ['Violation', 'Count']
+        if summary['violations']:
+            vc = pd.DataFrame(summary['violations'], columns=['Violation', 'Count'])
             fig = px.bar(vc, x='Violation', y='Count', color='Violation')
             st.plotly_chart(fig, use_container_width=True)
         else:
-            st.warning("No 'violation' column found in dataset.")
+            st.warning("No violation data found.")
 
     with tab2:
         st.subheader("Driver Gender Distribution")
-        if 'driver_gender' in drivers_data.columns:
-            gc = drivers_data['driver_gender'].value_counts().reset_index()
-            gc.columns = ['Gender', 'Count']
+        if summary['genders']:
+            gc = pd.DataFrame(summary['genders'], columns=['Gender', 'Count'])
             fig = px.pie(gc, names='Gender', values='Count',
                          color_discrete_sequence=px.colors.sequential.RdBu)
             st.plotly_chart(fig, use_container_width=True)
         else:
-            st.warning("No 'driver_gender' column found in dataset.")
+            st.warning("No driver gender data found.")
 
 # --------------------------------------
 # Deep Dive Analytics
@@ -131,61 +237,82 @@ if page == '🏠 Overview':
 elif page == '📈 Deep Dive':
     st.title("⚙️ Deep Analysis")
     st.header("Advanced Insights")
-    category = st.sidebar.selectbox("Choose Category", [
-        "🚗 Vehicle-Based", "🢍 Demographic-Based", "🕒 Time-Based",
-        "⚖️ Violation-Based", "🌍 Location-Based", "🧠 Complex Analytics"
-    ])
-
-    query_map = {
-        "🚗 Vehicle-Based": {
-            "Top 10 Drug-Related Vehicles": analytics.get_top_10_drug_related_vehicles,
-            "Most Frequently Searched Vehicles": analytics.get_most_searched_vehicles
-        },
-        "🢍 Demographic-Based": {
-            "Highest Arrest Rate by Age Group": analytics.get_highest_arrest_rate_by_age_group,
-            "Gender Distribution by Country": analytics.get_gender_distribution_by_country,
-            "Race & Gender with Highest Search Rate": analytics.get_race_gender_highest_search_rate
-        },
-        "🕒 Time-Based": {
-            "Peak Traffic Stop Times": analytics.get_peak_traffic_stop_time,
-            "Average Stop Duration by Violation": analytics.get_average_stop_duration_by_violation,
-            "Are Night Stops More Arrest-Prone?": analytics.get_arrest_rate_by_time_of_day
-        },
-        "⚖️ Violation-Based": {
-            "Violations with Most Searches/Arrests": analytics.get_violation_search_arrest_stats,
-            "Violations Common < Age 25": analytics.get_common_violations_under_25,
-            "Violations Rarely Leading to Arrest": analytics.get_rarely_flagged_violations
-        },
-        "🌍 Location-Based": {
-            "Countries with Highest Drug Stop Rates": analytics.get_country_with_highest_drug_related_rate,
-            "Arrest Rate by Country & Violation": analytics.get_arrest_rate_by_country_violation,
-            "Country with Most Searches": analytics.get_country_with_most_search_stops
-        },
-        "🧠 Complex Analytics": {
-            "Yearly Stops & Arrests by Country": analytics.get_yearly_stops_arrests_by_country,
-            "Violation Trends by Age & Race": analytics.get_violation_trends_by_age_race,
-            "Time Period Stop Patterns": analytics.get_time_period_analysis_of_stops,
-            "High Search+Arrest Violations": analytics.get_high_search_arrest_violations,
-            "Driver Demographics by Country": analytics.get_driver_demographics_by_country,
-            "Top 5 Arrest-Prone Violations": analytics.get_top_5_highest_arrest_violations
-        }
-    }
+    # Categories, labels and parameters all come from the query catalog (catalog.py).
+    query_map = dashboard_queries(analytics)
+    category = st.sidebar.selectbox("Choose Category", list(query_map))
 
-    if category:
+    mode = st.sidebar.radio("Mode", ["Single query", "Whole category", "All categories"])
+
+    if mode == "Single query" and category:
         query_label = st.sidebar.selectbox("Choose a Query", list(query_map[category].keys()))
         if query_label:
             st.subheader(query_label)
+            method = query_map[category][query_label]
+            # Counts and ages can't go negative, and LIMIT 0 shows nothing.
+            params = {
+                name: st.sidebar.number_input(name.replace('_', ' ').capitalize(), value=default, step=1,
+                                              min_value=1 if name == 'limit' else 0)
+                for name, (kind, default) in QUERY_CATALOG[method.__name__].get('params', {}).items()
+                if kind is int
+            }
+            # Rate analytics can answer from a sample first (approximate.py):
+            # the estimate shows at once and is replaced by the exact result.
+            approximate_first = method.__name__ in APPROXIMATE_QUERIES and st.sidebar.checkbox(
+                "⚡ Estimate first", value=True, help="Show a sampled estimate with 95% confidence "
+                                                     "intervals while the exact query runs")
+            slot = st.empty()
             try:
-                results = query_map[category][query_label]()
-                if results:
-                    columns = [desc[0] for desc in analytics.mediator.description]
-                    df = pd.DataFrame(results, columns=columns)
-                    st.dataframe(df, use_container_width=True)
+                if approximate_first:
+                    progressive = analytics.run_progressive(method.__name__, **params, **filters)
                 else:
-                    st.info("No data found for this query.")
+                    progressive = [(method(**params, **filters), False)]
+                for (results, columns), approximate in progressive:
+                    with slot.container():
+                        if results:
+                            df = pd.DataFrame(results, columns=columns)
+                            st.dataframe(df, use_container_width=True)
+                            if approximate:
+                                st.caption(f"≈ Estimated from {df['sampled_stops'].sum():,} sampled stops; "
+                                           f"refining to the exact result...")
+                        else:
+                            st.info("No data found for this query.")
             except Exception as e:
                 st.error(f"Query error: {e}")
 
+    elif mode != "Single query":
+        # Report: every query of the category (or all of them) runs concurrently
+        # on pooled connections; each result fills its slot as soon as it lands.
+        categories = [category] if mode == "Whole category" else list(query_map)
+        queries = {label: method for name in categories for label, method in query_map[name].items()}
+        if st.button(f"▶️ Run {len(queries)} queries"):
+            slots = {}
+            for name in categories:
+                if len(categories) > 1:
+                    st.header(name)
+                for label in query_map[name]:
+                    st.subheader(label)
+                    slots[label] = st.empty()
+                    slots[label].info("Running...")
+
+            progress = st.progress(0.0)
+            start = datetime.now()
+            for done, (label, result, error, seconds) in enumerate(analytics.run_report(queries, filters=filters), 1):
+                slot = slots[label].container()
+                if error is not None:
+                    slot.error(f"Query error: {error}")
+                elif result[0]:
+                    slot.dataframe(pd.DataFrame(result[0], columns=result[1]), use_container_width=True)
+                    slot.caption(f"{seconds * 1000:.0f} ms")
+                else:
+                    slot.info("No data found for this query.")
+                progress.progress(done / len(queries), text=f"{done}/{len(queries)} queries")
+            progress.progress(1.0, text=f"{len(queries)} queries in "
+                                        f"{(datetime.now() - start).total_seconds():.2f}s")
+
+    cache_stats = analytics.cache.stats()
+    st.sidebar.caption(f"Cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+                       f"({cache_stats['hit_rate']:.0%}), {cache_stats['entries']} results")
+
 # --------------------------------------
 # New Entry & Prediction Page
 # --------------------------------------
@@ -240,19 +367,32 @@ elif page == '📝 New Entry + Prediction':
 
             # Prediction + Insertion
         if submit_button:
-            predicted_outcome = stop_data['stop_outcome'].mode()[0] if not stop_data.empty else "Warning"
-            predicted_violation = violations_data['violation'].mode()[0] if not violations_data.empty else (violation_raw or "Speeding")
+            engine = get_prediction_engine(snapshot.watermark)
+            features = {
+                'country_name': country_name,
+                'age_group': age_group,
+                'driver_gender': driver_gender,
+                'driver_race': driver_race,
+                'time_of_day': time_of_day(stop_time),
+                'search_conducted': search_conducted,
+                'drugs_related_stop': drugs_related_stop,
+            }
+            predicted_outcome, _, _ = engine.predict('stop_outcome', features)
+            predicted_violation, _, _ = engine.predict('violation', features)
+            predicted_outcome = predicted_outcome or "Warning"
+            predicted_violation = predicted_violation or (violation_raw or "Speeding")
 
             search_text = "a search was conducted" if search_conducted else "no search was conducted"
             drug_text = "was drug-related" if drugs_related_stop else "was not drug-related"
 
             if user_role == "officer" and st.session_state.is_authenticated:
                 try:
-                    analytics.insert_driver_data(vehicle_number, driver_gender, driver_age, age_group, driver_race)
-                    analytics.insert_stop_data(vehicle_number, stop_date, stop_time, stop_duration,
-                                                country_name, drugs_related_stop, search_conducted,
-                                                is_arrested, stop_outcome=predicted_outcome, added_by=st.session_state.officer_id)
-                    analytics.insert_violation_data(vehicle_number, violation_raw, violation=predicted_violation)
+                    analytics.submit_stop(vehicle_number, driver_gender, driver_age, age_group, driver_race,
+                                          stop_date, stop_time, stop_duration, country_name,
+                                          drugs_related_stop, search_conducted, is_arrested,
+                                          stop_outcome=predicted_outcome, added_by=st.session_state.officer_id,
+                                          violation_raw=violation_raw, violation=predicted_violation)
+                    engine.observe(features, predicted_outcome, predicted_violation)
                     st.success("✅ Data inserted successfully into database.")
                 except Exception as e:
                     st.error(f"❌ Error inserting into DB: {e}")
@@ -267,3 +407,72 @@ elif page == '📝 New Entry + Prediction':
             for **{violation_raw or predicted_violation}**. Based on similar past data, the stop outcome is likely **{predicted_outcome}**,  
             and {search_text}. The stop {drug_text}.
             """)
+
+    # Batch Entry Section
+    if user_role == "officer" and st.session_state.is_authenticated:
+        st.markdown("---")
+        st.subheader("📦 Batch Entry")
+        st.caption(f"Upload a CSV or fill the grid with these columns: {', '.join(BATCH_COLUMNS)}")
+
+        uploaded_file = st.file_uploader("Upload stops CSV", type=["csv"])
+        if uploaded_file is not None:
+            batch = pd.read_csv(uploaded_file)
+        else:
+            batch = st.data_editor(pd.DataFrame(columns=BATCH_COLUMNS), num_rows="dynamic",
+                                   use_container_width=True, key="batch_grid")
+
+        if st.button("Submit Batch", disabled=batch.empty):
+            df_batch_drivers, df_batch_stops, df_batch_violations, error_report = validate_batch(batch)
+            try:
+                start = datetime.now()
+                existing = analytics.submit_stops_batch(df_batch_drivers, df_batch_stops, df_batch_violations,
+                                                        added_by=st.session_state.officer_id)
+                elapsed = (datetime.now() - start).total_seconds()
+                get_prediction_engine(snapshot.watermark).observe_stops(
+                    *(df[~df['vehicle_number'].isin(existing)]
+                      for df in (df_batch_drivers, df_batch_stops, df_batch_violations)))
+                if existing:
+                    existing_rows = batch.reset_index(drop=True)
+                    existing_rows = existing_rows[existing_rows['vehicle_number'].astype(str).str.strip().isin(existing)]
+                    error_report = pd.concat([error_report, pd.DataFrame({
+                        'row': existing_rows.index + 1,
+                        'vehicle_number': existing_rows['vehicle_number'],
+                        'column': 'vehicle_number',
+                        'error': "already on file",
+                    })]).sort_values('row', kind='stable')
+                inserted = len(df_batch_stops) - len(existing)
+                st.success(f"✅ Inserted {inserted} of {len(batch)} stops in {elapsed:.2f}s.")
+            except Exception as e:
+                st.error(f"❌ Error inserting batch into DB (nothing was saved): {e}")
+
+            if not error_report.empty:
+                st.warning(f"{error_report['row'].nunique()} rows were rejected:")
+                st.dataframe(error_report, use_container_width=True, hide_index=True)
+
+# --------------------------------------
+# Performance Page (admins only)
+# --------------------------------------
+elif page == '⏱ Performance' and st.session_state.officer_role == 'admin':
+    st.title("⏱ Performance")
+    st.caption(f"Rolling percentiles over the last {metrics.window} calls per method, "
+               f"this dashboard process only. Prometheus file: {METRICS_FILE}")
+
+    summary = metrics.summary()
+    if summary:
+        perf = pd.DataFrame(summary)
+        st.dataframe(perf.style.format({
+            'p50_ms': '{:.1f}', 'p95_ms': '{:.1f}', 'p99_ms': '{:.1f}',
+            'avg_db_ms': '{:.1f}', 'avg_rows': '{:.0f}', 'avg_bytes': '{:,.0f}',
+        }), use_container_width=True)
+        fig = px.bar(perf.head(20), x='p95_ms', y='name', orientation='h',
+                     hover_data=['p50_ms', 'p99_ms', 'avg_db_ms', 'calls'])
+        fig.update_layout(yaxis={'categoryorder': 'total ascending'})
+        st.plotly_chart(fig, use_container_width=True)
+    else:
+        st.info("Nothing measured yet. Browse the other pages first.")
+
+    with st.expander("Prometheus text"):
+        st.code(metrics.prometheus(), language='text')
+    if st.button("Reset measurements"):
+        metrics.reset()
+        st.rerun()
@@ -0,0 +1,205 @@
+import re
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+# Encoded schema (create_tables(encoded=True)): these low-cardinality text
+# columns hold SMALLINT codes into small dim_<column> lookup tables. Column
+# names stay the same, so the analytics group on the codes unchanged and
+# CheckPostAnalytics decodes result columns only at the end.
+ENCODED_COLUMNS = {
+    'country_name': 'stops',
+    'stop_outcome': 'stops',
+    'stop_duration': 'stops',
+    'violation': 'violations',
+    'violation_raw': 'violations',
+    'driver_race': 'drivers',
+}
+
+
+def dimension(column):
+    return f"dim_{column}"
+
+
+def column_types(encoded):
+    # SQL types of the encodable columns for create_tables().
+    if encoded:
+        return {column: 'SMALLINT' for column in ENCODED_COLUMNS}
+    return {'country_name': 'VARCHAR(50)', 'stop_outcome': 'VARCHAR(50)', 'stop_duration': 'VARCHAR(20)',
+            'violation': 'VARCHAR(50)', 'violation_raw': 'VARCHAR(100)', 'driver_race': 'VARCHAR(50)'}
+
+
+def create_dimensions(mediator):
+    # Codes are handed out once and never change, so cached results and
+    # prepared statements that baked a code in stay valid.
+    for column in ENCODED_COLUMNS:
+        mediator.execute(f"""
+            CREATE TABLE IF NOT EXISTS {dimension(column)} (
+                code SMALLINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+                value TEXT NOT NULL UNIQUE
+            );
+        """)
+        print(f"TABLE '{dimension(column)}' created.")
+
+
+def is_encoded(mediator):
+    mediator.execute("SELECT to_regclass(%s) IS NOT NULL;", (dimension('country_name'),))
+    return mediator.fetchone()[0]
+
+
+def decoded_select(table, columns, encoded):
+    # SELECT list for reading a fact table with text values, e.g. for exports.
+    if not encoded:
+        return f"SELECT {', '.join(columns)} FROM {table} t"
+    select, joins = [], []
+    for column in columns:
+        if ENCODED_COLUMNS.get(column) == table:
+            joins.append(f"LEFT JOIN {dimension(column)} {column}_dim ON {column}_dim.code = t.{column}")
+            select.append(f"{column}_dim.value AS {column}")
+        else:
+            select.append(f"t.{column}")
+    return f"SELECT {', '.join(select)} FROM {table} t {' '.join(joins)}"
+
+
+class Dictionary:
+    # In-process copy of the dim_* tables: value -> code for writes, code ->
+    # value for decoding results. Unknown values are added to the dimension
+    # (get-or-create); unknown codes, written by another process, trigger a reload.
+    # Reads (filters, query literals) never add values: an unknown one matches
+    # nothing, after at most one reload per RELOAD_INTERVAL.
+    RELOAD_INTERVAL = 30.0
+
+    def __init__(self, cursor):
+        self.cursor = cursor  # context manager factory yielding a cursor
+        self.codes = {column: {} for column in ENCODED_COLUMNS}
+        self.values = {column: {} for column in ENCODED_COLUMNS}
+        self.lock = threading.Lock()
+        self.loaded_at = 0.0
+        self.load()
+
+    def load(self):
+        query = " UNION ALL ".join(f"SELECT '{column}', code, value FROM {dimension(column)}"
+                                   for column in ENCODED_COLUMNS)
+        with self.cursor() as mediator:
+            mediator.execute(query)
+            rows = mediator.fetchall()
+        with self.lock:
+            for column, code, value in rows:
+                self.codes[column][value] = code
+                self.values[column][code] = value
+            self.loaded_at = time.monotonic()
+
+    def encode(self, column, values):
+        # Sorted, so a fresh load hands out codes in alphabetical order.
+        missing = sorted({value for value in values if value is not None and value not in self.codes[column]})
+        if missing:
+            with self.cursor() as mediator:
+                mediator.execute(f"""
+                    INSERT INTO {dimension(column)} (value)
+                    SELECT unnest(%s::TEXT[])
+                    ON CONFLICT (value) DO NOTHING;
+                """, (missing,))
+                mediator.execute(f"SELECT code, value FROM {dimension(column)} WHERE value = ANY(%s);", (missing,))
+                rows = mediator.fetchall()
+            with self.lock:
+                for code, value in rows:
+                    self.codes[column][value] = code
+                    self.values[column][code] = value
+        return [None if value is None else self.codes[column][value] for value in values]
+
+    def lookup(self, column, values):
+        # Codes of the values already in the dimension, for filtering: a value
+        # nobody has stored can't match, so it isn't added.
+        codes = self.known(column)
+        if any(value not in codes for value in values) and time.monotonic() - self.loaded_at > self.RELOAD_INTERVAL:
+            self.load()
+            codes = self.known(column)
+        return [codes[value] for value in values if value in codes]
+
+    def known(self, column):
+        # Snapshot of value -> code, safe to iterate while encode() adds values.
+        with self.lock:
+            return dict(self.codes[column])
+
+    def code(self, column, value):
+        return self.encode(column, [value])[0]
+
+    def encode_frame(self, df):
+        # Map the pandas category codes straight to dimension codes: one lookup
+        # per distinct value, then a vectorized take over the rows.
+        df = df.copy()
+        for column in ENCODED_COLUMNS:
+            if column not in df.columns:
+                continue
+            values = df[column].astype('category')
+            categories = [str(value) for value in values.cat.categories]
+            lookup = np.array(self.encode(column, categories) + [None], dtype=object)
+            df[column] = pd.array(lookup[values.cat.codes.to_numpy()], dtype='Int16')
+        return df
+
+    def decode_rows(self, rows, columns):
+        encoded = [(index, column) for index, column in enumerate(columns) if column in ENCODED_COLUMNS]
+        if not encoded or not rows:
+            return rows
+        if any(row[index] is not None and row[index] not in self.values[column]
+               for row in rows for index, column in encoded):
+            self.load()
+        decoded = []
+        for row in rows:
+            row = list(row)
+            for index, column in encoded:
+                if row[index] is not None:
+                    row[index] = self.values[column].get(row[index], row[index])
+            decoded.append(tuple(row))
+        return decoded
+
+    def encode_literals(self, query):
+        # For queries run now: the literals become the codes known today.
+        def literal(column, value):
+            # A value nobody has stored matches nothing.
+            codes = self.lookup(column, [value])
+            return str(codes[0]) if codes else 'NULL'
+
+        def lower_literal(column, value):
+            codes = [str(code) for known, code in self.known(column).items() if known.lower() == value]
+            return f"({', '.join(codes) or 'NULL'})"
+
+        return rewrite_literals(query, literal, lower_literal)
+
+
+def dimension_literals(query):
+    # For view definitions, which outlive today's codes (and are usually
+    # created before any data is loaded): each literal becomes a lookup in
+    # its dim_* table, evaluated whenever the view is refreshed.
+    def literal(column, value):
+        return f"(SELECT code FROM {dimension(column)} WHERE value = '{value}')"
+
+    def lower_literal(column, value):
+        return f"(SELECT code FROM {dimension(column)} WHERE LOWER(value) = '{value}')"
+
+    return rewrite_literals(query, literal, lower_literal)
+
+
+def rewrite_literals(query, literal, lower_literal):
+    # The analytics compare a few encoded columns with text literals
+    # (CASE stop_duration WHEN '16-30 Min' ..., LOWER(stop_outcome) = 'arrest').
+    # Swap the literals for codes so the comparison runs on SMALLINTs:
+    # literal(column, value) gives a single code, lower_literal(column, value)
+    # the parenthesized set of codes whose lowercased value matches.
+    for column in ENCODED_COLUMNS:
+        if column not in query:
+            continue
+        name = rf"((?:\w+\.)?\b{column}\b)"
+
+        def case_match(match):
+            whens = re.sub(r"WHEN\s+'([^']*)'", lambda when: f"WHEN {literal(column, when.group(1))}", match.group(2))
+            return f"CASE {match.group(1)}{whens}"
+
+        query = re.sub(rf"LOWER\({name}\)\s*=\s*'([^']*)'",
+                       lambda match: f"{match.group(1)} IN {lower_literal(column, match.group(2).lower())}", query)
+        query = re.sub(rf"CASE\s+{name}((?:\s+WHEN\s+'[^']*'\s+THEN\s+\S+)+)", case_match, query)
+        query = re.sub(rf"{name}\s*=\s*'([^']*)'",
+                       lambda match: f"{match.group(1)} = {literal(column, match.group(2))}", query)
+    return query
@@ -0,0 +1,93 @@
+from datetime import date
+
+from encoding import ENCODED_COLUMNS
+
+# Global analytics filters (the dashboard sidebar). Every CheckPostAnalytics
+# analytic accepts them as keyword arguments, e.g.
+#   analytics.get_peak_traffic_stop_time(start_date=date(2020, 1, 1), countries=('India',))
+# They are pushed down by shadowing the three tables with filtered CTEs of the
+# same name, so the analytics SQL itself does not change: stops keeps the rows
+# matching every condition (driver and violation conditions as semi-joins),
+# drivers and violations keep that set of vehicles. The CTEs are inlined, so
+# the conditions reach the scans (and partition pruning) of each query.
+# key -> (table, column, condition with a %(key)s placeholder)
+FILTERS = {
+    'start_date': ('stops', 'stop_date', "stop_date >= %(start_date)s"),
+    'end_date': ('stops', 'stop_date', "stop_date <= %(end_date)s"),
+    'countries': ('stops', 'country_name', "country_name = ANY(%(countries)s)"),
+    'violations': ('violations', 'violation', "violation = ANY(%(violations)s)"),
+    'age_groups': ('drivers', 'age_group', "age_group = ANY(%(age_groups)s)"),
+}
+
+
+def normalize_filters(filters):
+    # Drops unset filters; lists become sorted tuples and ISO strings dates,
+    # so equal filters give equal (hashable) cache keys.
+    normalized = {}
+    for key, value in (filters or {}).items():
+        if key not in FILTERS:
+            raise TypeError(f"Unknown filter: {key}")
+        if value is None or (isinstance(value, (list, tuple, set)) and not value):
+            continue
+        if isinstance(value, str) and FILTERS[key][1] == 'stop_date':
+            value = date.fromisoformat(value)
+        elif isinstance(value, (list, tuple, set)):
+            value = tuple(sorted(value))
+        normalized[key] = value
+    return normalized
+
+
+def split_filters(kwargs):
+    # Method keyword arguments -> (filters, the method's own arguments).
+    filters = {key: value for key, value in kwargs.items() if key in FILTERS}
+    return normalize_filters(filters), {key: value for key, value in kwargs.items() if key not in FILTERS}
+
+
+def filter_arguments(args, kwargs):
+    # Cache key arguments of a method that only takes filters (see cache.cached).
+    return (), split_filters(kwargs)[0]
+
+
+def filter_shape(filters):
+    # Which filters are set, as a small number: one prepared statement per shape.
+    return sum(1 << index for index, key in enumerate(FILTERS) if key in filters)
+
+
+def filter_types(filters, encoded):
+    # PREPARE parameter types of the filter placeholders.
+    types = {}
+    for key in filters:
+        column = FILTERS[key][1]
+        if column == 'stop_date':
+            types[key] = 'date'
+        else:
+            types[key] = 'smallint[]' if encoded and column in ENCODED_COLUMNS else 'text[]'
+    return types
+
+
+def apply_filters(query, filters, qualify='', sample=None):
+    # The query behind the filtered CTEs. `qualify` spells out the real tables
+    # where sibling CTEs would otherwise shadow them (SQLite: 'main.').
+    # `sample` (see backends.sample_clause) reads a sample of stops instead;
+    # that CTE is then materialized so every reference sees the same sample.
+    conditions = {table: [] for table in ('stops', 'drivers', 'violations')}
+    for key, (table, _, condition) in FILTERS.items():
+        if key in filters:
+            conditions[table].append(condition)
+    suffix, condition = sample or ("", None)
+    stop_conditions = ([condition] if condition else []) + conditions['stops'] + [
+        f"vehicle_number IN (SELECT vehicle_number FROM {qualify}{table} WHERE {' AND '.join(conditions[table])})"
+        for table in ('drivers', 'violations') if conditions[table]
+    ]
+    prelude = f"""
+        WITH stops AS {'MATERIALIZED' if sample else 'NOT MATERIALIZED'} (
+            SELECT * FROM {qualify}stops {suffix} WHERE {' AND '.join(stop_conditions) or 'TRUE'}
+        ), drivers AS NOT MATERIALIZED (
+            SELECT * FROM {qualify}drivers WHERE vehicle_number IN (SELECT vehicle_number FROM stops)
+        ), violations AS NOT MATERIALIZED (
+            SELECT * FROM {qualify}violations WHERE vehicle_number IN (SELECT vehicle_number FROM stops)
+        )"""
+    query = query.strip()
+    if query[:4].upper() == 'WITH':
+        return f"{prelude},{query[4:]}"
+    return f"{prelude}\n        {query}"
@@ -0,0 +1,267 @@
+import argparse
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:  # CSV output still works through pandas
+    pa = None
+
+# Column order of the check post exports that load_and_clean_data reads.
+CSV_COLUMNS = ['stop_date', 'stop_time', 'country_name', 'driver_gender', 'driver_age_raw',
+               'driver_age', 'driver_race', 'violation_raw', 'violation', 'search_conducted',
+               'search_type', 'stop_outcome', 'is_arrested', 'stop_duration',
+               'drugs_related_stop', 'vehicle_number']
+
+OUTCOMES = ['Warning', 'Ticket', 'Arrest']
+DURATIONS = ['0-15 Min', '16-30 Min', '30+ Min']
+
+# Every distribution can be overridden with --config (same shape, partial is fine).
+DEFAULT_CONFIG = {
+    'start_date': '2020-01-01',
+    'end_date': '2024-12-31',
+    'missing_age_rate': 0.02,
+    'age_mean': 36,
+    'age_sd': 13,
+    'male_rate': 0.7,
+    'races': {'White': 0.55, 'Black': 0.15, 'Hispanic': 0.15, 'Asian': 0.1, 'Other': 0.05},
+    # Stops by hour of day, midnight first.
+    'hours': [2, 1.5, 1, 1, 1, 2, 4, 6, 7, 7, 6, 6, 6, 6, 6, 6, 6, 6, 5, 5, 4, 4, 3, 3],
+    'search_types': {'Vehicle Search': 0.6, 'Frisk': 0.4},
+    'countries': {
+        'USA': {'weight': 0.45, 'violations': {'Speeding': 0.55, 'Moving violation': 0.15, 'Equipment': 0.1,
+                                               'Registration/plates': 0.05, 'Seat belt': 0.05, 'DUI': 0.05, 'Other': 0.05}},
+        'India': {'weight': 0.35, 'violations': {'Speeding': 0.4, 'Moving violation': 0.2, 'Equipment': 0.1,
+                                                 'Registration/plates': 0.1, 'Seat belt': 0.1, 'DUI': 0.05, 'Other': 0.05}},
+        'Canada': {'weight': 0.2, 'violations': {'Speeding': 0.6, 'Moving violation': 0.1, 'Equipment': 0.1,
+                                                 'Registration/plates': 0.05, 'Seat belt': 0.08, 'DUI': 0.02, 'Other': 0.05}},
+    },
+    # Per violation: raw labels, outcome mix (Warning/Ticket/Arrest), stop duration
+    # mix (0-15/16-30/30+), and search / drug-related rates.
+    'violations': {
+        'Speeding': {'raw': {'Speeding': 1.0}, 'outcomes': [0.25, 0.72, 0.03],
+                     'durations': [0.85, 0.12, 0.03], 'search_rate': 0.02, 'drug_rate': 0.005},
+        'Moving violation': {'raw': {'Moving violation': 0.8, 'Call for Service': 0.2}, 'outcomes': [0.3, 0.6, 0.1],
+                             'durations': [0.7, 0.22, 0.08], 'search_rate': 0.06, 'drug_rate': 0.01},
+        'Equipment': {'raw': {'Equipment/Inspection Violation': 1.0}, 'outcomes': [0.45, 0.5, 0.05],
+                      'durations': [0.8, 0.15, 0.05], 'search_rate': 0.05, 'drug_rate': 0.01},
+        'Registration/plates': {'raw': {'Registration/plates': 1.0}, 'outcomes': [0.2, 0.7, 0.1],
+                                'durations': [0.6, 0.3, 0.1], 'search_rate': 0.08, 'drug_rate': 0.01},
+        'Seat belt': {'raw': {'Seatbelt': 1.0}, 'outcomes': [0.1, 0.88, 0.02],
+                      'durations': [0.9, 0.08, 0.02], 'search_rate': 0.01, 'drug_rate': 0.002},
+        'DUI': {'raw': {'DUI': 1.0}, 'outcomes': [0.05, 0.35, 0.6],
+                'durations': [0.1, 0.4, 0.5], 'search_rate': 0.5, 'drug_rate': 0.15},
+        'Other': {'raw': {'Other': 0.7, 'Other (non-mapped)': 0.3}, 'outcomes': [0.4, 0.5, 0.1],
+                  'durations': [0.6, 0.3, 0.1], 'search_rate': 0.07, 'drug_rate': 0.02},
+    },
+}
+
+# Vehicle numbers look like UP76DY3473: state, 2 digits, 2 letters, 4 digits.
+STATES = np.array([list(state.encode()) for state in
+                   ['AP', 'DL', 'GJ', 'HR', 'KA', 'KL', 'MH', 'MP', 'PB', 'RJ',
+                    'TN', 'TS', 'UP', 'WB', 'BR', 'CG', 'GA', 'JH', 'OD', 'UK']], dtype=np.uint8)
+PLATE_CAPACITY = len(STATES) * 100 * 26 * 26 * 10_000
+PLATE_STRIDE = 2_654_435_761  # coprime with PLATE_CAPACITY, so the mapping below is a bijection
+
+
+def merge_config(base, override):
+    merged = dict(base)
+    for key, value in override.items():
+        merged[key] = merge_config(base[key], value) if isinstance(value, dict) and isinstance(base.get(key), dict) else value
+    return merged
+
+
+def normalized(weights):
+    weights = np.asarray(weights, dtype=float)
+    return weights / weights.sum()
+
+
+def sample_rows(rng, cumulative, group_codes):
+    # Inverse-CDF sampling with a different distribution per group:
+    # cumulative[g] is the CDF for group g.
+    draws = rng.random(len(group_codes))
+    return (draws[:, None] > cumulative[group_codes]).sum(axis=1).clip(max=cumulative.shape[1] - 1)
+
+
+def vehicle_numbers(start, count):
+    # Bijective scramble of the row index, so numbers are unique and don't look sequential.
+    index = (np.arange(start, start + count, dtype=np.int64) * PLATE_STRIDE + 7) % PLATE_CAPACITY
+    plates = np.empty((count, 10), dtype=np.uint8)
+    index, digits4 = np.divmod(index, 10_000)
+    index, letters = np.divmod(index, 676)
+    states, digits2 = np.divmod(index, 100)
+
+    plates[:, 0:2] = STATES[states]
+    plates[:, 2] = ord('0') + digits2 // 10
+    plates[:, 3] = ord('0') + digits2 % 10
+    plates[:, 4] = ord('A') + letters // 26
+    plates[:, 5] = ord('A') + letters % 26
+    for position in range(4):
+        plates[:, 9 - position] = ord('0') + digits4 % 10
+        digits4 //= 10
+    return plates.view('S10').ravel().astype(str)
+
+
+class StopGenerator:
+    def __init__(self, config=None, seed=0, total_rows=None):
+        self.config = merge_config(DEFAULT_CONFIG, config or {})
+        self.rng = np.random.default_rng(seed)
+        self.produced = 0
+        self.total_rows = total_rows
+
+        config = self.config
+        self.countries = np.array(list(config['countries']))
+        self.violations = np.array(list(config['violations']))
+        self.country_weights = normalized([country['weight'] for country in config['countries'].values()])
+        self.violation_cdf = np.cumsum([
+            normalized([country['violations'].get(violation, 0) for violation in self.violations])
+            for country in config['countries'].values()
+        ], axis=1)
+
+        violation_settings = [config['violations'][violation] for violation in self.violations]
+        self.outcome_cdf = np.cumsum([normalized(v['outcomes']) for v in violation_settings], axis=1)
+        self.duration_cdf = np.cumsum([normalized(v['durations']) for v in violation_settings], axis=1)
+        self.search_rate = np.array([v['search_rate'] for v in violation_settings])
+        self.drug_rate = np.array([v['drug_rate'] for v in violation_settings])
+
+        raw_labels = sorted({raw for v in violation_settings for raw in v['raw']})
+        self.raw_labels = np.array(raw_labels)
+        self.raw_cdf = np.cumsum([
+            normalized([v['raw'].get(raw, 0) for raw in raw_labels]) for v in violation_settings
+        ], axis=1)
+
+        self.races = np.array(list(config['races']))
+        self.race_weights = normalized(list(config['races'].values()))
+        self.hour_weights = normalized(config['hours'])
+        self.search_types = np.array(list(config['search_types']))
+        self.search_type_weights = normalized(list(config['search_types'].values()))
+        self.start_date = np.datetime64(config['start_date'], 'D')
+        self.days = int((np.datetime64(config['end_date'], 'D') - self.start_date).astype(int)) + 1
+
+    def chunk(self, rows):
+        rng, config = self.rng, self.config
+
+        country = rng.choice(len(self.countries), rows, p=self.country_weights)
+        violation = sample_rows(rng, self.violation_cdf, country)
+        outcome = sample_rows(rng, self.outcome_cdf, violation)
+        searched = rng.random(rows) < self.search_rate[violation]
+
+        # Exports are in time order: with a known total, dates advance across chunks.
+        if self.total_rows:
+            position = np.arange(self.produced, self.produced + rows)
+            stop_date = self.start_date + position * self.days // self.total_rows
+        else:
+            stop_date = self.start_date + np.sort(rng.integers(0, self.days, rows))
+        seconds = rng.choice(24, rows, p=self.hour_weights) * 3600 + rng.integers(0, 3600, rows)
+        ages = np.clip(np.rint(rng.normal(config['age_mean'], config['age_sd'], rows)), 16, 90)
+        ages[rng.random(rows) < config['missing_age_rate']] = np.nan
+        birth_year = stop_date.astype('datetime64[Y]').astype(int) + 1970 - ages
+
+        frame = pd.DataFrame({
+            'stop_date': stop_date,
+            'stop_time': pd.to_timedelta(seconds, unit='s'),
+            'country_name': pd.Categorical.from_codes(country, self.countries),
+            'driver_gender': np.where(rng.random(rows) < config['male_rate'], 'M', 'F'),
+            'driver_age_raw': birth_year,
+            'driver_age': ages,
+            'driver_race': pd.Categorical.from_codes(rng.choice(len(self.races), rows, p=self.race_weights), self.races),
+            'violation_raw': pd.Categorical.from_codes(sample_rows(rng, self.raw_cdf, violation), self.raw_labels),
+            'violation': pd.Categorical.from_codes(violation, self.violations),
+            'search_conducted': searched,
+            'search_type': pd.Categorical.from_codes(
+                np.where(searched, rng.choice(len(self.search_types), rows, p=self.search_type_weights), -1),
+                self.search_types),
+            'stop_outcome': pd.Categorical.from_codes(outcome, OUTCOMES),
+            'is_arrested': outcome == OUTCOMES.index('Arrest'),
+            'stop_duration': pd.Categorical.from_codes(sample_rows(rng, self.duration_cdf, violation), DURATIONS),
+            'drugs_related_stop': rng.random(rows) < self.drug_rate[violation],
+            'vehicle_number': vehicle_numbers(self.produced, rows),
+        }, columns=CSV_COLUMNS)
+        self.produced += rows
+        return frame
+
+
+def to_arrow(frame):
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    # Export layout: dates as YYYY-MM-DD, times as HH:MM:SS, ages as whole numbers.
+    seconds = (frame['stop_time'].dt.total_seconds()).astype('int32').to_numpy()
+    table = table.set_column(CSV_COLUMNS.index('stop_date'), 'stop_date',
+                             pa.array(frame['stop_date'].to_numpy().astype('datetime64[D]')))
+    table = table.set_column(CSV_COLUMNS.index('stop_time'), 'stop_time',
+                             pa.array(seconds, pa.int32()).cast(pa.time32('s')))
+    for column in ('driver_age_raw', 'driver_age'):
+        table = table.set_column(CSV_COLUMNS.index(column), column,
+                                 pa.array(frame[column].to_numpy(), from_pandas=True).cast(pa.int16()))
+    return table
+
+
+def write_frames(path, frames, file_format=None):
+    file_format = file_format or ('parquet' if path.endswith('.parquet') else 'csv')
+    if pa is None:
+        if file_format == 'parquet':
+            raise RuntimeError("Parquet output needs pyarrow")
+        return write_csv_pandas(path, frames)
+
+    writer = None
+    rows = 0
+    for frame in frames:
+        rows += len(frame)
+        table = to_arrow(frame)
+        if writer is None:
+            if file_format == 'parquet':
+                writer = pq.ParquetWriter(path, table.schema)
+            else:
+                writer = pa_csv.CSVWriter(path, table.schema,
+                                          write_options=pa_csv.WriteOptions(quoting_style='needed'))
+        writer.write_table(table)
+    if writer is not None:
+        writer.close()
+    return rows
+
+
+def write_csv_pandas(path, frames):
+    rows = 0
+    for frame in frames:
+        frame = frame.assign(stop_date=frame['stop_date'].dt.strftime('%Y-%m-%d'),
+                             stop_time=frame['stop_time'].astype(str).str[-8:],
+                             driver_age_raw=frame['driver_age_raw'].astype('Int64'),
+                             driver_age=frame['driver_age'].astype('Int64'))
+        frame.to_csv(path, mode='w' if rows == 0 else 'a', header=rows == 0, index=False)
+        rows += len(frame)
+    return rows
+
+
+def generate(path, rows, chunk_size=1_000_000, seed=0, config=None, file_format=None):
+    generator = StopGenerator(config, seed, total_rows=rows)
+    frames = (generator.chunk(min(chunk_size, rows - offset)) for offset in range(0, rows, chunk_size))
+    return write_frames(path, frames, file_format)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic traffic stop exports (CSV or Parquet).")
+    parser.add_argument('output', help="Output file; .parquet writes Parquet, anything else CSV")
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--chunk-size', type=int, default=1_000_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--config', help="JSON file overriding DEFAULT_CONFIG distributions")
+    parser.add_argument('--format', choices=['csv', 'parquet'])
+    args = parser.parse_args()
+
+    config = None
+    if args.config:
+        with open(args.config) as f:
+            config = json.load(f)
+
+    start = time.perf_counter()
+    rows = generate(args.output, args.rows, args.chunk_size, args.seed, config, args.format)
+    elapsed = time.perf_counter() - start
+    print(f"Wrote {rows:,} rows to {args.output} in {elapsed:.1f}s ({rows / elapsed * 60:,.0f} rows/min)")
+
+
+if __name__ == "__main__":
+    main()
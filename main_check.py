@@ -1,15 +1,281 @@
+import argparse
+import glob
+import hashlib
+import io
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import date
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
 import pandas as pd
 import psycopg2
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 from sqlalchemy import create_engine
 
+from backends import BACKENDS, EmbeddedCursor, connect, embedded_transaction, transaction_scope
+from encoding import Dictionary, column_types, create_dimensions, dimension_literals, is_encoded
+from partitions import (DEFAULT_PARTITION, bulk_range, detach_partitions, ensure_future_partitions,
+                        ensure_partitions, is_partitioned, partition_interval)
+from snapshot import change_watermark, write_database_snapshot, write_frames_snapshot
+from views import ViewRefresher, create_materialized_views, refresh_view, view_status, MATERIALIZED_VIEWS
+
+DRIVER_COLUMNS = ['vehicle_number', 'driver_gender', 'driver_age', 'age_group', 'driver_race']
+STOP_COLUMNS = ['vehicle_number', 'search_type', 'stop_date', 'stop_time',
+                'stop_duration', 'country_name', 'drugs_related_stop',
+                'search_conducted', 'is_arrested', 'stop_outcome']
+VIOLATION_COLUMNS = ['vehicle_number', 'violation_raw', 'violation']
+
+# Managed secondary indexes for the CheckPostAnalytics workload. Anything named
+# ix_* on these tables that is not listed here is dropped by create_indexes().
+INDEXES = {
+    # Partial indexes on the boolean flags the analytics filter on.
+    'ix_stops_drugs_related': "ON stops (vehicle_number) WHERE drugs_related_stop",
+    'ix_stops_searched': "ON stops (country_name, vehicle_number) WHERE search_conducted",
+    'ix_stops_searched_or_arrested': "ON stops (vehicle_number) WHERE search_conducted OR is_arrested",
+    # Hour-of-day bucketing used by the time-of-day analytics.
+    'ix_stops_stop_hour': "ON stops ((EXTRACT(HOUR FROM stop_time))) INCLUDE (is_arrested)",
+    # stop_date follows load order, so a BRIN index stays tiny and still prunes ranges.
+    'ix_stops_stop_date_brin': "ON stops USING BRIN (stop_date)",
+    'ix_stops_country': "ON stops (country_name) INCLUDE (is_arrested, search_conducted, drugs_related_stop)",
+    # Covering indexes on the join key so joins can run as index-only scans.
+    'ix_stops_vehicle_cover': "ON stops (vehicle_number) INCLUDE (country_name, is_arrested, search_conducted, stop_duration)",
+    'ix_drivers_vehicle_cover': "ON drivers (vehicle_number) INCLUDE (driver_gender, driver_age, age_group, driver_race)",
+    'ix_drivers_age': "ON drivers (driver_age) INCLUDE (vehicle_number)",
+    'ix_violations_vehicle_cover': "ON violations (vehicle_number) INCLUDE (violation)",
+}
+
+
+def clean_frame(df):
+    df = df.drop(columns=['driver_age_raw'], errors='ignore')
+
+    df['stop_date'] = pd.to_datetime(df['stop_date'])
+    df['stop_time'] = pd.to_datetime(df['stop_time'], errors='coerce').dt.time
+    df['country_name'] = df['country_name'].astype('category')
+    df['driver_gender'] = df['driver_gender'].astype('category')
+    df['driver_race'] = df['driver_race'].astype('category')
+    df['violation_raw'] = df['violation_raw'].astype('category')
+    df['violation'] = df['violation'].astype('category')
+    df['stop_outcome'] = df['stop_outcome'].astype('category')
+    df['stop_duration'] = df['stop_duration'].astype('category')
+
+    df['age_group'] = pd.cut(df['driver_age'],
+                             bins=[0, 18, 30, 50, 70, 120],
+                             labels=['Teen', 'Young Adult', 'Adult', 'Middle Age', 'Senior'])
+
+    df_drivers = df[DRIVER_COLUMNS].drop_duplicates()
+    df_stops = df[STOP_COLUMNS].drop_duplicates()
+    df_violations = df[VIOLATION_COLUMNS].drop_duplicates()
+
+    return df_drivers, df_stops, df_violations
+
+
+# Columns of a dashboard batch upload: the export layout without driver_age_raw.
+BATCH_COLUMNS = ['vehicle_number', 'driver_gender', 'driver_age', 'driver_race', 'stop_date',
+                 'stop_time', 'stop_duration', 'country_name', 'search_type', 'search_conducted',
+                 'drugs_related_stop', 'is_arrested', 'stop_outcome', 'violation_raw', 'violation']
+GENDERS = ['M', 'F']
+STOP_DURATIONS = ['0-15 Min', '16-30 Min', '30+ Min']
+STOP_OUTCOMES = ['Warning', 'Ticket', 'Arrest']
+BOOLEAN_VALUES = {'true': True, 'false': False, '1': True, '0': False, 'yes': True, 'no': False}
+
+
+def validate_batch(df):
+    # Checks every row against the schema rules, then cleans the valid rows with
+    # clean_frame() exactly as the CSV loader does. Returns the three frames for
+    # the valid rows plus a per-row error report.
+    df = df.reindex(columns=BATCH_COLUMNS).reset_index(drop=True)
+    errors = []
+
+    def flag(mask, column, message):
+        for row in df.index[mask]:
+            errors.append({'row': row + 1, 'vehicle_number': df.at[row, 'vehicle_number'],
+                           'column': column, 'error': message})
+
+    def blank(column):
+        return df[column].isna() | (df[column].astype(str).str.strip() == '')
+
+    vehicle = df['vehicle_number'].astype(str).str.strip()
+    flag(blank('vehicle_number'), 'vehicle_number', "required")
+    flag(~blank('vehicle_number') & (vehicle.str.len() > 20), 'vehicle_number', "longer than 20 characters")
+    flag(~blank('vehicle_number') & vehicle.duplicated(keep=False), 'vehicle_number', "duplicated in this batch")
+    df['vehicle_number'] = vehicle
+
+    flag(~df['driver_gender'].isin(GENDERS), 'driver_gender', f"must be one of {', '.join(GENDERS)}")
+
+    age = pd.to_numeric(df['driver_age'], errors='coerce')
+    flag(~blank('driver_age') & age.isna(), 'driver_age', "not a number")
+    flag((age < 0) | (age > 120), 'driver_age', "must be between 0 and 120")
+    df['driver_age'] = age
+
+    stop_date = pd.to_datetime(df['stop_date'], errors='coerce')
+    flag(stop_date.isna(), 'stop_date', "missing or not a valid date")
+    stop_time = pd.to_datetime(df['stop_time'].astype(str), errors='coerce', format='mixed')
+    flag(stop_time.isna() | blank('stop_time'), 'stop_time', "missing or not a valid time")
+
+    flag(~blank('stop_duration') & ~df['stop_duration'].isin(STOP_DURATIONS), 'stop_duration',
+         f"must be one of {', '.join(STOP_DURATIONS)}")
+    flag(~df['stop_outcome'].isin(STOP_OUTCOMES), 'stop_outcome', f"must be one of {', '.join(STOP_OUTCOMES)}")
+    flag(blank('country_name'), 'country_name', "required")
+    flag(blank('violation'), 'violation', "required")
+
+    for column in ('search_conducted', 'drugs_related_stop', 'is_arrested'):
+        values = df[column].astype(str).str.strip().str.lower().map(BOOLEAN_VALUES)
+        flag(~blank(column) & values.isna(), column, "must be true or false")
+        df[column] = values.fillna(False).astype(bool)
+
+    report = pd.DataFrame(errors, columns=['row', 'vehicle_number', 'column', 'error'])
+    valid = df.drop(index=report['row'] - 1)
+    df_drivers, df_stops, df_violations = clean_frame(valid)
+    return df_drivers, df_stops, df_violations, report.sort_values('row', kind='stable')
+
+
+class KeySet:
+    # Rows already emitted, kept as a sorted array of 64-bit row hashes
+    # (8 bytes per row) instead of the rows themselves.
+    def __init__(self):
+        self.keys = np.empty(0, dtype=np.uint64)
+
+    def filter_new(self, df):
+        df, hashes = self.unseen(df)
+        self.add(hashes)
+        return df
+
+    def unseen(self, df):
+        # Rows not seen yet (first copy of each) and their hashes, without
+        # marking them seen: add() them once they are safely loaded.
+        hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+        _, first = np.unique(hashes, return_index=True)
+        first.sort()
+
+        if len(self.keys):
+            positions = np.searchsorted(self.keys, hashes[first])
+            positions = np.minimum(positions, len(self.keys) - 1)
+            new = first[self.keys[positions] != hashes[first]]
+        else:
+            new = first
+
+        return df.iloc[new], hashes[new]
+
+    def add(self, hashes):
+        # Merge the (unique, unseen) hashes into the sorted array at their
+        # searchsorted positions: one O(N) copy, no re-sort of what's there.
+        hashes = np.sort(hashes)
+        self.keys = np.insert(self.keys, np.searchsorted(self.keys, hashes), hashes)
+
+
+def file_checksum(filepath):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def stop_timestamps(df):
+    # stop_date + stop_time as one timestamp, for raw export rows and cleaned
+    # stops alike; NaT where either part can't be parsed.
+    return pd.to_datetime(df['stop_date'].astype(str) + ' ' + df['stop_time'].astype(str),
+                          errors='coerce', format='mixed')
+
+
+def rows_since(df, since):
+    # '>=' rather than '>' so stops sharing the watermark's timestamp aren't
+    # lost; re-loading the few that were already in is harmless with upserts.
+    # Rows without a usable timestamp are kept and left to clean_frame().
+    if since is None:
+        return df
+    stamps = stop_timestamps(df)
+    return df[stamps.isna() | (stamps >= since)]
+
+
+def latest_stop(latest, df_stops):
+    newest = stop_timestamps(df_stops).max()
+    if pd.isna(newest):
+        return latest
+    newest = newest.to_pydatetime()
+    return newest if latest is None else max(latest, newest)
+
+
+def clean_file(filepath, watermark=None):
+    # Runs in a worker process, so it must not touch the database connection.
+    # With a watermark only rows newer than the last load are cleaned, and a
+    # file whose checksum hasn't changed is skipped outright (frames is None).
+    start = time.perf_counter()
+    checksum = None
+    if watermark is not None:
+        checksum = file_checksum(filepath)
+        if checksum == watermark['file_checksum']:
+            return None, checksum, time.perf_counter() - start
+    df = pd.read_csv(filepath)
+    if watermark is not None:
+        df = rows_since(df, watermark['last_stop_at'])
+    return clean_frame(df), checksum, time.perf_counter() - start
+
+
+def resolve_sources(sources):
+    # Each source may be a CSV file, a directory of CSVs or a glob pattern.
+    paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            paths.extend(sorted(glob.glob(os.path.join(source, '*.csv'))))
+        elif glob.has_magic(source):
+            paths.extend(sorted(glob.glob(source)))
+        else:
+            paths.append(source)
+    return list(dict.fromkeys(paths))
+
+
+def iter_clean_chunks(filepath, chunksize=100_000, since=None):
+    seen_drivers, seen_stops, seen_violations = KeySet(), KeySet(), KeySet()
+    for chunk in pd.read_csv(filepath, chunksize=chunksize):
+        chunk = rows_since(chunk, since)
+        df_drivers, df_stops, df_violations = clean_frame(chunk)
+        yield (seen_drivers.filter_new(df_drivers),
+               seen_stops.filter_new(df_stops),
+               seen_violations.filter_new(df_violations))
+
+
+# Partitioned stops (create_tables(partition_by='month' | 'year')): the key
+# includes stop_date because every unique constraint must contain the
+# partition key. Formatted with encoding.column_types().
+PARTITIONED_STOPS = """
+    CREATE TABLE IF NOT EXISTS stops (
+        vehicle_number VARCHAR(20) NOT NULL,
+        search_type VARCHAR(100),
+        stop_date DATE NOT NULL,
+        stop_time TIME NOT NULL,
+        stop_duration {stop_duration},
+        country_name {country_name},
+        drugs_related_stop BOOLEAN DEFAULT FALSE,
+        search_conducted BOOLEAN DEFAULT FALSE,
+        is_arrested BOOLEAN DEFAULT FALSE,
+        stop_outcome {stop_outcome},
+        added_by TEXT REFERENCES officers(officer_id),
+        PRIMARY KEY (vehicle_number, stop_date),
+        FOREIGN KEY (vehicle_number) REFERENCES drivers(vehicle_number) ON DELETE CASCADE
+    ) PARTITION BY RANGE (stop_date);
+"""
+PARTITIONS_AHEAD = 3  # future months/years kept ready
+
+
 class traffic_stops:
-    def __init__(self, host, port, user, password, database):
+    def __init__(self, host, port, user, password, database, backend='postgres'):
         self.host = host
         self.port = port
         self.user = user
         self.password = password
         self.database = database
+        self.backend = backend
+
+        # Embedded DuckDB/SQLite file (see backends.py): `database` is its path.
+        if backend != 'postgres':
+            self.connection = connect(backend, database)
+            self.mediator = EmbeddedCursor(self.connection, backend)
+            self.engine = None
+            self.dictionary = None
+            return
 
         # psycopg2 connection
         self.connection = psycopg2.connect(
@@ -26,34 +292,161 @@ class traffic_stops:
         self.engine_string = f"postgresql://{user}:{password}@{host}:{port}/{database}"
         self.engine = create_engine(self.engine_string)
 
+        # Set when the database uses the encoded schema (see encoding.py).
+        self.dictionary = self.make_dictionary() if is_encoded(self.mediator) else None
+
+    def make_dictionary(self):
+        return Dictionary(lambda: nullcontext(self.mediator))
+
     def load_and_clean_data(self, filepath):
-        df = pd.read_csv(filepath)
+        return clean_frame(pd.read_csv(filepath))
+
+    def load_streaming(self, filepath, chunksize=100_000):
+        # Bounded memory: only one chunk plus the dedup key sets are held at a time.
+        totals = [0, 0, 0]
+        for number, (df_drivers, df_stops, df_violations) in enumerate(iter_clean_chunks(filepath, chunksize), 1):
+            self.insert_data(df_drivers, df_stops, df_violations)
+            totals = [totals[0] + len(df_drivers), totals[1] + len(df_stops), totals[2] + len(df_violations)]
+            print(f"Chunk {number}: drivers={len(df_drivers)}, stops={len(df_stops)}, violations={len(df_violations)}")
+        print(f"Streamed {filepath}: drivers={totals[0]}, stops={totals[1]}, violations={totals[2]}")
+        return totals
+
+    def load_incremental(self, filepath, chunksize=100_000):
+        # Delta load: an unchanged file (same checksum) is skipped, otherwise only
+        # rows at or after the source's watermark are cleaned and upserted, so a
+        # nightly run costs time proportional to the new data.
+        watermark = self.get_watermarks([filepath])[filepath]
+        checksum = file_checksum(filepath)
+        if checksum == watermark['file_checksum']:
+            print(f"{filepath} unchanged since the last load, skipped.")
+            return [0, 0, 0]
+
+        totals = [0, 0, 0]
+        latest = None
+        chunks = iter_clean_chunks(filepath, chunksize, watermark['last_stop_at'])
+        for number, (df_drivers, df_stops, df_violations) in enumerate(chunks, 1):
+            self.insert_data(df_drivers, df_stops, df_violations, method='upsert')
+            latest = latest_stop(latest, df_stops)
+            totals = [totals[0] + len(df_drivers), totals[1] + len(df_stops), totals[2] + len(df_violations)]
+            print(f"Chunk {number}: drivers={len(df_drivers)}, stops={len(df_stops)}, violations={len(df_violations)}")
+        self.save_watermark(filepath, checksum, latest, totals[1])
+        print(f"Incremental load of {filepath} since {watermark['last_stop_at'] or 'the beginning'}: "
+              f"drivers={totals[0]}, stops={totals[1]}, violations={totals[2]}")
+        return totals
+
+    def get_watermarks(self, paths):
+        # Sources are keyed by absolute path; files never loaded get an empty watermark.
+        sources = {path: os.path.abspath(path) for path in paths}
+        self.mediator.execute(
+            "SELECT source, file_checksum, last_stop_at FROM ingest_watermarks WHERE source = ANY(%s);",
+            (list(sources.values()),)
+        )
+        found = {source: {'file_checksum': checksum, 'last_stop_at': last_stop_at}
+                 for source, checksum, last_stop_at in self.mediator.fetchall()}
+        return {path: found.get(source, {'file_checksum': None, 'last_stop_at': None})
+                for path, source in sources.items()}
 
-        df.drop(columns=['driver_age_raw'], inplace=True)
+    def save_watermark(self, filepath, checksum, last_stop_at, rows):
+        # Only called once a file is fully loaded, so a failed run is simply redone.
+        self.mediator.execute("""
+            INSERT INTO ingest_watermarks (source, file_checksum, last_stop_at, rows_loaded, loaded_at)
+            VALUES (%s, %s, %s, %s, now())
+            ON CONFLICT (source) DO UPDATE SET
+                file_checksum = EXCLUDED.file_checksum,
+                last_stop_at = GREATEST(ingest_watermarks.last_stop_at, EXCLUDED.last_stop_at),
+                rows_loaded = ingest_watermarks.rows_loaded + EXCLUDED.rows_loaded,
+                loaded_at = EXCLUDED.loaded_at;
+        """, (os.path.abspath(filepath), checksum, last_stop_at, rows))
+
+    def ingest_files(self, paths, workers=None, incremental=False):
+        # Parse + clean in a process pool; this process is the single writer and
+        # loads each finished file in drivers -> stops -> violations order.
+        workers = workers or os.cpu_count()
+        watermarks = self.get_watermarks(paths) if incremental else {}
+        seen_drivers, seen_stops, seen_violations = KeySet(), KeySet(), KeySet()
+        report = []
+        pending = {}
+        queue = list(paths)
+        start = time.perf_counter()
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            while queue or pending:
+                # Keep at most two files per worker in flight so cleaned frames
+                # don't pile up in memory faster than they can be written.
+                while queue and len(pending) < workers * 2:
+                    path = queue.pop(0)
+                    pending[pool.submit(clean_file, path, watermarks.get(path))] = path
 
-        df['stop_date'] = pd.to_datetime(df['stop_date'])
-        df['stop_time'] = pd.to_datetime(df['stop_time'], errors='coerce').dt.time
-        df['country_name'] = df['country_name'].astype('category')
-        df['driver_gender'] = df['driver_gender'].astype('category')
-        df['driver_race'] = df['driver_race'].astype('category')
-        df['violation_raw'] = df['violation_raw'].astype('category')
-        df['violation'] = df['violation'].astype('category')
-        df['stop_outcome'] = df['stop_outcome'].astype('category')
-        df['stop_duration'] = df['stop_duration'].astype('category')
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path = pending.pop(future)
+                    entry = {'file': path, 'status': 'ok', 'drivers': 0, 'stops': 0,
+                             'violations': 0, 'clean_seconds': 0.0, 'load_seconds': 0.0, 'error': None}
+                    try:
+                        frames, checksum, entry['clean_seconds'] = future.result()
+                        if frames is None:
+                            entry['status'] = 'unchanged'
+                            report.append(entry)
+                            print(f"[{len(report)}/{len(paths)}] {path}: unchanged, skipped")
+                            continue
+                        df_drivers, df_stops, df_violations = frames
+                        # Rows only count as seen once their file is loaded, so
+                        # a failed file doesn't hide its rows from later files.
+                        df_drivers, new_drivers = seen_drivers.unseen(df_drivers)
+                        df_stops, new_stops = seen_stops.unseen(df_stops)
+                        df_violations, new_violations = seen_violations.unseen(df_violations)
 
-        df['age_group'] = pd.cut(df['driver_age'],
-                                 bins=[0, 18, 30, 50, 70, 120],
-                                 labels=['Teen', 'Young Adult', 'Adult', 'Middle Age', 'Senior'])
+                        load_start = time.perf_counter()
+                        with self.load_transaction():
+                            self.insert_data(df_drivers, df_stops, df_violations,
+                                             method='upsert' if incremental else 'copy')
+                            if incremental:
+                                self.save_watermark(path, checksum, latest_stop(None, df_stops), len(df_stops))
+                        seen_drivers.add(new_drivers)
+                        seen_stops.add(new_stops)
+                        seen_violations.add(new_violations)
+                        entry['load_seconds'] = time.perf_counter() - load_start
+                        entry['drivers'], entry['stops'], entry['violations'] = len(df_drivers), len(df_stops), len(df_violations)
+                    except Exception as e:
+                        entry['status'] = 'failed'
+                        entry['error'] = f"{type(e).__name__}: {e}"
+                    report.append(entry)
 
-        df_drivers = df[['vehicle_number', 'driver_gender', 'driver_age', 'age_group', 'driver_race']].drop_duplicates()
-        df_stops = df[['vehicle_number', 'search_type', 'stop_date', 'stop_time',
-                       'stop_duration', 'country_name', 'drugs_related_stop',
-                       'search_conducted', 'is_arrested', 'stop_outcome']].drop_duplicates()
-        df_violations = df[['vehicle_number', 'violation_raw', 'violation']].drop_duplicates()
+                    if entry['status'] == 'ok':
+                        print(f"[{len(report)}/{len(paths)}] {path}: {entry['stops']} stops "
+                              f"(clean {entry['clean_seconds']:.2f}s, load {entry['load_seconds']:.2f}s)")
+                    else:
+                        print(f"[{len(report)}/{len(paths)}] {path}: FAILED - {entry['error']}")
 
-        return df_drivers, df_stops, df_violations
+        failed = [entry for entry in report if entry['status'] == 'failed']
+        unchanged = sum(entry['status'] == 'unchanged' for entry in report)
+        total_stops = sum(entry['stops'] for entry in report)
+        print(f"Ingested {len(report) - len(failed) - unchanged}/{len(paths)} files ({unchanged} unchanged), {total_stops} stops "
+              f"in {time.perf_counter() - start:.2f}s with {workers} workers.")
+        for entry in failed:
+            print(f"  FAILED {entry['file']}: {entry['error']}")
+        return report
 
-    def create_tables(self):
+    @contextmanager
+    def load_transaction(self):
+        # One file's rows commit together or not at all. Dimension codes
+        # handed out inside a rolled-back load are gone too, so the
+        # Dictionary starts over from the database.
+        if self.backend != 'postgres':
+            scope = embedded_transaction(self.mediator, True)
+        else:
+            scope = transaction_scope(self.connection, True)
+        try:
+            with scope:
+                yield
+        except Exception:
+            if self.dictionary is not None:
+                self.dictionary = self.make_dictionary()
+            raise
+
+    def create_tables(self, materialized_views=False, partition_by=None, encoded=False):
+        if self.backend != 'postgres' and (materialized_views or partition_by or encoded):
+            raise ValueError("Materialized views, partitioning and the encoded schema need PostgreSQL")
         self.mediator.execute("""
             CREATE TABLE IF NOT EXISTS officers (
                 officer_id TEXT PRIMARY KEY,
@@ -66,45 +459,183 @@ class traffic_stops:
         """)
         print("TABLE 'officers' created.")
 
-        self.mediator.execute("""
+        # Encoded schema: country, outcome, duration, violation and race become
+        # SMALLINT codes into dim_* lookup tables.
+        if encoded and self.dictionary is None:
+            create_dimensions(self.mediator)
+            self.dictionary = self.make_dictionary()
+        types = column_types(self.dictionary is not None)
+
+        self.mediator.execute(f"""
             CREATE TABLE IF NOT EXISTS drivers (
                 vehicle_number VARCHAR(20) PRIMARY KEY,
                 driver_gender CHAR(1) CHECK (driver_gender IN ('M', 'F')),
                 driver_age INT CHECK (driver_age BETWEEN 0 AND 120),
                 age_group VARCHAR(20),
-                driver_race VARCHAR(50)
+                driver_race {types['driver_race']}
             );
         """)
         print("TABLE 'drivers' created.")
 
-        self.mediator.execute("""
-            CREATE TABLE IF NOT EXISTS stops (
+        if partition_by:
+            self.create_partitioned_stops(partition_by)
+        else:
+            self.mediator.execute(f"""
+                CREATE TABLE IF NOT EXISTS stops (
+                    vehicle_number VARCHAR(20) PRIMARY KEY,
+                    search_type VARCHAR(100),
+                    stop_date DATE NOT NULL,
+                    stop_time TIME NOT NULL,
+                    stop_duration {types['stop_duration']},
+                    country_name {types['country_name']},
+                    drugs_related_stop BOOLEAN DEFAULT FALSE,
+                    search_conducted BOOLEAN DEFAULT FALSE,
+                    is_arrested BOOLEAN DEFAULT FALSE,
+                    stop_outcome {types['stop_outcome']},
+                    added_by TEXT REFERENCES officers(officer_id),
+                    FOREIGN KEY (vehicle_number) REFERENCES drivers(vehicle_number) ON DELETE CASCADE
+                );
+            """)
+            print("TABLE 'stops' created.")
+
+        # A partitioned stops has no unique vehicle_number to point at, so
+        # violations then references the driver instead.
+        self.mediator.execute(f"""
+            CREATE TABLE IF NOT EXISTS violations (
                 vehicle_number VARCHAR(20) PRIMARY KEY,
-                search_type VARCHAR(100),
-                stop_date DATE NOT NULL,
-                stop_time TIME NOT NULL,
-                stop_duration VARCHAR(20),
-                country_name VARCHAR(50),
-                drugs_related_stop BOOLEAN DEFAULT FALSE,
-                search_conducted BOOLEAN DEFAULT FALSE,
-                is_arrested BOOLEAN DEFAULT FALSE,
-                stop_outcome VARCHAR(50),
-                added_by TEXT REFERENCES officers(officer_id),
-                FOREIGN KEY (vehicle_number) REFERENCES drivers(vehicle_number) ON DELETE CASCADE
+                violation_raw {types['violation_raw']},
+                violation {types['violation']},
+                FOREIGN KEY (vehicle_number) REFERENCES {'drivers' if partition_by else 'stops'}(vehicle_number) ON DELETE CASCADE
             );
         """)
-        print("TABLE 'stops' created.")
+        print("TABLE 'violations' created.")
 
+        # One row per loaded source file, for incremental (delta) ingest.
         self.mediator.execute("""
-            CREATE TABLE IF NOT EXISTS violations (
-                vehicle_number VARCHAR(20) PRIMARY KEY,
-                violation_raw VARCHAR(100),
-                violation VARCHAR(50),
-                FOREIGN KEY (vehicle_number) REFERENCES stops(vehicle_number) ON DELETE CASCADE
+            CREATE TABLE IF NOT EXISTS ingest_watermarks (
+                source TEXT PRIMARY KEY,
+                file_checksum CHAR(64),
+                last_stop_at TIMESTAMP,
+                rows_loaded BIGINT NOT NULL DEFAULT 0,
+                loaded_at TIMESTAMPTZ NOT NULL DEFAULT now()
             );
         """)
-        print("TABLE 'violations' created.")
+        print("TABLE 'ingest_watermarks' created.")
+
+        if materialized_views:
+            create_materialized_views(self.mediator, self.view_rewriter())
+
+
+    def create_partitioned_stops(self, interval):
+        # stops range-partitioned on stop_date by month or year. The primary key
+        # has to include the partition key, hence (vehicle_number, stop_date).
+        # An existing plain stops table is migrated in place.
+        if self.table_exists('stops') and not is_partitioned(self.mediator):
+            self.migrate_stops_to_partitioned(interval)
+        else:
+            self.mediator.execute(PARTITIONED_STOPS.format(**column_types(self.dictionary is not None)))
+            self.mediator.execute(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF stops DEFAULT;")
+            print(f"TABLE 'stops' created, partitioned by {interval}.")
+        ensure_future_partitions(self.mediator, PARTITIONS_AHEAD, interval)
+
+    def migrate_stops_to_partitioned(self, interval):
+        # One transaction: rename the old table out of the way, create the
+        # partitioned stops with a partition per month/year of existing data
+        # (stray dates stay in the default partition), copy the rows over
+        # and drop the old table. The materialized views and
+        # the violations foreign key depend on the old table, so they are
+        # dropped first; the views are recreated (unpopulated) afterwards.
+        self.mediator.execute("SELECT stop_date, COUNT(*) FROM stops GROUP BY stop_date;")
+        day_counts = dict(self.mediator.fetchall())
+        self.mediator.execute("SELECT matviewname FROM pg_matviews WHERE matviewname = ANY(%s);",
+                              (list(MATERIALIZED_VIEWS),))
+        views = [row[0] for row in self.mediator.fetchall()]
+
+        start = time.perf_counter()
+        with transaction_scope(self.connection, True):
+            for name in views:
+                self.mediator.execute(f"DROP MATERIALIZED VIEW {name};")
+            self.mediator.execute("ALTER TABLE stops RENAME TO stops_unpartitioned;")
+            self.mediator.execute("ALTER TABLE stops_unpartitioned RENAME CONSTRAINT stops_pkey TO stops_unpartitioned_pkey;")
+            self.mediator.execute("ALTER TABLE IF EXISTS violations DROP CONSTRAINT IF EXISTS violations_vehicle_number_fkey;")
+            self.mediator.execute("""
+                ALTER TABLE IF EXISTS violations ADD CONSTRAINT violations_vehicle_number_fkey
+                FOREIGN KEY (vehicle_number) REFERENCES drivers(vehicle_number) ON DELETE CASCADE;
+            """)
+            self.mediator.execute(PARTITIONED_STOPS.format(**column_types(self.dictionary is not None)))
+            self.mediator.execute(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF stops DEFAULT;")
+            if day_counts:
+                ensure_partitions(self.mediator, *bulk_range(day_counts, interval, PARTITIONS_AHEAD), interval)
+            columns = ", ".join(STOP_COLUMNS + ['added_by'])
+            self.mediator.execute(f"INSERT INTO stops ({columns}) SELECT {columns} FROM stops_unpartitioned;")
+            rows = self.mediator.rowcount
+            self.mediator.execute("DROP TABLE stops_unpartitioned;")
+        print(f"TABLE 'stops' migrated to {interval} partitions: {rows} rows in {time.perf_counter() - start:.2f}s.")
 
+        if views:
+            create_materialized_views(self.mediator, self.view_rewriter())
+            print("Materialized views recreated; run refresh-views to populate them.")
+
+    def view_rewriter(self):
+        # View definitions look their codes up in the dim_* tables on refresh.
+        return dimension_literals if self.dictionary is not None else None
+
+    def table_exists(self, table):
+        self.mediator.execute("SELECT to_regclass(%s) IS NOT NULL;", (table,))
+        return self.mediator.fetchone()[0]
+
+    def create_future_partitions(self, ahead=None):
+        return ensure_future_partitions(self.mediator, ahead or PARTITIONS_AHEAD)
+
+    def archive_partitions(self, before):
+        detached = detach_partitions(self.mediator, before)
+        for name in detached:
+            print(f"  archive with: pg_dump -t {name} {self.database} > {name}.sql && psql -c 'DROP TABLE {name}'")
+        return detached
+
+    def prepare_partitions(self, df_stops):
+        # Make sure every month/year in the bulk of the batch has its partition
+        # before COPY, rather than letting the rows pile up in the default
+        # partition. Stray dates far from the bulk go to the default partition.
+        if self.backend != 'postgres':
+            return None
+        stop_dates = pd.to_datetime(df_stops['stop_date']).dropna()
+        interval = partition_interval(self.mediator)
+        if interval is None or stop_dates.empty:
+            return interval
+        day_counts = {day.date(): rows for day, rows in stop_dates.dt.normalize().value_counts().items()}
+        ensure_partitions(self.mediator, *bulk_range(day_counts, interval, PARTITIONS_AHEAD), interval)
+        return interval
+
+    def create_indexes(self, concurrently=False):
+        # CONCURRENTLY avoids blocking writers on a live database; right after a
+        # bulk load the plain build is faster.
+        # Partitioned tables can't build or drop indexes CONCURRENTLY, so a
+        # partitioned stops always gets the plain build.
+        if self.backend != 'postgres':
+            # DuckDB answers these scans from zone maps; SQLite keeps its primary keys only.
+            print(f"Analytics indexes are PostgreSQL-only; skipped for {self.backend}.")
+            return
+        mode = "CONCURRENTLY " if concurrently else ""
+        stops_mode = "" if is_partitioned(self.mediator) else mode
+        self.mediator.execute("""
+            SELECT indexname, tablename FROM pg_indexes
+            WHERE schemaname = current_schema()
+              AND tablename IN ('drivers', 'stops', 'violations')
+              AND indexname LIKE 'ix\\_%';
+        """)
+        existing = dict(self.mediator.fetchall())
+
+        for name in sorted(set(existing) - set(INDEXES)):
+            self.mediator.execute(f"DROP INDEX {stops_mode if existing[name] == 'stops' else mode}IF EXISTS {name};")
+            print(f"INDEX '{name}' dropped.")
+        for name, definition in INDEXES.items():
+            if name not in existing:
+                start = time.perf_counter()
+                index_mode = stops_mode if definition.startswith("ON stops ") else mode
+                self.mediator.execute(f"CREATE INDEX {index_mode}IF NOT EXISTS {name} {definition};")
+                print(f"INDEX '{name}' created in {time.perf_counter() - start:.2f}s.")
+        self.mediator.execute("ANALYZE drivers, stops, violations;")
 
     def insert_sample_officers(self):
         self.mediator.execute("""
@@ -116,17 +647,148 @@ class traffic_stops:
         """)
 
 
-    def insert_data(self, df_drivers, df_stops, df_violations):
-        df_drivers.to_sql('drivers', self.engine, if_exists='append', index=False)
-        df_stops.to_sql('stops', self.engine, if_exists='append', index=False)
-        df_violations.to_sql('violations', self.engine, if_exists='append', index=False)
+    def copy_frame(self, table, df):
+        # Stream the frame through an in-memory CSV buffer into COPY ... FROM STDIN.
+        # Float columns holding whole numbers (e.g. driver_age with NaNs) go out as
+        # nullable ints so INT columns accept them.
+        df = df.copy()
+        for column in df.columns:
+            if pd.api.types.is_float_dtype(df[column]):
+                values = df[column].dropna()
+                if (values == values.round()).all():
+                    df[column] = df[column].astype('Int64')
+
+        buffer = io.StringIO()
+        df.to_csv(buffer, index=False, header=False, date_format='%Y-%m-%d')
+        buffer.seek(0)
+
+        columns = ", ".join(df.columns)
+        start = time.perf_counter()
+        self.mediator.copy_expert(
+            f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer
+        )
+        elapsed = time.perf_counter() - start
+        rate = len(df) / elapsed if elapsed > 0 else float('inf')
+        print(f"COPY {table}: {len(df)} rows in {elapsed:.2f}s ({rate:,.0f} rows/sec)")
+        return len(df), elapsed
+
+    def upsert_frame(self, table, df, keys=('vehicle_number',)):
+        # COPY into a session temp table, then merge with INSERT ... ON CONFLICT
+        # DO UPDATE, so re-loading rows that are already there never fails on the
+        # primary key. Rows whose values didn't change are not rewritten.
+        if df.empty:
+            return 0
+        df = df.drop_duplicates(list(keys), keep='last')
+        staging = f"staging_{table}"
+        self.mediator.execute(f"CREATE TEMP TABLE IF NOT EXISTS {staging} (LIKE {table} INCLUDING DEFAULTS);")
+        self.mediator.execute(f"TRUNCATE {staging};")
+        self.copy_frame(staging, df)
+
+        columns = [column for column in df.columns if column not in keys]
+        key = ", ".join(keys)
+        start = time.perf_counter()
+        self.mediator.execute(f"""
+            INSERT INTO {table} ({key}, {', '.join(columns)})
+            SELECT {key}, {', '.join(columns)} FROM {staging}
+            ON CONFLICT ({key}) DO UPDATE
+            SET {', '.join(f"{column} = EXCLUDED.{column}" for column in columns)}
+            WHERE ({', '.join(f"{table}.{column}" for column in columns)})
+                IS DISTINCT FROM ({', '.join(f"EXCLUDED.{column}" for column in columns)});
+        """)
+        print(f"UPSERT {table}: {self.mediator.rowcount} rows written in {time.perf_counter() - start:.2f}s")
+        return self.mediator.rowcount
+
+    def insert_data(self, df_drivers, df_stops, df_violations, method='copy'):
+        # Parents first so the stops/violations foreign keys are satisfied.
+        if self.dictionary is not None:
+            df_drivers, df_stops, df_violations = (self.dictionary.encode_frame(df)
+                                                   for df in (df_drivers, df_stops, df_violations))
+        partitioned = self.prepare_partitions(df_stops) is not None
+        if self.backend != 'postgres':
+            # 'upsert' replaces rows by primary key; to_sql isn't offered.
+            for table, df in (('drivers', df_drivers), ('stops', df_stops), ('violations', df_violations)):
+                start = time.perf_counter()
+                self.mediator.insert_frame(table, df, replace=method == 'upsert')
+                print(f"INSERT {table}: {len(df)} rows in {time.perf_counter() - start:.2f}s")
+        elif method == 'copy':
+            self.copy_frame('drivers', df_drivers)
+            self.copy_frame('stops', df_stops)
+            self.copy_frame('violations', df_violations)
+        elif method == 'upsert':
+            self.upsert_frame('drivers', df_drivers)
+            self.upsert_frame('stops', df_stops, ('vehicle_number', 'stop_date') if partitioned else ('vehicle_number',))
+            self.upsert_frame('violations', df_violations)
+        else:
+            df_drivers.to_sql('drivers', self.engine, if_exists='append', index=False)
+            df_stops.to_sql('stops', self.engine, if_exists='append', index=False)
+            df_violations.to_sql('violations', self.engine, if_exists='append', index=False)
         print("Data inserted successfully.")
 
+    def write_snapshot(self, directory, filepath=None):
+        # Arrow snapshot for the dashboard: the cleaned CSV when a file is given
+        # (stamped with the current change watermark, as it is assumed to have
+        # just been loaded), otherwise the current database state.
+        if filepath:
+            df_drivers, df_stops, df_violations = self.load_and_clean_data(filepath)
+            return write_frames_snapshot(directory, df_drivers, df_stops, df_violations,
+                                         change_watermark(self.mediator))
+        return write_database_snapshot(self.mediator, directory)
+
+    def refresh_views(self, concurrently=True):
+        for name in MATERIALIZED_VIEWS:
+            refresh_view(self.mediator, name, concurrently)
+
+    def print_view_status(self):
+        for status in view_status(self.mediator):
+            if status['fresh']:
+                state = "fresh"
+            elif status['staleness_seconds'] is None:
+                state = "stale (never refreshed)"
+            else:
+                state = f"stale {status['staleness_seconds']:.0f}s"
+            last_ms = f"{status['duration_ms']:.0f} ms" if status['duration_ms'] is not None else "never refreshed"
+            print(f"{status['view_name']}: {state}, last refresh {status['refreshed_at']} ({last_ms})")
+
     def close(self):
         self.mediator.close()
         self.connection.close()
 
 def main():
+    parser = argparse.ArgumentParser(description="Load traffic stop CSVs into PostgreSQL.")
+    commands = parser.add_subparsers(dest='command')
+    ingest_parser = commands.add_parser('ingest', help="Clean many CSVs in a process pool and load them.")
+    ingest_parser.add_argument('sources', nargs='+', help="CSV files, directories or glob patterns")
+    ingest_parser.add_argument('--workers', type=int, default=os.cpu_count())
+    refresh_parser = commands.add_parser('refresh-views', help="Refresh the analytics materialized views.")
+    refresh_parser.add_argument('--every', type=int, help="Keep running, refreshing stale views every N seconds")
+    refresh_parser.add_argument('--blocking', action='store_true', help="Don't use REFRESH ... CONCURRENTLY")
+    commands.add_parser('view-status', help="Show materialized view staleness and refresh duration.")
+    commands.add_parser('indexes', help="Sync the managed analytics indexes (built CONCURRENTLY).")
+    snapshot_parser = commands.add_parser('snapshot', help="Write the Arrow snapshot the dashboard memory-maps.")
+    snapshot_parser.add_argument('--dir', default='snapshot', help="Snapshot directory")
+    snapshot_parser.add_argument('--from-csv', metavar='FILE', help="Snapshot this cleaned CSV instead of the database")
+    partitions_parser = commands.add_parser('partitions', help="Create upcoming stops partitions, detach old ones.")
+    partitions_parser.add_argument('--ahead', type=int, default=PARTITIONS_AHEAD,
+                                   help="Months/years of future partitions to keep ready")
+    partitions_parser.add_argument('--detach-before', type=date.fromisoformat, metavar='YYYY-MM-DD',
+                                   help="Detach partitions that end on or before this date, for archival")
+    parser.add_argument('--backend', choices=BACKENDS, default='postgres',
+                        help="Load into PostgreSQL or an embedded DuckDB/SQLite file")
+    parser.add_argument('--db-file', help="Embedded database file (default traffic_stops.<backend>)")
+    parser.add_argument('--materialized-views', action='store_true',
+                        help="Create (and populate after loading) the analytics materialized views")
+    parser.add_argument('--partition-by', choices=['month', 'year'],
+                        help="Range-partition stops on stop_date (migrates an existing stops table)")
+    parser.add_argument('--encoded', action='store_true',
+                        help="Store country, outcome, duration, violation and race as SMALLINT codes "
+                             "into dim_* lookup tables (new databases)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Skip unchanged files and upsert only rows newer than each file's watermark")
+    args = parser.parse_args()
+    if args.backend != 'postgres' and (args.command in ('refresh-views', 'view-status', 'snapshot', 'partitions')
+                                       or args.materialized_views or args.partition_by or args.encoded):
+        parser.error("materialized views, partitions, snapshots and --encoded need --backend postgres")
+
     # Config
     host = "localhost"
     port = 5432
@@ -134,25 +796,67 @@ def main():
     password = "vGpostgre"
     database = "traffic_stops"
     filepath = "/Users/Viji/Desktop/Guvi_python/MDTE21/guvi_projects/traffic_stops - traffic_stops_with_vehicle_number.csv"
+    chunksize = 100_000
+
+    if args.backend != 'postgres':
+        database = args.db_file or f"traffic_stops.{args.backend}"
 
     # Create instance
-    app = traffic_stops(host, port, user, password, database)
+    app = traffic_stops(host, port, user, password, database, args.backend)
 
-    # Step 1: Load + Clean Data
-    df_drivers, df_stops, df_violations = app.load_and_clean_data(filepath)
+    if args.command == 'refresh-views':
+        if args.every:
+            ViewRefresher(app.mediator, args.every, not args.blocking).run()
+        else:
+            app.refresh_views(not args.blocking)
+        app.close()
+        return
+    if args.command == 'view-status':
+        app.print_view_status()
+        app.close()
+        return
+    if args.command == 'indexes':
+        app.create_indexes(concurrently=True)
+        app.close()
+        return
+    if args.command == 'snapshot':
+        app.write_snapshot(args.dir, args.from_csv)
+        app.close()
+        return
+    if args.command == 'partitions':
+        app.create_future_partitions(args.ahead)
+        if args.detach_before:
+            app.archive_partitions(args.detach_before)
+        app.close()
+        return
 
-    # Step 2: Create Tables
-    app.create_tables()
+    # Step 1: Create Tables
+    app.create_tables(args.materialized_views, args.partition_by, args.encoded)
 
-    # Step 3: Insert Dummy officer Data
+    # Step 2: Insert Dummy officer Data
     app.insert_sample_officers() 
 
-    # Step 4: Insert Data
-    app.insert_data(df_drivers, df_stops, df_violations)
+    # Step 3: Load + Clean + Insert Data
+    if args.command == 'ingest':
+        report = app.ingest_files(resolve_sources(args.sources), args.workers, args.incremental)
+    elif args.incremental:
+        app.load_incremental(filepath, chunksize)
+    else:
+        app.load_streaming(filepath, chunksize)
+
+    # Step 4: Build the analytics indexes once the bulk load is done
+    app.create_indexes()
+
+    # Step 5: Populate the materialized views
+    if args.materialized_views:
+        app.refresh_views()
 
     # Close
     app.close()
 
+    if args.command == 'ingest' and any(entry['status'] == 'failed' for entry in report):
+        raise SystemExit(1)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,159 @@
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from functools import wraps
+
+import numpy as np
+
+from cache import estimate_size
+
+QUANTILES = (50, 95, 99)
+
+
+class Metrics:
+    # Per-name timings for CheckPostAnalytics methods and dashboard data loads:
+    # cumulative totals plus the last `window` samples for rolling percentiles.
+    # DB time, rows and bytes are added by run_query() through the sample of
+    # the call currently being measured on this thread.
+    def __init__(self, window=1024):
+        self.window = window
+        self.samples = defaultdict(lambda: deque(maxlen=self.window))  # name -> (wall_ms, db_ms, rows, bytes)
+        self.totals = defaultdict(lambda: {'count': 0, 'errors': 0, 'wall_ms': 0.0, 'db_ms': 0.0,
+                                           'rows': 0, 'bytes': 0})
+        self.current = threading.local()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, name):
+        # Yields the sample dict so callers that don't go through run_query()
+        # (e.g. snapshot reads) can fill in rows/bytes themselves.
+        sample = {'db_ms': 0.0, 'rows': 0, 'bytes': 0}
+        parent = getattr(self.current, 'sample', None)
+        self.current.sample = sample
+        start = time.perf_counter()
+        error = False
+        try:
+            yield sample
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.current.sample = parent
+            self.record(name, (time.perf_counter() - start) * 1000, sample['db_ms'],
+                        sample['rows'], sample['bytes'], error)
+            if parent is not None:
+                for key in ('db_ms', 'rows', 'bytes'):
+                    parent[key] += sample[key]
+
+    def note_query(self, db_seconds, rows):
+        sample = getattr(self.current, 'sample', None)
+        if sample is not None:
+            sample['db_ms'] += db_seconds * 1000
+            sample['rows'] += len(rows)
+            sample['bytes'] += estimate_size(rows)
+
+    def record(self, name, wall_ms, db_ms=0.0, rows=0, nbytes=0, error=False):
+        with self.lock:
+            self.samples[name].append((wall_ms, db_ms, rows, nbytes))
+            totals = self.totals[name]
+            totals['count'] += 1
+            totals['errors'] += error
+            totals['wall_ms'] += wall_ms
+            totals['db_ms'] += db_ms
+            totals['rows'] += rows
+            totals['bytes'] += nbytes
+
+    def reset(self):
+        with self.lock:
+            self.samples.clear()
+            self.totals.clear()
+
+    def summary(self):
+        # One row per name, slowest p95 first.
+        with self.lock:
+            snapshot = {name: (np.array(samples), dict(self.totals[name])) for name, samples in self.samples.items()}
+        rows = []
+        for name, (samples, totals) in snapshot.items():
+            wall = np.percentile(samples[:, 0], QUANTILES)
+            rows.append({
+                'name': name,
+                'calls': totals['count'],
+                'errors': totals['errors'],
+                'p50_ms': float(wall[0]),
+                'p95_ms': float(wall[1]),
+                'p99_ms': float(wall[2]),
+                'avg_db_ms': float(samples[:, 1].mean()),
+                'avg_rows': float(samples[:, 2].mean()),
+                'avg_bytes': float(samples[:, 3].mean()),
+            })
+        return sorted(rows, key=lambda row: row['p95_ms'], reverse=True)
+
+    def prometheus(self):
+        # Prometheus text exposition format: a summary of wall time per name
+        # plus counters for DB time, rows, bytes and errors.
+        lines = [
+            "# HELP secure_check_call_seconds Wall time of analytics calls and dashboard loads.",
+            "# TYPE secure_check_call_seconds summary",
+        ]
+        with self.lock:
+            snapshot = {name: (np.array(samples), dict(self.totals[name])) for name, samples in self.samples.items()}
+        for name, (samples, totals) in sorted(snapshot.items()):
+            for quantile, value in zip(QUANTILES, np.percentile(samples[:, 0], QUANTILES)):
+                lines.append(f'secure_check_call_seconds{{name="{name}",quantile="{quantile / 100}"}} {value / 1000:.6f}')
+            lines.append(f'secure_check_call_seconds_sum{{name="{name}"}} {totals["wall_ms"] / 1000:.6f}')
+            lines.append(f'secure_check_call_seconds_count{{name="{name}"}} {totals["count"]}')
+        for metric, key, help_text, scale in (
+            ('secure_check_db_seconds_total', 'db_ms', "Time spent in the database.", 1000),
+            ('secure_check_rows_total', 'rows', "Rows fetched.", 1),
+            ('secure_check_bytes_total', 'bytes', "Approximate bytes fetched.", 1),
+            ('secure_check_errors_total', 'errors', "Calls that raised.", 1),
+        ):
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} counter")
+            for name, (_, totals) in sorted(snapshot.items()):
+                lines.append(f'{metric}{{name="{name}"}} {totals[key] / scale:g}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        # Atomic replace, for the node_exporter textfile collector.
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.prom.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(self.prometheus())
+        os.replace(tmp_path, path)
+
+
+class MetricsExporter(threading.Thread):
+    # Rewrites the Prometheus text file every `interval` seconds.
+    def __init__(self, metrics, path, interval=15):
+        super().__init__(daemon=True)
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.metrics.write_prometheus(self.path)
+            except OSError as e:
+                print(f"Metrics export failed: {e}")
+
+    def stop(self):
+        self.stopped.set()
+
+
+def instrumented(method):
+    # Records a CheckPostAnalytics method on self.metrics (when set). Goes above
+    # @cached so cache hits are measured too.
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.metrics is None:
+            return method(self, *args, **kwargs)
+        with self.metrics.measure(method.__name__):
+            return method(self, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,145 @@
+import re
+from collections import Counter
+from datetime import date, timedelta
+
+from backends import transaction_scope
+
+# Range partitions of stops on stop_date. Partitions are named stops_YYYY_MM
+# (month) or stops_YYYY (year); stops_default catches dates with no partition.
+DEFAULT_PARTITION = 'stops_default'
+PARTITION_NAME = re.compile(r'^stops_(\d{4})(?:_(\d{2}))?$')
+
+PARTITIONS_QUERY = """
+    SELECT c.relname
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'stops'::regclass
+    ORDER BY c.relname;
+"""
+
+
+def partition_for(day, interval):
+    # (name, first day, first day of the next partition) of the partition holding `day`.
+    if interval == 'year':
+        return f"stops_{day.year}", date(day.year, 1, 1), date(day.year + 1, 1, 1)
+    start = date(day.year, day.month, 1)
+    end = date(day.year + day.month // 12, day.month % 12 + 1, 1)
+    return f"stops_{day.year}_{day.month:02d}", start, end
+
+
+def partition_number(start, interval):
+    # Consecutive partitions have consecutive numbers.
+    return start.year if interval == 'year' else start.year * 12 + start.month
+
+
+def bulk_range(day_counts, interval, gap=3):
+    # (first, last) day of the busiest run of populated partitions no more
+    # than `gap` partitions apart, for {day: rows}. A mistyped 1900-01-01 or
+    # 2999-12-31 falls outside it and lands in the default partition rather
+    # than creating every partition in between.
+    counts = Counter()
+    for day, rows in day_counts.items():
+        counts[partition_for(day, interval)[1]] += rows
+    runs = []
+    for start in sorted(counts):
+        if runs and partition_number(start, interval) - partition_number(runs[-1][-1], interval) <= gap:
+            runs[-1].append(start)
+        else:
+            runs.append([start])
+    busiest = max(runs, key=lambda run: sum(counts[start] for start in run))
+    return busiest[0], partition_for(busiest[-1], interval)[2] - timedelta(days=1)
+
+
+def is_partitioned(mediator):
+    mediator.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass('stops');")
+    row = mediator.fetchone()
+    return bool(row and row[0])
+
+
+def partition_names(mediator):
+    mediator.execute(PARTITIONS_QUERY)
+    return [row[0] for row in mediator.fetchall()]
+
+
+def partition_interval(mediator):
+    # None when stops isn't partitioned; otherwise read off the partition names.
+    if not is_partitioned(mediator):
+        return None
+    for name in partition_names(mediator):
+        match = PARTITION_NAME.match(name)
+        if match:
+            return 'month' if match.group(2) else 'year'
+    return 'month'
+
+
+def create_partition(mediator, name, start, end):
+    # Rows that already landed in the default partition for this range are
+    # moved into the new partition before it is attached; otherwise attaching
+    # would fail on the default partition's constraint. The move is one
+    # transaction unless the caller already has one open.
+    mediator.execute(f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE stop_date >= %s AND stop_date < %s);",
+                     (start, end))
+    if not mediator.fetchone()[0]:
+        mediator.execute(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF stops FOR VALUES FROM (%s) TO (%s);",
+                         (start, end))
+        return
+    connection = mediator.connection
+    with transaction_scope(connection, connection.autocommit):
+        mediator.execute(f"CREATE TABLE {name} (LIKE stops INCLUDING DEFAULTS INCLUDING CONSTRAINTS);")
+        mediator.execute(f"""
+            WITH moved AS (
+                DELETE FROM {DEFAULT_PARTITION}
+                WHERE stop_date >= %s AND stop_date < %s
+                RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved;
+        """, (start, end))
+        print(f"Moved {mediator.rowcount} rows from {DEFAULT_PARTITION} into {name}.")
+        mediator.execute(f"ALTER TABLE stops ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s);", (start, end))
+
+
+def ensure_partitions(mediator, first, last, interval=None):
+    # Create every missing partition covering first..last (dates, inclusive).
+    interval = interval or partition_interval(mediator)
+    existing = set(partition_names(mediator))
+    created = []
+    day = first
+    while day <= last:
+        name, start, end = partition_for(day, interval)
+        if name not in existing:
+            create_partition(mediator, name, start, end)
+            existing.add(name)
+            created.append(name)
+        day = end
+    if created:
+        print(f"PARTITIONS {', '.join(created)} created.")
+    return created
+
+
+def ensure_future_partitions(mediator, ahead=3, interval=None):
+    # The current partition plus `ahead` more, so new stops never fall through
+    # to the default partition. Safe to run from cron.
+    interval = interval or partition_interval(mediator)
+    today = date.today()
+    last = today
+    for _ in range(ahead):
+        last = partition_for(last, interval)[2]
+    return ensure_partitions(mediator, today, last, interval)
+
+
+def detach_partitions(mediator, before):
+    # Detaching is a catalog change, not a data copy: each partition entirely
+    # before `before` becomes a standalone table that can be dumped and dropped.
+    # (DETACH ... CONCURRENTLY isn't allowed while a default partition exists.)
+    interval = partition_interval(mediator)
+    detached = []
+    for name in partition_names(mediator):
+        match = PARTITION_NAME.match(name)
+        if not match:
+            continue
+        _, _, end = partition_for(date(int(match.group(1)), int(match.group(2) or 1), 1), interval)
+        if end <= before:
+            mediator.execute(f"ALTER TABLE stops DETACH PARTITION {name};")
+            detached.append(name)
+            print(f"PARTITION '{name}' detached.")
+    return detached
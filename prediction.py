@@ -0,0 +1,130 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+FEATURES = ['country_name', 'age_group', 'driver_gender', 'driver_race',
+            'time_of_day', 'search_conducted', 'drugs_related_stop']
+TARGETS = ['stop_outcome', 'violation']
+
+# Finest to coarsest. When a group has too few past stops to be trusted, the
+# prediction backs off to the next, coarser grouping.
+BACKOFF_LEVELS = [
+    FEATURES,
+    ['country_name', 'age_group', 'driver_gender', 'time_of_day', 'search_conducted', 'drugs_related_stop'],
+    ['country_name', 'age_group', 'driver_gender', 'search_conducted', 'drugs_related_stop'],
+    ['country_name', 'search_conducted', 'drugs_related_stop'],
+    ['country_name'],
+    [],
+]
+
+
+def time_of_day(stop_time):
+    # Same buckets as the time-of-day analytics in sql.py.
+    hour = stop_time.hour
+    if 5 <= hour <= 11:
+        return 'Morning'
+    if 12 <= hour <= 16:
+        return 'Afternoon'
+    if 17 <= hour <= 20:
+        return 'Evening'
+    return 'Night'
+
+
+class PredictionEngine:
+    # Conditional frequency tables: for each target and backoff level, a dense
+    # count array indexed by the codes of that level's features, with the
+    # target label as the last axis. Prediction is a handful of array lookups.
+    def __init__(self, min_support=20):
+        self.min_support = min_support
+        self.vocab = {name: {} for name in FEATURES + TARGETS}
+        self.tables = {target: [np.zeros([0] * (len(level) + 1), dtype=np.int32) for level in BACKOFF_LEVELS]
+                       for target in TARGETS}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_counts(cls, rows, min_support=20):
+        # rows: (*FEATURES, stop_outcome, violation, count) as returned by
+        # CheckPostAnalytics.get_prediction_counts().
+        engine = cls(min_support)
+        df = pd.DataFrame(rows, columns=FEATURES + TARGETS + ['count'])
+        codes = {}
+        for name in FEATURES + TARGETS:
+            values = df[name].astype(object).where(df[name].notna(), None)
+            uniques = list(dict.fromkeys(values))
+            engine.vocab[name] = {value: code for code, value in enumerate(uniques)}
+            codes[name] = values.map(engine.vocab[name]).to_numpy(dtype=np.intp)
+
+        counts = df['count'].to_numpy(dtype=np.int64)
+        feature_shape = [len(engine.vocab[name]) for name in FEATURES]
+        for target in TARGETS:
+            known = df[target].notna().to_numpy()  # stops without an outcome/violation don't vote
+            full = np.zeros(feature_shape + [len(engine.vocab[target])], dtype=np.int64)
+            np.add.at(full, tuple(codes[name][known] for name in FEATURES + [target]), counts[known])
+            for index, level in enumerate(BACKOFF_LEVELS):
+                dropped = tuple(axis for axis, name in enumerate(FEATURES) if name not in level)
+                engine.tables[target][index] = full.sum(axis=dropped).astype(np.int32)
+        return engine
+
+    def predict(self, target, features):
+        # Returns (label, confidence, number of features used), or (None, 0.0, 0)
+        # when nothing has been observed yet.
+        # The engine is shared between sessions, so read vocab and tables
+        # under the lock observe() writes them under.
+        with self.lock:
+            labels = list(self.vocab[target])
+            for index, level in enumerate(BACKOFF_LEVELS):
+                key = tuple(self.vocab[name].get(features.get(name)) for name in level)
+                if None in key:
+                    continue
+                counts = self.tables[target][index][key]
+                total = counts.sum()
+                if total >= self.min_support or (not level and total > 0):
+                    best = int(counts.argmax())
+                    return labels[best], float(counts[best] / total), len(level)
+        return None, 0.0, 0
+
+    def observe(self, features, stop_outcome, violation, count=1):
+        # Incremental update after a new stop is saved: bump every backoff level.
+        values = dict(features, stop_outcome=stop_outcome, violation=violation)
+        with self.lock:
+            codes = {name: self.code(name, values.get(name)) for name in FEATURES + TARGETS}
+            for target in TARGETS:
+                for index, level in enumerate(BACKOFF_LEVELS):
+                    key = tuple(codes[name] for name in level) + (codes[target],)
+                    self.tables[target][index][key] += count
+
+    def observe_stops(self, df_drivers, df_stops, df_violations):
+        # observe() for a batch of saved stops, joined like
+        # CheckPostAnalytics.get_prediction_counts and counted per combination.
+        df = df_stops.merge(df_drivers, on='vehicle_number').merge(
+            df_violations[['vehicle_number', 'violation']], on='vehicle_number', how='left')
+        if df.empty:
+            return
+        df['time_of_day'] = df['stop_time'].map(lambda value: time_of_day(value) if pd.notna(value) else None)
+        df = df[FEATURES + TARGETS].astype(object).where(df[FEATURES + TARGETS].notna(), None)
+        for row in df.groupby(FEATURES + TARGETS, dropna=False).size().reset_index(name='count').itertuples(index=False):
+            values = row._asdict()
+            self.observe({name: values[name] for name in FEATURES}, values['stop_outcome'], values['violation'],
+                         values['count'])
+
+    def code(self, name, value):
+        # Unseen values get a new code; the count arrays grow along that axis
+        # first, so the code never points past the end of a table.
+        vocab = self.vocab[name]
+        if value not in vocab:
+            size = len(vocab) + 1
+            for target in TARGETS:
+                for index, level in enumerate(BACKOFF_LEVELS):
+                    if name == target:
+                        axis = len(level)
+                    elif name in level:
+                        axis = level.index(name)
+                    else:
+                        continue
+                    table = self.tables[target][index]
+                    padding = [(0, 0)] * table.ndim
+                    padding[axis] = (0, size - table.shape[axis])
+                    self.tables[target][index] = np.pad(table, padding)
+            vocab[value] = size - 1
+        return vocab[value]
@@ -0,0 +1,108 @@
+import argparse
+import json
+
+from sql import ANALYTIC_METHODS, CheckPostAnalytics
+
+LARGE_TABLES = ['drivers', 'stops', 'violations']
+
+# Analytics that aggregate every row by design; a full scan is the right plan
+# for them, so their sequential scans are reported but don't fail the check.
+EXPECTED_FULL_SCANS = {
+    'get_highest_arrest_rate_by_age_group',
+    'get_gender_distribution_by_country',
+    'get_race_gender_highest_search_rate',
+    'get_peak_traffic_stop_time',
+    'get_average_stop_duration_by_violation',
+    'get_arrest_rate_by_time_of_day',
+    'get_rarely_flagged_violations',
+    'get_country_with_highest_drug_related_rate',
+    'get_arrest_rate_by_country_violation',
+    'get_yearly_stops_arrests_by_country',
+    'get_violation_trends_by_age_race',
+    'get_time_period_analysis_of_stops',
+    'get_high_search_arrest_violations',
+    'get_driver_demographics_by_country',
+    'get_top_5_highest_arrest_violations',
+}
+
+
+def table_sizes(analytics):
+    rows, _ = analytics.run_query("""
+        SELECT c.relname, c.reltuples::BIGINT
+        FROM pg_class c
+        WHERE c.relkind IN ('r', 'p') AND c.relnamespace = current_schema()::regnamespace;
+    """)
+    return dict(rows)
+
+
+def walk(node):
+    yield node
+    for child in node.get('Plans', []):
+        yield from walk(child)
+
+
+def is_large_table(relation, sizes, min_rows):
+    # Partitions (stops_2024_01, ...) count as their parent table.
+    parent = next((table for table in LARGE_TABLES
+                   if relation == table or relation.startswith(table + '_')), None)
+    return parent is not None and sizes.get(relation, 0) >= min_rows
+
+
+def check_method(analytics, method_name, sizes, min_rows):
+    result = {'method': method_name, 'execution_ms': 0.0, 'shared_hit': 0,
+              'shared_read': 0, 'seq_scans': []}
+    for plan in analytics.explain(method_name):
+        result['execution_ms'] += plan['Execution Time']
+        root = plan['Plan']
+        result['shared_hit'] += root.get('Shared Hit Blocks', 0)
+        result['shared_read'] += root.get('Shared Read Blocks', 0)
+        for node in walk(root):
+            relation = node.get('Relation Name')
+            if node['Node Type'] in ('Seq Scan', 'Parallel Seq Scan') and is_large_table(relation, sizes, min_rows):
+                result['seq_scans'].append(f"{relation} ({node.get('Actual Rows', 0)} rows)")
+    result['regression'] = bool(result['seq_scans']) and method_name not in EXPECTED_FULL_SCANS
+    return result
+
+
+def check_plans(analytics, min_rows=100_000):
+    sizes = table_sizes(analytics)
+    return [check_method(analytics, method_name, sizes, min_rows) for method_name in ANALYTIC_METHODS]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EXPLAIN (ANALYZE, BUFFERS) every analytics query "
+                                                 "and flag sequential scans on large tables.")
+    parser.add_argument('--min-rows', type=int, default=100_000,
+                        help="Tables with at least this many rows count as large")
+    parser.add_argument('--json', help="Also write the full report to this file")
+    args = parser.parse_args()
+
+    analytics = CheckPostAnalytics(
+        host="localhost",
+        port=5432,
+        user="postgres",
+        password="vGpostgre",
+        database="traffic_stops"
+    )
+    report = check_plans(analytics, args.min_rows)
+    analytics.close()
+
+    for result in report:
+        status = "SEQ SCAN" if result['regression'] else ("full scan (expected)" if result['seq_scans'] else "ok")
+        print(f"{result['method']:<45} {result['execution_ms']:>9.1f} ms  "
+              f"hit={result['shared_hit']:<8} read={result['shared_read']:<8} {status}")
+        for scan in result['seq_scans']:
+            print(f"    seq scan on {scan}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    regressions = [result['method'] for result in report if result['regression']]
+    if regressions:
+        print(f"{len(regressions)} queries fell back to a sequential scan: {', '.join(regressions)}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
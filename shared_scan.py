@@ -0,0 +1,210 @@
+# One pass over drivers LEFT JOIN stops LEFT JOIN violations, grouped with
+# GROUPING SETS, that answers a family of analytics that would otherwise each
+# scan and join the same tables: the time-of-day pair, the violation family,
+# the per-country, age-group and race/gender rates, and the Overview metrics.
+# fan_out() reshapes the grouped rows into exactly what each method returns.
+#
+# has_stop / has_violation sit in the grouping sets so that groups coming from
+# drivers without a stop (or stops without a violation) never mix with real
+# NULL values; the methods' inner joins only see the has_* = TRUE groups.
+# On the partitioned schema a vehicle can have several stops, so its driver
+# and violation rows repeat once per stop: counts of drivers or violations
+# are COUNT(DISTINCT) over their vehicle numbers.
+SHARED_SCAN_QUERY = """
+    WITH base AS (
+        SELECT
+            d.vehicle_number AS driver_vehicle,
+            v.vehicle_number AS violation_vehicle,
+            d.driver_gender,
+            d.age_group,
+            d.driver_race,
+            d.driver_age,
+            s.vehicle_number IS NOT NULL AS has_stop,
+            v.vehicle_number IS NOT NULL AS has_violation,
+            s.country_name,
+            s.is_arrested,
+            s.search_conducted,
+            s.drugs_related_stop,
+            s.stop_outcome,
+            s.stop_duration,
+            CASE
+                WHEN s.vehicle_number IS NULL THEN NULL
+                WHEN EXTRACT(HOUR FROM s.stop_time) BETWEEN 5 AND 11 THEN 'Morning'
+                WHEN EXTRACT(HOUR FROM s.stop_time) BETWEEN 12 AND 16 THEN 'Afternoon'
+                WHEN EXTRACT(HOUR FROM s.stop_time) BETWEEN 17 AND 20 THEN 'Evening'
+                ELSE 'Night'
+            END AS time_of_day,
+            v.violation
+        FROM drivers d
+        LEFT JOIN stops s ON s.vehicle_number = d.vehicle_number
+        LEFT JOIN violations v ON v.vehicle_number = d.vehicle_number
+    )
+    SELECT
+        CASE
+            WHEN GROUPING(time_of_day) = 0 THEN 'time_of_day'
+            WHEN GROUPING(violation) = 0 THEN 'violation'
+            WHEN GROUPING(country_name) = 0 THEN 'country'
+            WHEN GROUPING(driver_race) = 0 THEN 'race_gender'
+            WHEN GROUPING(age_group) = 0 THEN 'age_group'
+            WHEN GROUPING(driver_gender) = 0 THEN 'gender'
+            ELSE 'total'
+        END AS grouping_set,
+        has_stop,
+        has_violation,
+        time_of_day,
+        violation,
+        country_name,
+        age_group,
+        driver_race,
+        driver_gender,
+        COUNT(*) AS row_count,
+        COUNT(DISTINCT driver_vehicle) AS drivers,
+        COUNT(DISTINCT violation_vehicle) AS violations,
+        COUNT(*) FILTER (WHERE has_stop) AS total_stops,
+        COUNT(*) FILTER (WHERE is_arrested) AS total_arrests,
+        COUNT(*) FILTER (WHERE search_conducted) AS searched,
+        COUNT(*) FILTER (WHERE search_conducted OR is_arrested) AS searched_or_arrested,
+        COUNT(*) FILTER (WHERE drugs_related_stop) AS drug_related,
+        COUNT(*) FILTER (WHERE LOWER(stop_outcome) = 'arrest') AS arrest_outcomes,
+        COUNT(*) FILTER (WHERE LOWER(stop_outcome) = 'warning') AS warning_outcomes,
+        COUNT(DISTINCT violation_vehicle) FILTER (WHERE driver_age < 25) AS under_25,
+        ROUND(AVG(
+            CASE stop_duration
+                WHEN '<5 Min' THEN 3
+                WHEN '6-15 Min' THEN 10
+                WHEN '16-30 Min' THEN 23
+                WHEN '30+ Min' THEN 35
+            END
+        ), 2) AS avg_duration_minutes,
+        ROUND((COUNT(*) FILTER (WHERE is_arrested)::FLOAT
+               / NULLIF(COUNT(*) FILTER (WHERE has_stop), 0) * 100)::NUMERIC, 2) AS arrest_rate_percent,
+        ROUND((COUNT(*) FILTER (WHERE search_conducted)::FLOAT
+               / NULLIF(COUNT(*) FILTER (WHERE has_stop), 0) * 100)::NUMERIC, 2) AS search_rate_percent,
+        ROUND((COUNT(*) FILTER (WHERE drugs_related_stop)::FLOAT
+               / NULLIF(COUNT(*) FILTER (WHERE has_stop), 0) * 100)::NUMERIC, 2) AS drug_related_rate_percent
+    FROM base
+    GROUP BY GROUPING SETS (
+        (),
+        (has_stop, time_of_day),
+        (has_violation, violation),
+        (has_stop, country_name),
+        (driver_gender),
+        (has_stop, age_group),
+        (has_stop, driver_race, driver_gender)
+    );
+"""
+
+# The CheckPostAnalytics methods fan_out() produces results for.
+SHARED_SCAN_METHODS = [
+    'get_highest_arrest_rate_by_age_group',
+    'get_race_gender_highest_search_rate',
+    'get_peak_traffic_stop_time',
+    'get_average_stop_duration_by_violation',
+    'get_arrest_rate_by_time_of_day',
+    'get_violation_search_arrest_stats',
+    'get_common_violations_under_25',
+    'get_rarely_flagged_violations',
+    'get_country_with_highest_drug_related_rate',
+    'get_country_with_most_search_stops',
+    'get_high_search_arrest_violations',
+    'get_top_5_highest_arrest_violations',
+    'get_overview_summary',
+]
+
+
+def order(groups, key, descending=True, limit=None):
+    # ORDER BY with PostgreSQL's NULL placement: NULLs sort as the largest
+    # value, so first when descending and last when ascending.
+    present = sorted((g for g in groups if g[key] is not None), key=lambda g: g[key], reverse=descending)
+    missing = [g for g in groups if g[key] is None]
+    ordered = missing + present if descending else present + missing
+    return ordered[:limit] if limit else ordered
+
+
+def result(groups, columns):
+    return [tuple(g[column] for column in columns) for g in groups], columns
+
+
+def ranks(groups, numerator):
+    # RANK() OVER (ORDER BY numerator / total_stops DESC).
+    ratios = [g[numerator] / g['total_stops'] for g in groups]
+    return [1 + sum(other > ratio for other in ratios) for ratio in ratios]
+
+
+def fan_out(rows, columns):
+    groups = {}
+    for row in rows:
+        group = dict(zip(columns, row))
+        groups.setdefault(group['grouping_set'], []).append(group)
+
+    times = [g for g in groups.get('time_of_day', []) if g['has_stop']]
+    countries = [g for g in groups.get('country', []) if g['has_stop']]
+    age_groups = [g for g in groups.get('age_group', []) if g['has_stop']]
+    race_genders = [g for g in groups.get('race_gender', []) if g['has_stop']]
+    all_violations = [g for g in groups.get('violation', []) if g['has_violation']]
+    violations = [g for g in all_violations if g['total_stops'] > 0]
+
+    high_search = [dict(g) for g in violations]
+    for g, search_rank, arrest_rank in zip(high_search, ranks(high_search, 'searched'),
+                                           ranks(high_search, 'total_arrests')):
+        g['search_rank'], g['arrest_rank'] = search_rank, arrest_rank
+    high_search.sort(key=lambda g: (g['search_rank'], g['arrest_rank']))
+
+    results = {
+        'get_highest_arrest_rate_by_age_group': result(
+            order(age_groups, 'arrest_rate_percent', limit=1), ['age_group', 'arrest_rate_percent']),
+        'get_race_gender_highest_search_rate': result(
+            order(race_genders, 'search_rate_percent', limit=1),
+            ['driver_race', 'driver_gender', 'search_rate_percent']),
+        'get_peak_traffic_stop_time': result(
+            order(times, 'total_stops', limit=1), ['time_of_day', 'total_stops']),
+        'get_average_stop_duration_by_violation': result(
+            order(violations, 'avg_duration_minutes'), ['violation', 'avg_duration_minutes']),
+        'get_arrest_rate_by_time_of_day': result(
+            order(times, 'arrest_rate_percent'),
+            ['time_of_day', 'total_stops', 'total_arrests', 'arrest_rate_percent']),
+        'get_violation_search_arrest_stats': result(
+            order([g for g in violations if g['searched_or_arrested'] > 0], 'searched_or_arrested'),
+            ['violation', 'searched_or_arrested']),
+        'get_common_violations_under_25': result(
+            order([g for g in all_violations if g['under_25'] > 0], 'under_25'), ['violation', 'under_25']),
+        'get_rarely_flagged_violations': result(
+            order(violations, 'searched_or_arrested', descending=False, limit=1),
+            ['violation', 'searched_or_arrested']),
+        'get_country_with_highest_drug_related_rate': result(
+            order(countries, 'drug_related_rate_percent', limit=1),
+            ['country_name', 'total_stops', 'drug_related', 'drug_related_rate_percent']),
+        'get_country_with_most_search_stops': result(
+            order([g for g in countries if g['searched'] > 0], 'searched', limit=1), ['country_name', 'searched']),
+        'get_high_search_arrest_violations': result(
+            high_search, ['violation', 'search_rate_percent', 'arrest_rate_percent', 'search_rank', 'arrest_rank']),
+        'get_top_5_highest_arrest_violations': result(
+            order(violations, 'arrest_rate_percent', limit=5),
+            ['violation', 'total_stops', 'total_arrests', 'arrest_rate_percent']),
+    }
+
+    # Rename to the column names each method's own query uses.
+    renames = {
+        'get_highest_arrest_rate_by_age_group': ['age_group', 'arrest_rate'],
+        'get_violation_search_arrest_stats': ['violation', 'incident_count'],
+        'get_common_violations_under_25': ['violation', 'violation_count'],
+        'get_rarely_flagged_violations': ['violation', 'search_or_arrest_count'],
+        'get_country_with_highest_drug_related_rate': ['country_name', 'total_stops', 'drug_related_count',
+                                                       'drug_related_rate_percent'],
+        'get_country_with_most_search_stops': ['country_name', 'search_conducted_count'],
+    }
+    for name, names in renames.items():
+        results[name] = (results[name][0], names)
+
+    total = groups['total'][0]
+    results['get_overview_summary'] = {
+        'total_stops': total['total_stops'],
+        'total_arrests': total['arrest_outcomes'],
+        'total_warnings': total['warning_outcomes'],
+        'drug_related_stops': total['drug_related'],
+        'violations': [(g['violation'], g['violations']) for g in order(all_violations, 'violations')
+                       if g['violation'] is not None],
+        'genders': [(g['driver_gender'], g['drivers']) for g in order(groups.get('gender', []), 'drivers')
+                    if g['driver_gender'] is not None],
+    }
+    return results
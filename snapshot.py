@@ -0,0 +1,283 @@
+import bisect
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+
+from encoding import decoded_select, is_encoded
+
+# Arrow IPC snapshot of drivers / stops / violations for the dashboard. Files are
+# memory-mapped, so a cold start reads no rows up front and every dashboard
+# process shares the same pages of the OS cache. Low-cardinality text columns
+# are dictionary-encoded (categoricals in pandas).
+DICTIONARY = pa.dictionary(pa.int32(), pa.string())
+SNAPSHOT_SCHEMAS = {
+    'drivers': pa.schema([
+        ('vehicle_number', pa.string()),
+        ('driver_gender', DICTIONARY),
+        ('driver_age', pa.int32()),
+        ('age_group', DICTIONARY),
+        ('driver_race', DICTIONARY),
+    ]),
+    'stops': pa.schema([
+        ('vehicle_number', pa.string()),
+        ('search_type', DICTIONARY),
+        ('stop_date', pa.date32()),
+        ('stop_time', pa.time32('s')),
+        ('stop_duration', DICTIONARY),
+        ('country_name', DICTIONARY),
+        ('drugs_related_stop', pa.bool_()),
+        ('search_conducted', pa.bool_()),
+        ('is_arrested', pa.bool_()),
+        ('stop_outcome', DICTIONARY),
+        ('added_by', DICTIONARY),
+    ]),
+    'violations': pa.schema([
+        ('vehicle_number', pa.string()),
+        ('violation_raw', DICTIONARY),
+        ('violation', DICTIONARY),
+    ]),
+}
+MANIFEST = 'manifest.json'
+WRITE_OPTIONS = pa.ipc.IpcWriteOptions(unify_dictionaries=True)
+
+
+def change_watermark(mediator):
+    # data_changes is stamped by the write triggers (see views.py). Without
+    # them, fall back to the cumulative row-change counters of the statistics
+    # collector, which are cheap to read but only approximately current.
+    mediator.execute("SELECT to_regclass('data_changes') IS NOT NULL;")
+    if mediator.fetchone()[0]:
+        mediator.execute("SELECT MAX(changed_at) FROM data_changes WHERE table_name = ANY(%s);",
+                         (list(SNAPSHOT_SCHEMAS),))
+        changed_at = mediator.fetchone()[0]
+        return changed_at.isoformat() if changed_at else None
+    mediator.execute("""
+        SELECT SUM(n_tup_ins + n_tup_upd + n_tup_del)
+        FROM pg_stat_user_tables
+        WHERE relname = ANY(%s) OR relname LIKE 'stops\\_%%';
+    """, (list(SNAPSHOT_SCHEMAS),))
+    return f"stats:{mediator.fetchone()[0] or 0}"
+
+
+def write_table(directory, name, table):
+    # Write next to the target and rename over it: readers that already mapped
+    # the old file keep it, new readers see the complete new one.
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.arrow.tmp')
+    os.close(fd)
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema, options=WRITE_OPTIONS) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, os.path.join(directory, f"{name}.arrow"))
+
+
+def write_manifest(directory, watermark, rows):
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.json.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump({'watermark': watermark, 'written_at': datetime.now().isoformat(), 'rows': rows}, f)
+    os.replace(tmp_path, os.path.join(directory, MANIFEST))
+
+
+def frame_to_table(name, df):
+    # Cleaned frames from main_check.clean_frame(); columns the frame doesn't
+    # have (stops.added_by) are left out.
+    schema = SNAPSHOT_SCHEMAS[name]
+    df = df.sort_values('vehicle_number', kind='stable')
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    return table.select(
+        [field.name for field in schema if field.name in df.columns]
+    ).cast(pa.schema([field for field in schema if field.name in df.columns]))
+
+
+def write_frames_snapshot(directory, df_drivers, df_stops, df_violations, watermark=None):
+    os.makedirs(directory, exist_ok=True)
+    start = time.perf_counter()
+    rows = {}
+    for name, df in (('drivers', df_drivers), ('stops', df_stops), ('violations', df_violations)):
+        table = frame_to_table(name, df)
+        write_table(directory, name, table)
+        rows[name] = table.num_rows
+    write_manifest(directory, watermark, rows)
+    print(f"Snapshot written to {directory} in {time.perf_counter() - start:.2f}s: {rows}")
+    return rows
+
+
+def dump_table(mediator, directory, name):
+    # COPY the table out sorted by vehicle_number (so pages are binary-searchable)
+    # into a temp CSV, then parse it straight into the Arrow schema, including
+    # the dictionary columns. Encoded columns are joined back to their text.
+    schema = SNAPSHOT_SCHEMAS[name]
+    select = decoded_select(name, schema.names, is_encoded(mediator))
+    fd, csv_path = tempfile.mkstemp(dir=directory, suffix='.csv.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            mediator.copy_expert(
+                f"COPY ({select} ORDER BY t.vehicle_number COLLATE \"C\"{', t.stop_date' if name == 'stops' else ''}) "
+                f"TO STDOUT WITH (FORMAT csv, HEADER)", f
+            )
+        return pa_csv.read_csv(csv_path, convert_options=pa_csv.ConvertOptions(
+            column_types={field.name: field.type for field in schema},
+            true_values=['t'], false_values=['f'],
+            strings_can_be_null=True,
+        ))
+    finally:
+        os.remove(csv_path)
+
+
+def write_database_snapshot(mediator, directory):
+    # The watermark is read before dumping, so a write that lands mid-dump
+    # makes the snapshot look stale and it is simply redone.
+    os.makedirs(directory, exist_ok=True)
+    start = time.perf_counter()
+    watermark = change_watermark(mediator)
+    rows = {}
+    for name in SNAPSHOT_SCHEMAS:
+        table = dump_table(mediator, directory, name)
+        write_table(directory, name, table)
+        rows[name] = table.num_rows
+    write_manifest(directory, watermark, rows)
+    print(f"Snapshot written to {directory} in {time.perf_counter() - start:.2f}s: {rows}")
+    return watermark
+
+
+def read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def snapshot_age(manifest):
+    # Seconds since the snapshot was written.
+    return (datetime.now() - datetime.fromisoformat(manifest['written_at'])).total_seconds()
+
+
+class ColumnView:
+    # Sequence view of a sorted Arrow column so bisect can binary-search it
+    # without converting the whole column to Python objects.
+    def __init__(self, column):
+        self.column = column
+
+    def __len__(self):
+        return len(self.column)
+
+    def __getitem__(self, index):
+        return self.column[index].as_py()
+
+
+class KeyView:
+    # (vehicle_number, stop_date) pairs of two columns, for bisect.
+    def __init__(self, vehicles, dates):
+        self.vehicles = ColumnView(vehicles)
+        self.dates = ColumnView(dates)
+
+    def __len__(self):
+        return len(self.vehicles)
+
+    def __getitem__(self, index):
+        return self.vehicles[index], self.dates[index]
+
+
+class Snapshot:
+    def __init__(self, directory):
+        self.directory = directory
+        self.tables = {}
+        self.manifest = None
+        self.load()
+
+    def load(self):
+        # Memory-map every table; nothing is read until a page touches it.
+        manifest = read_manifest(self.directory)
+        if manifest is None:
+            return False
+        tables = {}
+        for name in SNAPSHOT_SCHEMAS:
+            source = pa.memory_map(os.path.join(self.directory, f"{name}.arrow"))
+            tables[name] = pa.ipc.open_file(source).read_all()
+        self.tables, self.manifest = tables, manifest
+        return True
+
+    @property
+    def available(self):
+        return self.manifest is not None
+
+    @property
+    def watermark(self):
+        return self.manifest['watermark'] if self.manifest else None
+
+    @property
+    def written_at(self):
+        return self.manifest['written_at'] if self.manifest else None
+
+    def page(self, after=None, limit=100):
+        # Same contract as CheckPostAnalytics.get_stops_page: rows ordered by
+        # (vehicle_number, stop_date), strictly after `after`.
+        stops = self.tables['stops']
+        start = 0 if after is None else bisect.bisect_right(KeyView(stops['vehicle_number'], stops['stop_date']),
+                                                            tuple(after))
+        return stops.slice(start, limit).to_pandas()
+
+    def value_counts(self, table, column):
+        counts = pc.value_counts(pc.drop_null(self.tables[table][column]))
+        return [(str(item['values']), item['counts']) for item in counts.to_pylist()]
+
+    def summary(self):
+        # Same shape as CheckPostAnalytics.get_overview_summary.
+        stops = self.tables['stops']
+        outcomes = {label.lower(): count for label, count in self.value_counts('stops', 'stop_outcome')}
+        summary = {
+            'total_stops': stops.num_rows,
+            'total_arrests': outcomes.get('arrest', 0),
+            'total_warnings': outcomes.get('warning', 0),
+            'drug_related_stops': pc.sum(stops['drugs_related_stop']).as_py() or 0,
+            'violations': self.value_counts('violations', 'violation'),
+            'genders': self.value_counts('drivers', 'driver_gender'),
+        }
+        summary['violations'].sort(key=lambda item: item[1], reverse=True)
+        summary['genders'].sort(key=lambda item: item[1], reverse=True)
+        return summary
+
+
+class SnapshotRefresher(threading.Thread):
+    # Every `interval` seconds compare the database's change watermark with the
+    # snapshot's; when it moved, rewrite the snapshot (unless another process
+    # already has) and remap it. A rewrite dumps all three tables, so it waits
+    # until the snapshot on disk is `min_age` seconds old: steady single-stop
+    # submits cost one dump per min_age rather than one per interval.
+    def __init__(self, snapshot, cursor, interval=60, min_age=900):
+        super().__init__(daemon=True)
+        self.snapshot = snapshot
+        self.cursor = cursor  # context manager yielding a cursor, e.g. CheckPostAnalytics.cursor
+        self.interval = interval
+        self.min_age = min_age
+        self.stopped = threading.Event()
+
+    def refresh(self):
+        with self.cursor() as mediator:
+            watermark = change_watermark(mediator)
+            if watermark == self.snapshot.watermark:
+                return False
+            on_disk = read_manifest(self.snapshot.directory)
+            if on_disk is None or (on_disk['watermark'] != watermark and snapshot_age(on_disk) >= self.min_age):
+                write_database_snapshot(mediator, self.snapshot.directory)
+            elif on_disk['watermark'] == self.snapshot.watermark:
+                return False  # too recent to rewrite, and nothing newer to map
+        return self.snapshot.load()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Snapshot refresh failed: {e}")
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
@@ -1,413 +1,634 @@
+import threading
+import time
+import weakref
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
 import psycopg2
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
 from datetime import datetime
 
+from approximate import APPROXIMATE_QUERIES, estimate, sample_percent
+from backends import (EmbeddedCursor, connect, embedded_transaction, sample_clause, supports_grouping_sets,
+                      table_qualifier, transaction_scope)
+from cache import cache_key, cached
+from catalog import (ANALYTIC_METHODS, QUERY_CATALOG, SQL_TYPES, bind_params, canonical_arguments, numbered,
+                     positional)
+from encoding import Dictionary, dimension_literals, is_encoded
+from filters import FILTERS, apply_filters, filter_arguments, filter_shape, filter_types, split_filters
+from metrics import instrumented
+from partitions import is_partitioned
+from shared_scan import SHARED_SCAN_METHODS, SHARED_SCAN_QUERY, fan_out
+from views import MATERIALIZED_VIEWS, view_status
+
 
 class CheckPostAnalytics:
-    def __init__(self, host, port, user, password, database):
-        self.connection = psycopg2.connect(
-            host=host,
-            port=port,
-            user=user,
-            password=password,
-            database=database
-        )
-        self.connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-        self.mediator = self.connection.cursor()
-
-
-    def get_top_10_drug_related_vehicles(self):
-        query = """
-        SELECT vehicle_number
-        FROM stops
-        WHERE drugs_related_stop = TRUE
-        LIMIT 10;
-        """
-        self.mediator.execute(query)
-        return self.mediator.fetchall()
-    
-    def get_most_searched_vehicles(self):
-        query = """
-        SELECT vehicle_number, COUNT(*) AS search_count
-        FROM stops
-        WHERE search_conducted = TRUE
-        GROUP BY vehicle_number
-        ORDER BY search_count DESC
-        LIMIT 1;
-        """
-        self.mediator.execute(query)
-        return self.mediator.fetchall()
+    def __init__(self, host, port, user, password, database, pooled=False, minconn=1, maxconn=10, cache=None,
+                 materialized_views=False, metrics=None, backend='postgres'):
+        # backend='duckdb' / 'sqlite' opens the embedded database file `database`
+        # (see backends.py); host, port, user and password are then unused.
+        # Embedded backends use one connection and no materialized views.
+        self.backend = backend
+        embedded = backend != 'postgres'
+        pooled = pooled and not embedded
+        materialized_views = materialized_views and not embedded
+        self.pooled = pooled
+        self.cache = cache  # optional cache.QueryCache shared by the get_* methods
+        self.materialized_views = materialized_views
+        self.metrics = metrics  # optional metrics.Metrics; see @instrumented
+        self.fresh_views = set()
+        self.fresh_views_checked_at = 0.0
+        self.explain_plans = None  # set by explain() to capture plans instead of rows
+        self.prepared = weakref.WeakKeyDictionary()  # connection -> names of catalog statements PREPAREd on it
+        self.prepared_lock = threading.Lock()
+        if embedded:
+            self.connection = connect(backend, database)
+            self.mediator = EmbeddedCursor(self.connection, backend)
+            self.lock = threading.Lock()
+            self.maxconn = 1
+        elif pooled:
+            # Each call checks out its own connection + cursor. The semaphore makes
+            # callers wait for a free connection instead of getting a PoolError.
+            self.pool = ThreadedConnectionPool(
+                minconn, maxconn,
+                host=host,
+                port=port,
+                user=user,
+                password=password,
+                database=database
+            )
+            self.pool_slots = threading.BoundedSemaphore(maxconn)
+            self.maxconn = maxconn
+        else:
+            self.connection = psycopg2.connect(
+                host=host,
+                port=port,
+                user=user,
+                password=password,
+                database=database
+            )
+            self.connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            self.mediator = self.connection.cursor()
+            self.lock = threading.Lock()
+            self.maxconn = 1
 
-    def get_highest_arrest_rate_by_age_group(self):
-        query = """
-        SELECT 
-            d.age_group,
-            ROUND(
-                (COUNT(CASE WHEN s.is_arrested = TRUE THEN 1 END)::FLOAT / COUNT(*) * 100)::NUMERIC, 
-                2
-            ) AS arrest_rate
-        FROM drivers d
-        JOIN stops s ON d.vehicle_number = s.vehicle_number
-        GROUP BY d.age_group
-        ORDER BY arrest_rate DESC
-        LIMIT 1;
-        """
-        self.mediator.execute(query)
-        return self.mediator.fetchall()
+        # Encoded schema (see encoding.py): literals in queries are swapped for
+        # codes before they run, and code columns are decoded in the results.
+        # Partitioned stops (see partitions.py) are keyed by (vehicle_number,
+        # stop_date): a vehicle can have several stops.
+        encoded = self.partitioned = False
+        if not embedded:
+            with self.cursor() as mediator:
+                encoded = is_encoded(mediator)
+                self.partitioned = is_partitioned(mediator)
+        self.dictionary = Dictionary(self.cursor) if encoded else None
 
-    def get_gender_distribution_by_country(self):
-        query = """
-        SELECT 
-            s.country_name,
-            d.driver_gender,
-            COUNT(*) AS total_stops
-        FROM drivers d
-        JOIN stops s ON d.vehicle_number = s.vehicle_number
-        GROUP BY s.country_name, d.driver_gender
-        ORDER BY s.country_name, d.driver_gender;
-        """
-        self.mediator.execute(query)
-        return self.mediator.fetchall()
+    @contextmanager
+    def cursor(self, transaction=False):
+        # transaction=True runs everything issued on the cursor as one transaction
+        # (commit on success, rollback on error) instead of autocommitting each statement.
+        if not self.pooled:
+            with self.lock:
+                if self.backend != 'postgres':
+                    scope = embedded_transaction(self.mediator, transaction)
+                else:
+                    scope = transaction_scope(self.connection, transaction)
+                with scope:
+                    yield self.mediator
+            return
 
-    def get_race_gender_highest_search_rate(self):
-        query = """
-        SELECT 
-            d.driver_race,
-            d.driver_gender,
-            ROUND((
-                COUNT(CASE WHEN s.search_conducted = TRUE THEN 1 END)::FLOAT 
-                / COUNT(*) * 100)::NUMERIC, 2
-            ) AS search_rate_percent
-        FROM drivers d
-        JOIN stops s ON d.vehicle_number = s.vehicle_number
-        GROUP BY d.driver_race, d.driver_gender
-        ORDER BY search_rate_percent DESC
-        LIMIT 1;
-        """
-        self.mediator.execute(query)
-        return self.mediator.fetchall()
+        with self.pool_slots:
+            connection = self.pool.getconn()
+            try:
+                connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                with transaction_scope(connection, transaction):
+                    with connection.cursor() as mediator:
+                        yield mediator
+            finally:
+                self.pool.putconn(connection, close=bool(connection.closed))
 
-    def get_peak_traffic_stop_time(self):
-        query = """
-        SELECT 
-            CASE 
-                WHEN EXTRACT(HOUR FROM stop_time) BETWEEN 5 AND 11 THEN 'Morning'
-                WHEN EXTRACT(HOUR FROM stop_time) BETWEEN 12 AND 16 THEN 'Afternoon'
-                WHEN EXTRACT(HOUR FROM stop_time) BETWEEN 17 AND 20 THEN 'Evening'
-                ELSE 'Night'
-            END AS time_of_day,
-            COUNT(*) AS total_stops
-        FROM stops
-        GROUP BY time_of_day
-        ORDER BY total_stops DESC
-        LIMIT 1;
-        """
-        self.mediator.execute(query)
-        return self.mediator.fetchall()
+    def run_query(self, query, params=None, prepared=None, types=None):
+        # Rows and column names come from the same cursor, so concurrent
+        # sessions never see each other's description. `prepared` names a
+        # catalog statement to run through PREPARE/EXECUTE; params is then a
+        # dict and `types` maps each parameter to its SQL type.
+        # A prepared statement lives as long as its connection, so its
+        # literals are looked up in the dim_* tables on each EXECUTE rather
+        # than fixed to the codes known when it was PREPAREd.
+        if self.dictionary is not None:
+            query = dimension_literals(query) if prepared else self.dictionary.encode_literals(query)
+        if self.explain_plans is not None:
+            query = "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query
+        with self.cursor() as mediator:
+            start = time.perf_counter()
+            if prepared is None:
+                mediator.execute(query, params)
+            else:
+                names = self.prepare(mediator, prepared, query, types)
+                arguments = f" ({', '.join(['%s'] * len(names))})" if names else ""
+                mediator.execute(f"EXECUTE {prepared}{arguments};", [params[name] for name in names])
+            rows = mediator.fetchall()
+            db_seconds = time.perf_counter() - start
+            columns = [desc[0] for desc in mediator.description]
+        if self.metrics is not None:
+            self.metrics.note_query(db_seconds, rows)
+        if self.explain_plans is not None:
+            self.explain_plans.append(rows[0][0][0])
+        elif self.dictionary is not None:
+            rows = self.dictionary.decode_rows(rows, columns)
+        return rows, columns
 
-    def get_average_stop_duration_by_violation(self):
-        query = """
-        SELECT 
-            v.violation,
-            ROUND(AVG(
-                CASE s.stop_duration
-                    WHEN '<5 Min' THEN 3
-                    WHEN '6-15 Min' THEN 10
-                    WHEN '16-30 Min' THEN 23
-                    WHEN '30+ Min' THEN 35
-                END
-            ), 2) AS avg_duration_minutes
-        FROM stops s
-        JOIN violations v ON v.vehicle_number = s.vehicle_number
-        GROUP BY v.violation
-        ORDER BY avg_duration_minutes DESC;
-        """
-        self.mediator.execute(query)
-        return self.mediator.fetchall()
+    def prepare(self, mediator, name, query, types):
+        # PREPARE a catalog statement the first time it runs on this connection.
+        # Later EXECUTEs skip parsing and analysis, and once PostgreSQL settles
+        # on a generic plan, planning too. Returns the parameter order.
+        statement, names = numbered(query)
+        with self.prepared_lock:
+            prepared = self.prepared.setdefault(mediator.connection, set())
+        if name not in prepared:
+            declared = ", ".join(types[param] for param in names)
+            mediator.execute(f"PREPARE {name}{f' ({declared})' if declared else ''} AS {statement}")
+            prepared.add(name)
+        return names
 
-    def get_arrest_rate_by_time_of_day(self):
-        query = """
-        SELECT 
-            CASE 
-                WHEN EXTRACT(HOUR FROM stop_time) BETWEEN 5 AND 11 THEN 'Morning'
-                WHEN EXTRACT(HOUR FROM stop_time) BETWEEN 12 AND 16 THEN 'Afternoon'
-                WHEN EXTRACT(HOUR FROM stop_time) BETWEEN 17 AND 20 THEN 'Evening'
-                ELSE 'Night'
-            END AS time_of_day,
-            COUNT(*) AS total_stops,
-            COUNT(CASE WHEN is_arrested = TRUE THEN 1 END) AS total_arrests,
-            ROUND(
-                (COUNT(CASE WHEN is_arrested = TRUE THEN 1 END)::FLOAT / COUNT(*) * 100)::NUMERIC, 
-                2
-            ) AS arrest_rate_percent
-        FROM stops
-        GROUP BY time_of_day
-        ORDER BY arrest_rate_percent DESC;
-        """
-        self.mediator.execute(query)
-        return self.mediator.fetchall()
-    
-    def get_violation_search_arrest_stats(self):
-        query = """
-        SELECT 
-            v.violation, 
-            COUNT(*) AS incident_count
-        FROM violations v
-        JOIN stops s ON s.vehicle_number = v.vehicle_number 
-        WHERE s.search_conducted = TRUE OR s.is_arrested = TRUE
-        GROUP BY v.violation
-        ORDER BY incident_count DESC;
-        """
-        self.mediator.execute(query)
-        return self.mediator.fetchall()
-    
-    def get_common_violations_under_25(self):
-        query = """
-        SELECT 
-            v.violation, 
-            COUNT(*) AS violation_count
-        FROM violations v
-        JOIN drivers d ON d.vehicle_number = v.vehicle_number 
-        WHERE d.driver_age < 25
-        GROUP BY v.violation
-        ORDER BY violation_count DESC;
-        """
-        self.mediator.execute(query)
-        return self.mediator.fetchall()
-    
-    def get_rarely_flagged_violations(self):
-        query = """
-        SELECT 
-            v.violation,
-            COUNT(CASE WHEN s.search_conducted = TRUE OR s.is_arrested = TRUE THEN 1 END) AS search_or_arrest_count
-        FROM violations v
-        JOIN stops s ON v.vehicle_number = s.vehicle_number
-        GROUP BY v.violation
-        ORDER BY search_or_arrest_count ASC
-        LIMIT 1;
-        """
-        self.mediator.execute(query)
-        return self.mediator.fetchall()
+    def run_catalog(self, name, params, filters=None):
+        # One catalog analytic (see catalog.py). Materialized-view entries go
+        # through run_aggregate; the rest are prepared statements on
+        # PostgreSQL (one per set of active filters) and plain queries
+        # elsewhere (or under explain()).
+        entry = QUERY_CATALOG[name]
+        if 'view' in entry:
+            return self.run_aggregate(entry['view'], filters)
+        query, statement = entry['query'], name
+        types = {param: SQL_TYPES[kind] for param, (kind, _) in entry.get('params', {}).items()}
+        if filters:
+            query = apply_filters(query, filters, table_qualifier(self.backend))
+            params = dict(params, **self.filter_params(filters))
+            statement = f"{name}__f{filter_shape(filters)}"
+            types.update(filter_types(filters, self.dictionary is not None))
+        if self.backend != 'postgres' or self.explain_plans is not None:
+            query, names = positional(query)
+            return self.run_query(query, [params[param] for param in names])
+        return self.run_query(query, params, prepared=statement, types=types)
 
-    def get_country_with_highest_drug_related_rate(self):
-        query = """
-        SELECT 
-            country_name,
-            COUNT(*) AS total_stops,
-            COUNT(CASE WHEN drugs_related_stop = TRUE THEN 1 END) AS drug_related_count,
-            ROUND(
-                (COUNT(CASE WHEN drugs_related_stop = TRUE THEN 1 END)::FLOAT 
-                / COUNT(*) * 100)::NUMERIC, 2
-            ) AS drug_related_rate_percent
-        FROM stops
-        GROUP BY country_name
-        ORDER BY drug_related_rate_percent DESC
-        LIMIT 1;
-        """
-        self.mediator.execute(query)
-        return self.mediator.fetchall()
+    def filter_params(self, filters):
+        # Filter values as bound parameters: lists (arrays for psycopg2), of
+        # codes on the encoded schema.
+        params = {}
+        for key, value in filters.items():
+            column = FILTERS[key][1]
+            if isinstance(value, tuple):
+                value = list(value)
+                if self.dictionary is not None and column in self.dictionary.codes:
+                    value = self.dictionary.lookup(column, value)
+            params[key] = value
+        return params
+
+    def run_filtered(self, query, filters):
+        # A query without parameters of its own, under the global filters.
+        if not filters:
+            return self.run_query(query)
+        query, names = positional(apply_filters(query, filters, table_qualifier(self.backend)))
+        params = self.filter_params(filters)
+        return self.run_query(query, [params[name] for name in names])
+
+    def explain(self, method_name, *args):
+        # Run one analytics method under EXPLAIN (ANALYZE, BUFFERS) and return the
+        # JSON plan of every statement it issued. Bypasses the result cache.
+        cache, self.cache = self.cache, None
+        self.explain_plans = []
+        try:
+            getattr(self, method_name)(*args)
+            return self.explain_plans
+        finally:
+            self.cache = cache
+            self.explain_plans = None
+
+    def run_report(self, queries, max_workers=None, filters=None):
+        # Run several analytics at once, each on its own pooled connection, and
+        # yield (label, (rows, columns) or None, error or None, seconds) in the
+        # order they finish. Without a pool they still run, one at a time.
+        # Methods the shared scan covers wait for it and are then served from
+        # the cache it warmed, instead of each scanning on its own. `filters`
+        # (see filters.py) apply to every query.
+        filters = filters or {}
+
+        def timed(method):
+            start = time.perf_counter()
+            return method(**filters), time.perf_counter() - start
+
+        shared = {label: method for label, method in queries.items()
+                  if getattr(method, '__name__', None) in SHARED_SCAN_METHODS}
+        if self.cache is None or len(shared) < 2 or not supports_grouping_sets(self.backend):
+            shared = {}
+
+        # At most half the pool by default, so one report can't starve the
+        # other dashboard sessions of connections.
+        max_workers = max_workers or min(len(queries), self.maxconn // 2) or 1
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(timed, method): label
+                       for label, method in queries.items() if label not in shared}
+            if shared:
+                futures[executor.submit(self.run_shared_scan, **filters)] = None
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    label = futures.pop(future)
+                    if label is None:
+                        # If the scan failed, the methods simply run their own queries.
+                        for shared_label, method in shared.items():
+                            futures[executor.submit(timed, method)] = shared_label
+                        continue
+                    try:
+                        result, seconds = future.result()
+                        yield label, result, None, seconds
+                    except Exception as e:
+                        yield label, None, e, 0.0
+
+    @instrumented
+    def run_shared_scan(self, **filters):
+        # One GROUPING SETS pass (see shared_scan.py) for a whole family of
+        # methods. Each method's result is put in the cache under the same key
+        # @cached uses for a call with just these filters as arguments.
+        generation = self.cache.generation if self.cache is not None else None
+        filters = split_filters(filters)[0]
+        rows, columns = self.run_filtered(SHARED_SCAN_QUERY, filters)
+        results = fan_out(rows, columns)
+        if self.cache is not None:
+            for name, value in results.items():
+                self.cache.put(cache_key(name, (), filters), value, None, generation)
+        return results
+
+    def run_progressive(self, name, **kwargs):
+        # Yield (result, approximate) for one analytic: a sampled estimate
+        # first when approximate.py has one, then the exact result. With a
+        # pool the exact query starts first, in the background, and the
+        # estimate runs beside it; on a single connection they can only take
+        # turns, estimate first. No estimate when the exact result is already
+        # cached or the table isn't worth sampling (see get_sample_percent).
+        method = getattr(self, name)
+        if (name not in APPROXIMATE_QUERIES or self.get_sample_percent() is None
+                or (self.cache is not None and self.cache.get(
+                    cache_key(name, *canonical_arguments(name, (), kwargs)))[0])):
+            yield method(**kwargs), False
+            return
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            exact = executor.submit(method, **kwargs) if self.pooled else None
+            try:
+                approximate = self.get_approximate(name, **kwargs)
+            except Exception:
+                approximate = None  # no estimate; just wait for the exact result
+            if approximate is not None and not (exact and exact.done()):
+                yield approximate, True
+            yield exact.result() if exact else method(**kwargs), False
+
+    @instrumented
+    @cached(ttl=60)
+    def get_approximate(self, name, *args, **kwargs):
+        # Sampled estimate of a rate analytic, with 95% confidence intervals
+        # (see approximate.py). Takes the exact method's arguments and filters.
+        filters, kwargs = split_filters(kwargs)
+        params = bind_params(name, args, kwargs)
+        percent = self.get_sample_percent()
+        sample = sample_clause(self.backend, percent) if percent is not None else None
+        query, names = positional(apply_filters(APPROXIMATE_QUERIES[name]['query'], filters,
+                                                table_qualifier(self.backend), sample))
+        values = self.filter_params(filters)
+        rows, columns = self.run_query(query, [values[param] for param in names])
+        return estimate(name, rows, columns, params)
+
+    def get_sample_percent(self):
+        # Share of stops an estimate reads; None when sampling wouldn't pay
+        # (a small table) or there are no statistics to size the sample by.
+        rows = self.get_stop_row_estimate()
+        if not rows:
+            return None
+        percent = sample_percent(rows)
+        return percent if percent < 100 else None
+
+    @cached(ttl=3600)
+    def get_stop_row_estimate(self):
+        # Planner statistics on PostgreSQL (summed over the partitions), not a
+        # COUNT(*) over the table sampling is meant to avoid scanning. None
+        # for a table that has never been ANALYZEd (reltuples -1, or 0
+        # before PostgreSQL 14).
+        if self.backend != 'postgres':
+            rows, _ = self.run_query("SELECT COUNT(*) FROM stops;")
+            return rows[0][0]
+        rows, _ = self.run_query("""
+            SELECT (SUM(reltuples) FILTER (WHERE reltuples > 0))::BIGINT
+            FROM pg_class
+            WHERE relkind = 'r'
+              AND (oid = 'stops'::regclass
+                   OR oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = 'stops'::regclass));
+        """)
+        return rows[0][0]
+
+    def encode(self, column, value):
+        return self.dictionary.code(column, value) if self.dictionary is not None else value
+
+    def execute(self, query, params=None):
+        with self.cursor() as mediator:
+            mediator.execute(query, params)
+        self.invalidate_cache()
+
+    def invalidate_cache(self):
+        self.fresh_views_checked_at = 0.0
+        if self.cache is not None:
+            self.cache.invalidate()
 
-    def get_arrest_rate_by_country_violation(self):
+    def run_aggregate(self, view_name, filters=None):
+        # Read the materialized view when it is fresh, otherwise run its query live.
+        # Filters always run live, on the filtered CTEs (see filters.py); since
+        # they are inlined, a date range only scans the stops partitions inside it.
+        view = MATERIALIZED_VIEWS[view_name]
+        if filters:
+            return self.run_filtered(f"SELECT * FROM ({view['query']}) AS {view_name} {view['order_by']};", filters)
+        if self.materialized_views and view_name in self.get_fresh_views():
+            return self.run_query(f"SELECT * FROM {view_name} {view['order_by']};")
+        return self.run_query(f"SELECT * FROM ({view['query']}) AS {view_name} {view['order_by']};")
+
+    def get_fresh_views(self, max_age=5.0):
+        if time.monotonic() - self.fresh_views_checked_at > max_age:
+            try:
+                self.fresh_views = {status['view_name'] for status in self.get_view_status() if status['fresh']}
+            except psycopg2.Error:
+                self.fresh_views = set()
+            self.fresh_views_checked_at = time.monotonic()
+        return self.fresh_views
+
+    def get_view_status(self):
+        with self.cursor() as mediator:
+            return view_status(mediator)
+
+    def close(self):
+        if self.pooled:
+            self.pool.closeall()
+        else:
+            self.mediator.close()
+            self.connection.close()
+
+
+    @instrumented
+    @cached(key=filter_arguments)
+    def get_overview_summary(self, **filters):
+        # Key metrics plus both Overview histograms come out of the shared scan,
+        # which also warms the cache for the Deep Dive methods it covers.
+        if not supports_grouping_sets(self.backend):
+            return self.get_overview_summary_separately(split_filters(filters)[0])
+        return self.run_shared_scan(**filters)['get_overview_summary']
+
+    def get_overview_summary_separately(self, filters=None):
+        # For backends without GROUPING SETS (SQLite): one query per part.
+        rows, _ = self.run_filtered("""
+            SELECT
+                COUNT(*),
+                COUNT(*) FILTER (WHERE LOWER(stop_outcome) = 'arrest'),
+                COUNT(*) FILTER (WHERE LOWER(stop_outcome) = 'warning'),
+                COUNT(*) FILTER (WHERE drugs_related_stop = TRUE)
+            FROM stops;
+        """, filters)
+        total_stops, total_arrests, total_warnings, drug_related_stops = rows[0]
+        violations, _ = self.run_filtered("""
+            SELECT violation, COUNT(*) AS n FROM violations
+            WHERE violation IS NOT NULL GROUP BY violation ORDER BY n DESC;
+        """, filters)
+        genders, _ = self.run_filtered("""
+            SELECT driver_gender, COUNT(*) AS n FROM drivers
+            WHERE driver_gender IS NOT NULL GROUP BY driver_gender ORDER BY n DESC;
+        """, filters)
+        return {
+            'total_stops': total_stops,
+            'total_arrests': total_arrests,
+            'total_warnings': total_warnings,
+            'drug_related_stops': drug_related_stops,
+            'violations': [tuple(row) for row in violations],
+            'genders': [tuple(row) for row in genders],
+        }
+
+    @instrumented
+    def get_stops_page(self, after=None, limit=100, **filters):
+        # Keyset pagination on the primary key: each page is an index range scan,
+        # no matter how deep into the table it is. `after` is the
+        # (vehicle_number, stop_date) of the previous page's last row; only
+        # the partitioned schema, with several stops per vehicle, needs the date.
+        filters, _ = split_filters(filters)
+        if self.partitioned:
+            key, after_key = "vehicle_number, stop_date", "(vehicle_number, stop_date) > (%(after)s, %(after_date)s)"
+        else:
+            key, after_key = "vehicle_number", "vehicle_number > %(after)s"
+        if after is None:
+            query = f"SELECT * FROM stops ORDER BY {key} LIMIT %(limit)s;"
+        else:
+            query = f"SELECT * FROM stops WHERE {after_key} ORDER BY {key} LIMIT %(limit)s;"
+        after, after_date = after or (None, None)
+        params = dict(self.filter_params(filters), after=after, after_date=after_date, limit=limit)
+        query, names = positional(apply_filters(query, filters, table_qualifier(self.backend)) if filters else query)
+        return self.run_query(query, [params[name] for name in names])
+
+    @instrumented
+    def get_prediction_counts(self):
+        # Stop counts per feature combination and outcome/violation, the input
+        # for prediction.PredictionEngine.
         query = """
-        SELECT 
+        SELECT
             s.country_name,
-            v.violation,
-            ROUND(
-                (COUNT(CASE WHEN s.is_arrested = TRUE THEN 1 END)::FLOAT 
-                / COUNT(*) * 100)::NUMERIC, 2
-            ) AS arrest_rate_percent
-        FROM stops s
-        JOIN violations v ON s.vehicle_number = v.vehicle_number
-        GROUP BY s.country_name, v.violation
-        ORDER BY arrest_rate_percent DESC;
-        """
-        self.mediator.execute(query)
-        return self.mediator.fetchall()
-    
-    def get_country_with_most_search_stops(self):
-        query = """
-        SELECT 
-            country_name,
-            COUNT(*) AS search_conducted_count
-        FROM stops
-        WHERE search_conducted = TRUE
-        GROUP BY country_name
-        ORDER BY search_conducted_count DESC
-        LIMIT 1;
-        """
-        self.mediator.execute(query)
-        return self.mediator.fetchall()
-    
-    def get_yearly_stops_arrests_by_country(self):
-        query = """
-        SELECT 
-            country_name,
-            stop_year,
-            total_stops,
-            total_arrests,
-            ROUND(
-                ((total_arrests::FLOAT / total_stops) * 100)::NUMERIC, 2
-            ) AS arrest_rate_percent,
-            RANK() OVER (PARTITION BY stop_year ORDER BY total_arrests DESC) AS arrest_rank_in_year
-        FROM (
-            SELECT 
-                country_name,
-                EXTRACT(YEAR FROM stop_date)::INT AS stop_year,
-                COUNT(*) AS total_stops,
-                COUNT(CASE WHEN is_arrested = TRUE THEN 1 END) AS total_arrests
-            FROM stops
-            GROUP BY country_name, EXTRACT(YEAR FROM stop_date)
-        ) AS yearly_stats
-        ORDER BY stop_year, arrest_rank_in_year;
-        """
-        self.mediator.execute(query)
-        return self.mediator.fetchall()
-    
-    def get_violation_trends_by_age_race(self):
-        query = """
-        SELECT 
             d.age_group,
+            d.driver_gender,
             d.driver_race,
+            CASE
+                WHEN EXTRACT(HOUR FROM s.stop_time) BETWEEN 5 AND 11 THEN 'Morning'
+                WHEN EXTRACT(HOUR FROM s.stop_time) BETWEEN 12 AND 16 THEN 'Afternoon'
+                WHEN EXTRACT(HOUR FROM s.stop_time) BETWEEN 17 AND 20 THEN 'Evening'
+                ELSE 'Night'
+            END AS time_of_day,
+            s.search_conducted,
+            s.drugs_related_stop,
+            s.stop_outcome,
             v.violation,
-            COUNT(*) AS violation_count
-        FROM drivers d
-        JOIN (
-            SELECT 
-                vehicle_number,
-                violation
-            FROM violations
-            WHERE violation IS NOT NULL
-        ) v ON d.vehicle_number = v.vehicle_number
-        GROUP BY d.age_group, d.driver_race, v.violation
-        ORDER BY violation_count DESC;
-        """
-        self.mediator.execute(query)
-        return self.mediator.fetchall()
-    
-    def get_time_period_analysis_of_stops(self):
-        query = """
-        SELECT 
-            EXTRACT(YEAR FROM stop_date) AS year,
-            EXTRACT(MONTH FROM stop_date) AS month,
-            EXTRACT(HOUR FROM stop_time) AS hour,
-            COUNT(*) AS total_stops
-        FROM stops
-        GROUP BY year, month, hour
-        ORDER BY year, month, hour;
-        """
-        self.mediator.execute(query)
-        return self.mediator.fetchall()
-    
-    def get_high_search_arrest_violations(self):
-        query = """
-        SELECT 
-            v.violation,
-            ROUND(
-                (COUNT(CASE WHEN s.search_conducted = TRUE THEN 1 END)::FLOAT 
-                / COUNT(*) * 100)::NUMERIC, 2
-            ) AS search_rate_percent,
-
-            ROUND(
-                (COUNT(CASE WHEN s.is_arrested = TRUE THEN 1 END)::FLOAT 
-                / COUNT(*) * 100)::NUMERIC, 2
-            ) AS arrest_rate_percent,
-
-            RANK() OVER (ORDER BY 
-                COUNT(CASE WHEN s.search_conducted = TRUE THEN 1 END)::FLOAT 
-                / COUNT(*) DESC
-            ) AS search_rank,
-
-            RANK() OVER (ORDER BY 
-                COUNT(CASE WHEN s.is_arrested = TRUE THEN 1 END)::FLOAT 
-                / COUNT(*) DESC
-            ) AS arrest_rank
-
-        FROM violations v
-        JOIN stops s ON v.vehicle_number = s.vehicle_number
-        GROUP BY v.violation
-        ORDER BY search_rank, arrest_rank;
-        """
-        self.mediator.execute(query)
-        return self.mediator.fetchall()
-    
-    def get_driver_demographics_by_country(self):
-        query = """
-        SELECT 
-            s.country_name,
-            ROUND(AVG(d.driver_age), 1) AS avg_driver_age,
-            ROUND(
-                (COUNT(CASE WHEN d.driver_gender = 'M' THEN 1 END)::FLOAT 
-                / COUNT(*) * 100)::NUMERIC, 2
-            ) AS male_percentage,
-            ROUND(
-                (COUNT(CASE WHEN d.driver_gender = 'F' THEN 1 END)::FLOAT 
-                / COUNT(*) * 100)::NUMERIC, 2
-            ) AS female_percentage,
-            COUNT(DISTINCT d.driver_race) AS race_diversity
-        FROM drivers d
-        JOIN stops s ON d.vehicle_number = s.vehicle_number
-        GROUP BY s.country_name
-        ORDER BY avg_driver_age DESC;
-        """
-        self.mediator.execute(query)
-        return self.mediator.fetchall()
-    
-    def get_top_5_highest_arrest_violations(self):
-        query = """
-        SELECT 
-            v.violation,
-            COUNT(*) AS total_stops,
-            COUNT(CASE WHEN s.is_arrested = TRUE THEN 1 END) AS total_arrests,
-            ROUND(
-                (COUNT(CASE WHEN s.is_arrested = TRUE THEN 1 END)::FLOAT 
-                / COUNT(*) * 100)::NUMERIC, 2
-            ) AS arrest_rate_percent
-        FROM violations v
-        JOIN stops s ON v.vehicle_number = s.vehicle_number
-        GROUP BY v.violation
-        HAVING COUNT(*) > 0
-        ORDER BY arrest_rate_percent DESC
-        LIMIT 5;
+            COUNT(*) AS stops
+        FROM stops s
+        JOIN drivers d ON d.vehicle_number = s.vehicle_number
+        LEFT JOIN violations v ON v.vehicle_number = s.vehicle_number
+        GROUP BY 1, 2, 3, 4, 5, 6, 7, 8, 9;
         """
-        self.mediator.execute(query)
-        return self.mediator.fetchall()
-    
+        rows, _ = self.run_query(query)
+        return rows
+
+    @instrumented
+    @cached()
+    def get_filter_options(self):
+        # Choices for the global filters' multiselects.
+        options = {}
+        for key in ('countries', 'violations', 'age_groups'):
+            table, column, _ = FILTERS[key]
+            rows, _ = self.run_query(f"SELECT DISTINCT {column} FROM {table};")
+            options[key] = sorted(row[0] for row in rows if row[0] is not None)
+        return options
+
+    @instrumented
+    @cached()
     def get_all_violations(self):
-        self.mediator.execute("SELECT DISTINCT violation FROM violations ORDER BY violation;")
-        return [row[0] for row in self.mediator.fetchall()]
+        # Sorted here: on the encoded schema ORDER BY would sort by code.
+        rows, _ = self.run_query("SELECT DISTINCT violation FROM violations;")
+        return sorted(row[0] for row in rows if row[0] is not None)
     
     def validate_officer_credentials(self, username, password):
         query = """
             SELECT * FROM officers 
             WHERE username = %s AND password = %s
         """
-        self.mediator.execute(query, (username, password))
-        result = self.mediator.fetchone()
-        return result  
+        with self.cursor() as mediator:
+            mediator.execute(query, (username, password))
+            result = mediator.fetchone()
+        return result
 
     def insert_driver_data(self, vehicle_number, driver_gender, driver_age, age_group, driver_race):
         query = """
             INSERT INTO drivers (vehicle_number, driver_gender, driver_age, age_group, driver_race)
             VALUES (%s, %s, %s, %s, %s)
         """
-        values = (vehicle_number, driver_gender, driver_age, age_group, driver_race)
-        self.mediator.execute(query, values)
-        self.connection.commit()
+        values = (vehicle_number, driver_gender, driver_age, age_group, self.encode('driver_race', driver_race))
+        self.execute(query, values)
 
     def insert_stop_data(self, vehicle_number, stop_date, stop_time, stop_duration, country_name, drugs_related_stop, search_conducted, is_arrested, stop_outcome, added_by):
         query = """
             INSERT INTO stops (vehicle_number, stop_date, stop_time, stop_duration, country_name, drugs_related_stop, search_conducted, is_arrested, stop_outcome, added_by)
             VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
         """
-        values = (vehicle_number, stop_date, stop_time, stop_duration, country_name, drugs_related_stop, search_conducted, is_arrested, stop_outcome, added_by)
-        self.mediator.execute(query, values)
-        self.connection.commit()
+        values = (vehicle_number, stop_date, stop_time, self.encode('stop_duration', stop_duration),
+                  self.encode('country_name', country_name), drugs_related_stop, search_conducted, is_arrested,
+                  self.encode('stop_outcome', stop_outcome), added_by)
+        self.execute(query, values)
 
     def insert_violation_data(self, vehicle_number, violation_raw, violation):
         query = """
             INSERT INTO violations (vehicle_number, violation_raw, violation)
             VALUES (%s, %s, %s)
         """
-        values = (vehicle_number, violation_raw, violation)
-        self.mediator.execute(query, values)
-        self.connection.commit()
+        values = (vehicle_number, self.encode('violation_raw', violation_raw), self.encode('violation', violation))
+        self.execute(query, values)
+
+    def submit_stop(self, vehicle_number, driver_gender, driver_age, age_group, driver_race,
+                    stop_date, stop_time, stop_duration, country_name, drugs_related_stop,
+                    search_conducted, is_arrested, stop_outcome, added_by, violation_raw, violation):
+        # All three rows in one statement: one round trip, and the CTE chain runs
+        # as a single implicit transaction, so a failure leaves nothing behind.
+        query = """
+            WITH new_driver AS (
+                INSERT INTO drivers (vehicle_number, driver_gender, driver_age, age_group, driver_race)
+                VALUES (%s, %s, %s, %s, %s)
+                RETURNING vehicle_number
+            ), new_stop AS (
+                INSERT INTO stops (vehicle_number, stop_date, stop_time, stop_duration, country_name, drugs_related_stop, search_conducted, is_arrested, stop_outcome, added_by)
+                SELECT vehicle_number, %s, %s, %s, %s, %s, %s, %s, %s, %s
+                FROM new_driver
+                RETURNING vehicle_number
+            )
+            INSERT INTO violations (vehicle_number, violation_raw, violation)
+            SELECT vehicle_number, %s, %s
+            FROM new_stop
+        """
+        values = (vehicle_number, driver_gender, driver_age, age_group, self.encode('driver_race', driver_race),
+                  stop_date, stop_time, self.encode('stop_duration', stop_duration),
+                  self.encode('country_name', country_name), drugs_related_stop,
+                  search_conducted, is_arrested, self.encode('stop_outcome', stop_outcome), added_by,
+                  self.encode('violation_raw', violation_raw), self.encode('violation', violation))
+        if self.partitioned:
+            # A vehicle may be back for a new stop: its driver and violation
+            # rows are kept from the first one, as in submit_stops_batch.
+            query = """
+                WITH new_driver AS (
+                    INSERT INTO drivers (vehicle_number, driver_gender, driver_age, age_group, driver_race)
+                    VALUES (%s, %s, %s, %s, %s)
+                    ON CONFLICT (vehicle_number) DO NOTHING
+                ), new_stop AS (
+                    INSERT INTO stops (vehicle_number, stop_date, stop_time, stop_duration, country_name, drugs_related_stop, search_conducted, is_arrested, stop_outcome, added_by)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    RETURNING vehicle_number
+                )
+                INSERT INTO violations (vehicle_number, violation_raw, violation)
+                SELECT vehicle_number, %s, %s
+                FROM new_stop
+                ON CONFLICT (vehicle_number) DO NOTHING
+            """
+            values = values[:5] + values[:1] + values[5:]
+        if self.backend != 'postgres':
+            # DuckDB and SQLite have no data-modifying CTEs: three INSERTs in one transaction.
+            with self.cursor(transaction=True) as mediator:
+                mediator.execute("""
+                    INSERT INTO drivers (vehicle_number, driver_gender, driver_age, age_group, driver_race)
+                    VALUES (%s, %s, %s, %s, %s)
+                """, values[:5])
+                mediator.execute("""
+                    INSERT INTO stops (vehicle_number, stop_date, stop_time, stop_duration, country_name, drugs_related_stop, search_conducted, is_arrested, stop_outcome, added_by)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """, values[:1] + values[5:14])
+                mediator.execute("""
+                    INSERT INTO violations (vehicle_number, violation_raw, violation)
+                    VALUES (%s, %s, %s)
+                """, values[:1] + values[14:])
+            self.invalidate_cache()
+            return
+        self.execute(query, values)
+
+    def submit_stops_batch(self, df_drivers, df_stops, df_violations, added_by):
+        # One transaction with multi-row INSERTs (execute_values). Vehicle numbers
+        # already on file are skipped and returned so they can be reported per row.
+        def rows(df):
+            return list(df.astype(object).where(df.notna(), None).itertuples(index=False, name=None))
+
+        # Encoded before the transaction opens: new dimension values are
+        # committed on their own, which is harmless if the batch rolls back.
+        if self.dictionary is not None:
+            df_drivers, df_stops, df_violations = (self.dictionary.encode_frame(df)
+                                                   for df in (df_drivers, df_stops, df_violations))
+
+        with self.cursor(transaction=True) as mediator:
+            vehicles = (list(df_drivers['vehicle_number']),)
+            mediator.execute("SELECT vehicle_number FROM drivers WHERE vehicle_number = ANY(%s);", vehicles)
+            existing = known_drivers = {row[0] for row in mediator.fetchall()}
+            known_violations = existing
+            if self.partitioned:
+                # A known vehicle may be back for a new stop: only a stop with
+                # the same date is already on file; its driver and violation
+                # rows are kept from the first stop.
+                mediator.execute("SELECT vehicle_number, stop_date FROM stops WHERE vehicle_number = ANY(%s);", vehicles)
+                on_file = set(mediator.fetchall())
+                existing = {vehicle for vehicle, day in zip(df_stops['vehicle_number'], df_stops['stop_date'].dt.date)
+                            if (vehicle, day) in on_file}
+                mediator.execute("SELECT vehicle_number FROM violations WHERE vehicle_number = ANY(%s);", vehicles)
+                known_violations = {row[0] for row in mediator.fetchall()} | existing
+
+            df_drivers = df_drivers[~df_drivers['vehicle_number'].isin(known_drivers)]
+            df_stops = df_stops[~df_stops['vehicle_number'].isin(existing)].assign(added_by=added_by)
+            df_violations = df_violations[~df_violations['vehicle_number'].isin(known_violations)]
+
+            for table, df in (('drivers', df_drivers), ('stops', df_stops), ('violations', df_violations)):
+                if self.backend != 'postgres':
+                    mediator.executemany(f"INSERT INTO {table} ({', '.join(df.columns)}) "
+                                         f"VALUES ({', '.join(['%s'] * len(df.columns))})", rows(df))
+                    continue
+                execute_values(mediator,
+                               f"INSERT INTO {table} ({', '.join(df.columns)}) VALUES %s",
+                               rows(df), page_size=1000)
+        self.invalidate_cache()
+        return sorted(existing)
+
+
+def catalog_method(name, entry):
+    def method(self, *args, **kwargs):
+        filters, kwargs = split_filters(kwargs)
+        return self.run_catalog(name, bind_params(name, args, kwargs), filters)
+    def key(args, kwargs):
+        return canonical_arguments(name, args, kwargs)
+
+    method.__name__ = method.__qualname__ = name
+    return instrumented(cached(ttl=entry.get('ttl'), key=key)(method))
+
+
+# The Deep Dive methods, generated from the catalog.
+for catalog_name, catalog_entry in QUERY_CATALOG.items():
+    setattr(CheckPostAnalytics, catalog_name, catalog_method(catalog_name, catalog_entry))
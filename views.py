@@ -0,0 +1,303 @@
+import threading
+import time
+
+# Heavy CheckPostAnalytics aggregates that can be served from materialized views.
+# 'query' is the aggregate without ORDER BY; 'unique' is the unique index that
+# REFRESH MATERIALIZED VIEW CONCURRENTLY needs.
+MATERIALIZED_VIEWS = {
+    'mv_gender_distribution_by_country': {
+        'query': """
+        SELECT
+            s.country_name,
+            d.driver_gender,
+            COUNT(*) AS total_stops
+        FROM drivers d
+        JOIN stops s ON d.vehicle_number = s.vehicle_number
+        GROUP BY s.country_name, d.driver_gender
+        """,
+        'order_by': "ORDER BY country_name, driver_gender",
+        'unique': ['country_name', 'driver_gender'],
+    },
+    'mv_average_stop_duration_by_violation': {
+        'query': """
+        SELECT
+            v.violation,
+            ROUND(AVG(
+                CASE s.stop_duration
+                    WHEN '<5 Min' THEN 3
+                    WHEN '6-15 Min' THEN 10
+                    WHEN '16-30 Min' THEN 23
+                    WHEN '30+ Min' THEN 35
+                END
+            ), 2) AS avg_duration_minutes
+        FROM stops s
+        JOIN violations v ON v.vehicle_number = s.vehicle_number
+        GROUP BY v.violation
+        """,
+        'order_by': "ORDER BY avg_duration_minutes DESC",
+        'unique': ['violation'],
+    },
+    'mv_arrest_rate_by_country_violation': {
+        'query': """
+        SELECT
+            s.country_name,
+            v.violation,
+            ROUND(
+                (COUNT(CASE WHEN s.is_arrested = TRUE THEN 1 END)::FLOAT
+                / COUNT(*) * 100)::NUMERIC, 2
+            ) AS arrest_rate_percent
+        FROM stops s
+        JOIN violations v ON s.vehicle_number = v.vehicle_number
+        GROUP BY s.country_name, v.violation
+        """,
+        'order_by': "ORDER BY arrest_rate_percent DESC",
+        'unique': ['country_name', 'violation'],
+    },
+    'mv_yearly_stops_arrests_by_country': {
+        'query': """
+        SELECT
+            country_name,
+            stop_year,
+            total_stops,
+            total_arrests,
+            ROUND(
+                ((total_arrests::FLOAT / total_stops) * 100)::NUMERIC, 2
+            ) AS arrest_rate_percent,
+            RANK() OVER (PARTITION BY stop_year ORDER BY total_arrests DESC) AS arrest_rank_in_year
+        FROM (
+            SELECT
+                country_name,
+                EXTRACT(YEAR FROM stop_date)::INT AS stop_year,
+                COUNT(*) AS total_stops,
+                COUNT(CASE WHEN is_arrested = TRUE THEN 1 END) AS total_arrests
+            FROM stops
+            GROUP BY country_name, EXTRACT(YEAR FROM stop_date)
+        ) AS yearly_stats
+        """,
+        'order_by': "ORDER BY stop_year, arrest_rank_in_year",
+        'unique': ['country_name', 'stop_year'],
+    },
+    'mv_violation_trends_by_age_race': {
+        'query': """
+        SELECT
+            d.age_group,
+            d.driver_race,
+            v.violation,
+            COUNT(*) AS violation_count
+        FROM drivers d
+        JOIN (
+            SELECT
+                vehicle_number,
+                violation
+            FROM violations
+            WHERE violation IS NOT NULL
+        ) v ON d.vehicle_number = v.vehicle_number
+        GROUP BY d.age_group, d.driver_race, v.violation
+        """,
+        'order_by': "ORDER BY violation_count DESC",
+        'unique': ['age_group', 'driver_race', 'violation'],
+    },
+    'mv_time_period_analysis_of_stops': {
+        'query': """
+        SELECT
+            EXTRACT(YEAR FROM stop_date) AS year,
+            EXTRACT(MONTH FROM stop_date) AS month,
+            EXTRACT(HOUR FROM stop_time) AS hour,
+            COUNT(*) AS total_stops
+        FROM stops
+        GROUP BY year, month, hour
+        """,
+        'order_by': "ORDER BY year, month, hour",
+        'unique': ['year', 'month', 'hour'],
+    },
+    'mv_high_search_arrest_violations': {
+        'query': """
+        SELECT
+            v.violation,
+            ROUND(
+                (COUNT(CASE WHEN s.search_conducted = TRUE THEN 1 END)::FLOAT
+                / COUNT(*) * 100)::NUMERIC, 2
+            ) AS search_rate_percent,
+
+            ROUND(
+                (COUNT(CASE WHEN s.is_arrested = TRUE THEN 1 END)::FLOAT
+                / COUNT(*) * 100)::NUMERIC, 2
+            ) AS arrest_rate_percent,
+
+            RANK() OVER (ORDER BY
+                COUNT(CASE WHEN s.search_conducted = TRUE THEN 1 END)::FLOAT
+                / COUNT(*) DESC
+            ) AS search_rank,
+
+            RANK() OVER (ORDER BY
+                COUNT(CASE WHEN s.is_arrested = TRUE THEN 1 END)::FLOAT
+                / COUNT(*) DESC
+            ) AS arrest_rank
+
+        FROM violations v
+        JOIN stops s ON v.vehicle_number = s.vehicle_number
+        GROUP BY v.violation
+        """,
+        'order_by': "ORDER BY search_rank, arrest_rank",
+        'unique': ['violation'],
+    },
+    'mv_driver_demographics_by_country': {
+        'query': """
+        SELECT
+            s.country_name,
+            ROUND(AVG(d.driver_age), 1) AS avg_driver_age,
+            ROUND(
+                (COUNT(CASE WHEN d.driver_gender = 'M' THEN 1 END)::FLOAT
+                / COUNT(*) * 100)::NUMERIC, 2
+            ) AS male_percentage,
+            ROUND(
+                (COUNT(CASE WHEN d.driver_gender = 'F' THEN 1 END)::FLOAT
+                / COUNT(*) * 100)::NUMERIC, 2
+            ) AS female_percentage,
+            COUNT(DISTINCT d.driver_race) AS race_diversity
+        FROM drivers d
+        JOIN stops s ON d.vehicle_number = s.vehicle_number
+        GROUP BY s.country_name
+        """,
+        'order_by': "ORDER BY avg_driver_age DESC",
+        'unique': ['country_name'],
+    },
+}
+
+SOURCE_TABLES = ['drivers', 'stops', 'violations']
+
+
+def create_materialized_views(mediator, rewrite=None):
+    # Change tracking: a statement trigger stamps data_changes on every write
+    # (including COPY), which is what view freshness is measured against.
+    # The log is insert-only and read with MAX(), so concurrent writers never
+    # wait on one another's row; prune_data_changes() keeps it short.
+    # `rewrite` adapts the view queries to the encoded schema (see encoding.py).
+    mediator.execute("""
+        CREATE TABLE IF NOT EXISTS data_changes (
+            table_name TEXT NOT NULL,
+            changed_at TIMESTAMPTZ NOT NULL
+        );
+    """)
+    # Databases set up with the earlier one-row-per-table layout.
+    mediator.execute("ALTER TABLE data_changes DROP CONSTRAINT IF EXISTS data_changes_pkey;")
+    mediator.execute("CREATE INDEX IF NOT EXISTS data_changes_table_time ON data_changes (table_name, changed_at);")
+    mediator.execute("""
+        CREATE TABLE IF NOT EXISTS mv_refresh_log (
+            view_name TEXT PRIMARY KEY,
+            refreshed_at TIMESTAMPTZ NOT NULL,
+            duration_ms DOUBLE PRECISION NOT NULL
+        );
+    """)
+    mediator.execute("""
+        CREATE OR REPLACE FUNCTION note_data_change() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO data_changes (table_name, changed_at)
+            VALUES (TG_TABLE_NAME, clock_timestamp());
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+    for table in SOURCE_TABLES:
+        mediator.execute(f"DROP TRIGGER IF EXISTS {table}_data_change ON {table};")
+        mediator.execute(f"""
+            CREATE TRIGGER {table}_data_change
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+            FOR EACH STATEMENT EXECUTE FUNCTION note_data_change();
+        """)
+
+    for name, view in MATERIALIZED_VIEWS.items():
+        query = rewrite(view['query']) if rewrite else view['query']
+        mediator.execute(f"CREATE MATERIALIZED VIEW IF NOT EXISTS {name} AS {query} WITH NO DATA;")
+        mediator.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {name}_key ON {name} ({', '.join(view['unique'])});")
+        print(f"MATERIALIZED VIEW '{name}' created.")
+
+
+def refresh_view(mediator, name, concurrently=True):
+    # CONCURRENTLY keeps the view readable during the refresh, but only works
+    # once the view has been populated.
+    mediator.execute("SELECT ispopulated FROM pg_matviews WHERE matviewname = %s;", (name,))
+    populated = mediator.fetchone()[0]
+    mode = "CONCURRENTLY " if concurrently and populated else ""
+
+    mediator.execute("SELECT clock_timestamp();")
+    started_at = mediator.fetchone()[0]
+    start = time.perf_counter()
+    mediator.execute(f"REFRESH MATERIALIZED VIEW {mode}{name};")
+    duration_ms = (time.perf_counter() - start) * 1000
+
+    mediator.execute("""
+        INSERT INTO mv_refresh_log (view_name, refreshed_at, duration_ms)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (view_name) DO UPDATE
+        SET refreshed_at = EXCLUDED.refreshed_at, duration_ms = EXCLUDED.duration_ms;
+    """, (name, started_at, duration_ms))
+    print(f"Refreshed {name} {mode.strip().lower() or 'fully'} in {duration_ms:.0f} ms.")
+    return duration_ms
+
+
+VIEW_STATUS_QUERY = """
+    SELECT
+        m.matviewname AS view_name,
+        m.ispopulated AS populated,
+        l.refreshed_at,
+        l.duration_ms,
+        c.last_change,
+        (l.refreshed_at IS NOT NULL AND m.ispopulated
+         AND (c.last_change IS NULL OR c.last_change <= l.refreshed_at)) AS fresh,
+        CASE WHEN l.refreshed_at IS NULL OR NOT m.ispopulated THEN NULL  -- never refreshed
+             WHEN c.last_change > l.refreshed_at
+             THEN EXTRACT(EPOCH FROM clock_timestamp() - l.refreshed_at)
+             ELSE 0 END AS staleness_seconds
+    FROM pg_matviews m
+    LEFT JOIN mv_refresh_log l ON l.view_name = m.matviewname
+    CROSS JOIN (SELECT MAX(changed_at) AS last_change FROM data_changes) c
+    WHERE m.matviewname = ANY(%s)
+    ORDER BY m.matviewname;
+"""
+
+
+def view_status(mediator):
+    mediator.execute(VIEW_STATUS_QUERY, (list(MATERIALIZED_VIEWS),))
+    columns = [desc[0] for desc in mediator.description]
+    return [dict(zip(columns, row)) for row in mediator.fetchall()]
+
+
+def refresh_stale_views(mediator, concurrently=True):
+    refreshed = []
+    for status in view_status(mediator):
+        if not status['fresh']:
+            refresh_view(mediator, status['view_name'], concurrently)
+            refreshed.append(status['view_name'])
+    prune_data_changes(mediator)
+    return refreshed
+
+
+def prune_data_changes(mediator):
+    # Only the latest stamp per table is ever read.
+    mediator.execute("""
+        DELETE FROM data_changes d
+        WHERE changed_at < (SELECT MAX(changed_at) FROM data_changes WHERE table_name = d.table_name);
+    """)
+
+
+class ViewRefresher(threading.Thread):
+    # Background scheduler: every `interval` seconds refresh whichever views
+    # have fallen behind data_changes.
+    def __init__(self, mediator, interval=300, concurrently=True):
+        super().__init__(daemon=True)
+        self.mediator = mediator
+        self.interval = interval
+        self.concurrently = concurrently
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                refresh_stale_views(self.mediator, self.concurrently)
+            except Exception as e:
+                print(f"View refresh failed: {e}")
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()